@@ -0,0 +1,281 @@
+# Tablas planas (pandas) de ideas, mensajes y llamadas para reportar entre talentos y campañas
+# sin recorrer a mano perfiles → temas → ideas. Se arman leyendo el almacén por páginas y se
+# escriben en Parquet por trozos, particionadas por perfil (carpetas profile_id=...), para que
+# las agregaciones de la vista de analítica trabajen sobre datos en columnas.
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from factory import SCRIPT_TARGET_SECONDS, script_metrics, script_variants
+from metrics import recorder
+
+# Filas que se acumulan antes de escribir un trozo (row group) del Parquet
+CHUNK_ROWS = 2000
+# Partición de las llamadas sin perfil (resúmenes, pruebas)
+NO_PROFILE = "sin_perfil"
+MANIFEST = "manifest.json"
+# Cortes del histograma de duración de los guiones (segundos hablados)
+DURATION_BINS = (0, 15, 30, 45, 50, 60, 90, float("inf"))
+
+if pa is not None:
+    SCHEMAS = {
+        "ideas": pa.schema([
+            ("profile_name", pa.string()),
+            ("topic_id", pa.string()),
+            ("topic_name", pa.string()),
+            ("idea_id", pa.string()),
+            ("position", pa.int64()),
+            ("titulo", pa.string()),
+            ("pilar", pa.string()),
+            ("has_script", pa.bool_()),
+            ("has_draft", pa.bool_()),
+            ("variants", pa.int64()),
+            ("script_words", pa.int64()),
+            ("script_seconds", pa.float64())
+        ]),
+        "messages": pa.schema([
+            ("profile_name", pa.string()),
+            ("seq", pa.int64()),
+            ("role", pa.string()),
+            ("content", pa.string()),
+            ("words", pa.int64())
+        ]),
+        "calls": pa.schema([
+            ("ts", pa.float64()),
+            ("stage", pa.string()),
+            ("model", pa.string()),
+            ("topic_id", pa.string()),
+            ("latency", pa.float64()),
+            ("ttft", pa.float64()),
+            ("prompt_tokens", pa.int64()),
+            ("completion_tokens", pa.int64()),
+            ("cached_tokens", pa.int64()),
+            ("cost", pa.float64()),
+            ("cached", pa.bool_()),
+            ("error", pa.string())
+        ])
+    }
+TABLES = ("ideas", "messages", "calls")
+# Columnas de cada tabla (sin profile_id, que va en la carpeta de la partición)
+COLUMNS = {
+    "ideas": ["profile_name", "topic_id", "topic_name", "idea_id", "position", "titulo", "pilar", "has_script", "has_draft", "variants", "script_words", "script_seconds"],
+    "messages": ["profile_name", "seq", "role", "content", "words"],
+    "calls": ["ts", "stage", "model", "topic_id", "latency", "ttft", "prompt_tokens", "completion_tokens", "cached_tokens", "cost", "cached", "error"]
+}
+
+
+def parquet_available():
+    return pq is not None
+
+
+def flatten(records):
+    # (tabla, profile_id, fila) por cada mensaje e idea de los registros de store.iter_records()
+    profiles, topics, seqs, positions = {}, {}, {}, {}
+    for record in records:
+        kind = record['type']
+        if kind == "profile":
+            profiles[record['id']] = record['name']
+        elif kind == "topic":
+            topics[record['id']] = (record['profile_id'], record['name'])
+        elif kind == "message":
+            pid = record['profile_id']
+            seqs[pid] = seqs.get(pid, -1) + 1
+            yield "messages", pid, {
+                "profile_name": profiles.get(pid),
+                "seq": seqs[pid],
+                "role": record['role'],
+                "content": record['content'],
+                "words": len(record['content'].split())
+            }
+        elif kind == "idea":
+            pid, topic_name = topics[record['topic_id']]
+            idea = record['idea']
+            positions[record['topic_id']] = positions.get(record['topic_id'], -1) + 1
+            metrics = script_metrics(idea['script']) if idea.get('script') else None
+            yield "ideas", pid, {
+                "profile_name": profiles.get(pid),
+                "topic_id": record['topic_id'],
+                "topic_name": topic_name,
+                "idea_id": idea['id'],
+                "position": positions[record['topic_id']],
+                "titulo": idea['titulo'],
+                "pilar": idea.get('pilar'),
+                "has_script": bool(idea.get('script')),
+                "has_draft": bool(idea.get('draft')) and not idea.get('script'),
+                "variants": len(script_variants(idea)),
+                "script_words": metrics['words'] if metrics else None,
+                "script_seconds": metrics['seconds'] if metrics else None
+            }
+
+
+def call_rows(since=0.0):
+    # Llamadas registradas en memoria por metrics.recorder después de `since`
+    for record in recorder.snapshot("call"):
+        if record['ts'] > since:
+            yield "calls", record.get('profile_id') or NO_PROFILE, {column: record.get(column) for column in COLUMNS["calls"]}
+
+
+def build_tables(store):
+    # Las mismas tablas en memoria (sin Parquet), con profile_id como columna
+    rows = {table: [] for table in TABLES}
+    for table, pid, row in [*flatten(store.iter_records()), *call_rows()]:
+        rows[table].append(dict(row, profile_id=pid))
+    return {table: pd.DataFrame(rows[table], columns=["profile_id", *COLUMNS[table]]) for table in TABLES}
+
+
+class PartitionedWriter:
+    # Escribe filas en root/<tabla>/profile_id=<id>/<archivo>.parquet por trozos de CHUNK_ROWS
+    def __init__(self, root, file_name):
+        self.root = root
+        self.file_name = file_name
+        self.buffers = {}
+        self.writers = {}
+        self.rows = 0
+
+    def add(self, table, pid, row):
+        buffer = self.buffers.setdefault((table, pid), [])
+        buffer.append(row)
+        self.rows += 1
+        if len(buffer) >= CHUNK_ROWS:
+            self._flush(table, pid)
+
+    def _flush(self, table, pid):
+        buffer = self.buffers.pop((table, pid), [])
+        if not buffer:
+            return
+        writer = self.writers.get((table, pid))
+        if writer is None:
+            folder = os.path.join(self.root, table, f"profile_id={pid}")
+            os.makedirs(folder, exist_ok=True)
+            writer = self.writers[(table, pid)] = pq.ParquetWriter(os.path.join(folder, self.file_name), SCHEMAS[table])
+        frame = pd.DataFrame(buffer, columns=COLUMNS[table])
+        writer.write_table(pa.Table.from_pandas(frame, schema=SCHEMAS[table], preserve_index=False))
+
+    def close(self):
+        for table, pid in list(self.buffers):
+            self._flush(table, pid)
+        for writer in self.writers.values():
+            writer.close()
+
+
+def read_manifest(root):
+    try:
+        with open(os.path.join(root, MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def export_parquet(store, root, progress=None):
+    # Ideas y mensajes se reescriben enteros; las llamadas se agregan: solo las registradas desde
+    # la exportación anterior. Todo se escribe primero en una carpeta temporal y solo pasa a root
+    # al final, junto con el manifiesto: si algo falla antes, no queda ningún archivo de llamadas
+    # nuevo y la siguiente exportación no las duplica. progress(filas) se llama a cada trozo
+    # escrito. Devuelve el manifiesto.
+    if pq is None:
+        raise RuntimeError("Para escribir Parquet hace falta pyarrow (pip install pyarrow).")
+    manifest = read_manifest(root)
+    started = time.time()
+    staging = os.path.join(root, f".staging-{int(started * 1000)}")
+    calls_file = f"part-{int(started * 1000)}.parquet"
+    writer = PartitionedWriter(staging, "part-0.parquet")
+    calls = PartitionedWriter(staging, calls_file)
+    moved = []
+    temporary = None
+    try:
+        try:
+            for table, pid, row in flatten(store.iter_records()):
+                writer.add(table, pid, row)
+                if progress and writer.rows % CHUNK_ROWS == 0:
+                    progress(writer.rows)
+            calls_until = manifest.get('calls_until', 0.0)
+            for table, pid, row in call_rows(calls_until):
+                calls.add(table, pid, row)
+                calls_until = max(calls_until, row['ts'])
+        finally:
+            writer.close()
+            calls.close()
+        for table in ("ideas", "messages"):
+            target = os.path.join(root, table)
+            shutil.rmtree(target, ignore_errors=True)
+            if os.path.isdir(os.path.join(staging, table)):
+                os.replace(os.path.join(staging, table), target)
+        for table, pid in calls.writers:
+            folder = os.path.join(root, table, f"profile_id={pid}")
+            os.makedirs(folder, exist_ok=True)
+            os.replace(os.path.join(staging, table, f"profile_id={pid}", calls_file), os.path.join(folder, calls_file))
+            moved.append(os.path.join(folder, calls_file))
+        manifest = {
+            "exported_at": started,
+            "calls_until": calls_until,
+            "rows": writer.rows,
+            "call_rows": manifest.get('call_rows', 0) + calls.rows
+        }
+        # Nombre único: dos exportaciones a la vez no se pisan el archivo antes de renombrarlo
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=root, prefix=f".{MANIFEST}-", suffix=".tmp", delete=False) as f:
+            temporary = f.name
+            json.dump(manifest, f)
+        os.replace(temporary, os.path.join(root, MANIFEST))
+    except BaseException:
+        # Sin manifiesto nuevo, las llamadas ya movidas se volverían a exportar la próxima vez
+        for path in [*moved, temporary]:
+            if path and os.path.exists(path):
+                os.remove(path)
+        raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return manifest
+
+
+def load_tables(root):
+    # Tablas leídas del Parquet (la partición vuelve como columna profile_id)
+    tables = {}
+    for table in TABLES:
+        folder = os.path.join(root, table)
+        if os.path.isdir(folder) and any(os.scandir(folder)):
+            frame = pd.read_parquet(folder)
+            frame['profile_id'] = frame['profile_id'].astype(str)
+            tables[table] = frame
+        else:
+            tables[table] = pd.DataFrame(columns=["profile_id", *COLUMNS[table]])
+    return tables
+
+
+# Agregaciones de la vista de analítica (vectorizadas sobre las tablas)
+def pillar_mix(ideas):
+    # Proporción de ideas de cada pilar por talento
+    if ideas.empty:
+        return pd.DataFrame()
+    return pd.crosstab(ideas['profile_name'], ideas['pilar'], normalize="index")
+
+
+def coverage(ideas):
+    # Ideas, guiones y borradores por talento y tema
+    if ideas.empty:
+        return pd.DataFrame(columns=["profile_name", "topic_name", "ideas", "with_script", "with_draft", "coverage"])
+    table = ideas.groupby(["profile_name", "topic_name"], as_index=False).agg(
+        ideas=("idea_id", "size"),
+        with_script=("has_script", "sum"),
+        with_draft=("has_draft", "sum")
+    )
+    table['coverage'] = table['with_script'] / table['ideas']
+    return table
+
+
+def script_length_distribution(ideas, target_seconds=SCRIPT_TARGET_SECONDS):
+    # Guiones por tramo de duración hablada estimada, y cuántos se pasan del objetivo
+    seconds = ideas.loc[ideas['has_script'].astype(bool), 'script_seconds'].astype(float)
+    bins = pd.cut(seconds, DURATION_BINS, right=False)
+    counts = bins.value_counts(sort=False)
+    counts.index = [f"{int(b.left)}–{'∞' if b.right == float('inf') else int(b.right)} s" for b in counts.index]
+    return counts, int((seconds > target_seconds).sum()), seconds.describe()
@@ -1,7 +1,41 @@
 import streamlit as st
-from openai import OpenAI
+from streamlit.errors import StreamlitAPIException
+import functools
 import json
+import os
+import threading
+import time
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, wait
+from storage import FactoryStore
+from clients import default_registry, key_id
+from gateway import default_gateway
+from llm_cache import CompletionCache
+from metrics import STAGE_CHAT, STAGE_DNA_EXTRACTION, STAGE_SCRIPT, STAGE_SCRIPT_PREFETCH, STAGE_SUMMARY, recorder
+from factory import (
+    DEFAULT_MODEL, DEFAULT_PROMPTS, DEFAULT_SCRIPT_WORKERS, MAX_SCRIPT_VARIANTS, MORE_IDEAS_COUNT, add_script_variants, build_script_prompt,
+    chat_completion, merge_dna_turns, script_messages, script_metrics, script_target_seconds, script_variants, set_active_variant,
+    stream_completion, stream_more_ideas, stream_new_ideas, upgrade_prompts, write_script_variants, write_scripts_concurrently
+)
+from ideas_json import IDEA_PILLARS, OTHER_PILLAR, requested_count, template_pillars
+from routing import ROUTE_LABELS, ROUTE_MODELS, ROUTE_STAGES, load_routes, route_for
+from prompts import TemplateError, compile_template
+from dedupe import DUPLICATE_THRESHOLD, IdeaIndex, split_duplicates
+from transcription import TranscriptionError, transcribe_audio
+from jobs import CANCELLED as JOB_CANCELLED, DONE as JOB_DONE, JobRunner
+from prefetch import (
+    PREFETCH_WORKERS, add_prefetch_spent, estimate_script_cost, load_prefetch, make_draft, pick_ideas, prefetch_spent,
+    recorded_cost, reset_prefetch_spent, valid_draft
+)
+from dump import export_dump, read_records, scan_profiles
+from analytics import (
+    build_tables, coverage, export_parquet, load_tables, parquet_available, pillar_mix, read_manifest, script_length_distribution
+)
+from batch import FINAL_STATUSES, PENDING_STATUSES, BatchPoller, queued_idea_ids, submit_batch
+from context import CHAT_TOKEN_BUDGET, EXTRACTION_TOKEN_BUDGET, context_messages, context_tokens, update_summary
+
+# Inicio del rerun (para medir su duración al final del script)
+rerun_started = time.perf_counter()
 
 # Configuración de la página
 st.set_page_config(page_title="Fábrica de Influencers - Brand People", page_icon="🏭", layout="wide")
@@ -25,47 +59,104 @@ DEFAULT_QUESTIONS = [
     "Sus Anécdotas personales"
 ]
 
+# Instrucciones de la entrevista: se arman una sola vez (prefijo idéntico en cada turno)
+QUESTIONS_STR = "\n".join([f"- {q}" for q in DEFAULT_QUESTIONS])
+INTERVIEW_SYSTEM_PROMPT = f"""Eres el Estratega Principal de la agencia 'Brand People'. Tu misión es construir el perfil de un nuevo talento mediante una entrevista conversacional.
+         
+         BASE DE CONOCIMIENTO (ARQUETIPOS DE ÉXITO):
+         1. El Técnico/Analista (Estilo 'Chapu'/'Fer Pérez'): Datos duros, mecánica, sim-racing, costos reales.
+         2. El Insider/Aventurero (Estilo 'Char'): Detrás de cámaras, logística, experiencias exclusivas, enfoque femenino en nichos masculinos.
+         3. El Gen Z/Lifestyle (Estilo 'Julian'/'Mateo'): Aspiracional, retos, humor, cultura pop, karts, vlogs rápidos.
+         
+         TU TAREA:
+         Entrevista al usuario para encajarlo en uno de estos arquetipos o crear uno nuevo.
+         
+         DEBES CUBRIR ESTAS PREGUNTAS CLAVE (una a una, no todas juntas):
+         {QUESTIONS_STR}
+         
+         OBJETIVO FINAL: No generes el perfil aún, solo entrevista paso a paso.
+            """
+
+# Modelo barato para plegar turnos viejos de la entrevista en el resumen (sin ruta; con ruta lo
+# decide la etapa summary)
+SUMMARY_MODEL = "gpt-4o-mini"
+
+# Cada cuánto se refresca el panel de ADN mientras avanza la entrevista (segundos)
+DNA_REFRESH_SECONDS = 2
+
+# Cada cuánto se refresca el panel de trabajos en segundo plano mientras haya alguno en curso (segundos)
+JOB_REFRESH_SECONDS = 1.5
+# Trabajos que se listan en la barra lateral
+JOBS_SHOWN = 6
+
+# Cada cuánto se refresca el estado de los lotes pendientes de la Batch API (segundos)
+BATCH_REFRESH_SECONDS = 10
+# Lotes que se listan por tema
+BATCHES_SHOWN = 5
+
+# Mensajes del chat que se pintan por página
+CHAT_PAGE_SIZE = 30
+# Ideas por página en El Estratega y El Guionista
+IDEAS_PAGE_SIZE = 20
+
+# Concurrencia máxima para la guionización en lote
+MAX_SCRIPT_WORKERS = 8
+
+# Carpeta de las tablas de analítica en Parquet (una partición por perfil)
+ANALYTICS_DIR = os.environ.get("INFLUENCER_FACTORY_ANALYTICS", "analytics")
+
 import uuid
 
-# Inicialización de Session State (Estructura Refactorizada)
-def init_session_state():
-    if 'data' not in st.session_state:
-        st.session_state['data'] = {
-            "current_profile_id": None,
-            "profiles": {},
-            "prompts": {
-                "strategist": """Actúa como un Estratega de Contenido "Relatable" y Humano.
-Tu objetivo es generar ideas que conecten desde la EMPATÍA y la SIMPLICIDAD, no desde el "marketing agresivo".
+# Base de datos local (compartida por todas las sesiones del proceso)
+@st.cache_resource
+def get_store():
+    return FactoryStore(os.environ.get("INFLUENCER_FACTORY_DB", "influencer_factory.db"))
 
-Usa el perfil JSON para generar 10 ideas de video para el tema '{topic_name}'.
+store = get_store()
 
-REGLAS DE ORO:
-- Nada de "trucos virales" forzados.
-- Busca lo cotidiano, lo simple, lo que le pasa a todo el mundo.
-- Lenguaje natural, como si le hablaras a un amigo.
+# Caché en disco de respuestas del LLM (compartida por todas las sesiones)
+@st.cache_resource
+def get_completion_cache():
+    return CompletionCache(os.environ.get("INFLUENCER_FACTORY_CACHE", "llm_cache.db"))
 
-Usa estos pilares pero con enfoque SIMPLE:
-1. EDUCACIÓN (Tips rápidos y útiles, sin tecnicismos)
-2. CURIOSIDAD (Cosas que no sabías, datos curiosos simples)
-3. OPINIÓN/REFLEXIÓN (Pensamientos honestos, no polémicas vacías)
-4. LIFESTYLE (Vlog, día a día, detrás de cámaras real)
-5. GAMIFICACIÓN (Retos sencillos, preguntas a la audiencia)
+completion_cache = get_completion_cache()
 
-Perfil: {profile_str}
+# Hilos de fondo para la extracción incremental del ADN (independientes de los reruns)
+@st.cache_resource
+def get_dna_jobs():
+    return {
+        "executor": ThreadPoolExecutor(max_workers=4, thread_name_prefix="dna"),
+        "futures": {},
+        "locks": {},
+        "lock": threading.Lock()
+    }
 
-Output esperado: JSON con clave 'ideas' (lista de objetos {'id': 'uuid', 'titulo', 'pilar', 'gancho_visual', 'script': null}).""",
-                "scriptwriter": """Eres el Guionista Senior de Brand People. Escribe el guión para la idea seleccionada.
+dna_jobs = get_dna_jobs()
 
-LA FÓRMULA MATEMÁTICA DEL GUIÓN (NO TE DESVÍES):
-1. EL GANCHO (0-3 seg): Prohibido saludar. Inicia con Afirmación Polémica, Lista o Reto.
-2. EL CUERPO (4-50 seg): Velocidad alta. Frases cortas. Jerga técnica explicada rápido.
-3. EL CTA (Final): Llamado a la acción específico.
+# Hilo de fondo que sigue los lotes de la Batch API y escribe sus guiones (uno por proceso)
+@st.cache_resource
+def get_batch_poller():
+    return BatchPoller(store)
 
-Perfil: {profile_str}
-Idea: {idea_str}
+batch_poller = get_batch_poller()
 
-Formato: Texto plano, líneas dobles."""
-            }
+# Trabajos de generación en segundo plano (ADN, ideas, guiones en lote), compartidos por el proceso
+@st.cache_resource
+def get_job_runner():
+    return JobRunner()
+
+job_runner = get_job_runner()
+
+# Inicialización de Session State (Estructura Refactorizada)
+def init_session_state():
+    if 'data' not in st.session_state:
+        # Solo se cargan los nombres; el perfil activo se lee completo bajo demanda
+        st.session_state['data'] = {
+            "current_profile_id": store.get_setting("current_profile_id"),
+            "profiles": {pid: {"name": name} for pid, name in store.list_profiles().items()},
+            "prompts": upgrade_prompts(store.get_setting("prompts", dict(DEFAULT_PROMPTS))),
+            "routes": load_routes(store.get_setting("routes")),
+            "prefetch": load_prefetch(store.get_setting("prefetch"))
         }
     
     # Migración de datos antiguos (si existen) a la nueva estructura
@@ -79,61 +170,629 @@ Formato: Texto plano, líneas dobles."""
             "topics": {}
         }
         st.session_state['data']['current_profile_id'] = default_id
+        store.save_profile(default_id, st.session_state['data']['profiles'][default_id])
+        store.set_setting("current_profile_id", default_id)
         
         # Limpiar estado antiguo para evitar confusión
         for key in ['profile', 'chat_history', 'ideas', 'selected_idea', 'script']:
             if key in st.session_state:
                 del st.session_state[key]
 
+    # Identificador de la sesión para listar solo sus trabajos en segundo plano
+    st.session_state.setdefault('session_id', str(uuid.uuid4()))
+
     # Asegurar que 'prompts' exista (para sesiones activas que recargan)
     if 'prompts' not in st.session_state['data']:
-        st.session_state['data']['prompts'] = {
-            "strategist": """Actúa como un Estratega de Contenido "Relatable" y Humano.
-Tu objetivo es generar ideas que conecten desde la EMPATÍA y la SIMPLICIDAD, no desde el "marketing agresivo".
+        st.session_state['data']['prompts'] = dict(DEFAULT_PROMPTS)
+    if 'routes' not in st.session_state['data']:
+        st.session_state['data']['routes'] = load_routes(store.get_setting("routes"))
+    if 'prefetch' not in st.session_state['data']:
+        st.session_state['data']['prefetch'] = load_prefetch(store.get_setting("prefetch"))
 
-Usa el perfil JSON para generar 10 ideas de video para el tema '{topic_name}'.
+init_session_state()
 
-REGLAS DE ORO:
-- Nada de "trucos virales" forzados.
-- Busca lo cotidiano, lo simple, lo que le pasa a todo el mundo.
-- Lenguaje natural, como si le hablaras a un amigo.
+# Helper para obtener el perfil actual (lo carga de la base de datos si aún no está en memoria)
+def get_current_profile():
+    pid = st.session_state['data']['current_profile_id']
+    if pid and pid in st.session_state['data']['profiles']:
+        profile = st.session_state['data']['profiles'][pid]
+        if 'chat_history' not in profile:
+            profile = store.load_profile(pid) or {"name": profile['name'], "dna": None, "chat_history": [], "topics": {}}
+            st.session_state['data']['profiles'][pid] = profile
+        return profile
+    return None
 
-Usa estos pilares pero con enfoque SIMPLE:
-1. EDUCACIÓN (Tips rápidos y útiles, sin tecnicismos)
-2. CURIOSIDAD (Cosas que no sabías, datos curiosos simples)
-3. OPINIÓN/REFLEXIÓN (Pensamientos honestos, no polémicas vacías)
-4. LIFESTYLE (Vlog, día a día, detrás de cámaras real)
-5. GAMIFICACIÓN (Retos sencillos, preguntas a la audiencia)
+def set_current_profile(pid):
+    # Descargar de memoria los demás perfiles (quedan solo con su nombre)
+    for other_id, other in st.session_state['data']['profiles'].items():
+        if other_id != pid:
+            st.session_state['data']['profiles'][other_id] = {"name": other['name']}
+    st.session_state['data']['current_profile_id'] = pid
+    store.set_setting("current_profile_id", pid)
+    cancel_prefetch(keep=lambda job: job.profile_id == pid)
 
-Perfil: {profile_str}
+def add_message(profile, message):
+    profile['chat_history'].append(message)
+    store.append_message(st.session_state['data']['current_profile_id'], message)
 
-Output esperado: JSON con clave 'ideas' (lista de objetos {'id': 'uuid', 'titulo', 'pilar', 'gancho_visual', 'script': null}).""",
-            "scriptwriter": """Eres el Guionista Senior de Brand People. Escribe el guión para la idea seleccionada.
+def save_prompt(name, value):
+    # Solo actúa cuando el usuario cambia el texto: la plantilla se compila y valida una vez por
+    # texto (los avisos se muestran esa vez, no en cada rerun) y, si no sirve, se conserva la anterior
+    saved = st.session_state['data']['prompts'].get(name)
+    checked = st.session_state.setdefault('prompts_checked', {})
+    if value == saved or checked.get(name) == (value, saved):
+        return
+    checked[name] = (value, saved)
+    try:
+        template = compile_template(name, value)
+    except TemplateError as e:
+        st.error(f"{e} Se sigue usando la versión guardada.")
+        return
+    for warning in template.warnings:
+        st.warning(warning)
+    st.session_state['data']['prompts'][name] = value
+    store.set_setting("prompts", st.session_state['data']['prompts'])
+    if name == "scriptwriter":
+        # Los borradores en curso se escriben con la plantilla anterior
+        cancel_prefetch()
 
-LA FÓRMULA MATEMÁTICA DEL GUIÓN (NO TE DESVÍES):
-1. EL GANCHO (0-3 seg): Prohibido saludar. Inicia con Afirmación Polémica, Lista o Reto.
-2. EL CUERPO (4-50 seg): Velocidad alta. Frases cortas. Jerga técnica explicada rápido.
-3. EL CTA (Final): Llamado a la acción específico.
+def stage_route(stage):
+    # Modelo, alternativo y presupuesto de la etapa según la tabla editable de la barra lateral
+    return route_for(st.session_state['data']['routes'], stage)
 
-Perfil: {profile_str}
-Idea: {idea_str}
+def render_routes_editor():
+    with st.expander("🧭 Modelos por etapa"):
+        st.caption("Si el modelo principal no responde dentro del presupuesto (o falla) se usa la respuesta anterior guardada o el alternativo.")
+        routes = st.session_state['data']['routes']
+        for stage in ROUTE_STAGES:
+            st.markdown(f"**{ROUTE_LABELS[stage]}**")
+            col_model, col_fallback, col_budget = st.columns(3)
+            entry = routes[stage]
+            fallback_options = [None, *ROUTE_MODELS]
+            updated = {
+                "model": col_model.selectbox("Modelo", ROUTE_MODELS, index=ROUTE_MODELS.index(entry['model']) if entry['model'] in ROUTE_MODELS else 0, key=f"route_model_{stage}"),
+                "fallback": col_fallback.selectbox(
+                    "Alternativo", fallback_options,
+                    index=fallback_options.index(entry.get('fallback')) if entry.get('fallback') in fallback_options else 0,
+                    format_func=lambda m: m or "—", key=f"route_fallback_{stage}"
+                ),
+                "budget": col_budget.number_input("Presupuesto (s)", 0.0, 120.0, float(entry.get('budget') or 0.0), 0.5, key=f"route_budget_{stage}", help="0 = sin límite") or None
+            }
+            if updated != entry:
+                routes[stage] = updated
+                store.set_setting("routes", routes)
 
-Formato: Texto plano, líneas dobles."""
+def render_prefetch_settings(pid):
+    with st.expander("⚡ Pre-generar guiones de las ideas nuevas"):
+        st.caption("Al llegar ideas nuevas se escriben en segundo plano los guiones de las primeras y quedan como borrador en El Guionista. Se cancela al cambiar de tema, de perfil o la plantilla del Guionista.")
+        config = st.session_state['data']['prefetch']
+        pillar_options = [*template_pillars(st.session_state['data']['prompts']['strategist']), OTHER_PILLAR]
+        updated = {
+            "enabled": st.checkbox("Activar pre-generación", value=config['enabled'], key="prefetch_enabled"),
+            "top_k": st.slider("Ideas a guionizar", 1, 10, config['top_k'], key="prefetch_top_k"),
+            "pillars": st.multiselect("Solo estos pilares (vacío = todos)", pillar_options, default=[p for p in config['pillars'] if p in pillar_options], key="prefetch_pillars"),
+            "cap_usd": st.number_input("Tope de gasto por perfil (USD)", 0.0, 100.0, float(config['cap_usd']), 0.05, key="prefetch_cap")
         }
+        if updated != config:
+            st.session_state['data']['prefetch'] = updated
+            store.set_setting("prefetch", updated)
+        spent = prefetch_spent(store, pid)
+        col_spent, col_reset = st.columns([3, 1])
+        col_spent.caption(f"Gastado en borradores por este perfil: ${spent:.4f} de ${updated['cap_usd']:.2f}")
+        if col_reset.button("Reiniciar", key="prefetch_reset", disabled=not spent):
+            reset_prefetch_spent(store, pid)
+            rerun_fragment()
 
-init_session_state()
+# Contexto de la entrevista (resumen persistente + últimos turnos)
+def summarize_turns(client, previous_summary, messages, pid, route=None):
+    turns = "\n".join(f"{m['role']}: {m['content']}" for m in messages)
+    summary_prompt = f"""Resumen actual de la entrevista:
+{previous_summary or '(vacío)'}
 
-# Helper para obtener el perfil actual
-def get_current_profile():
-    pid = st.session_state['data']['current_profile_id']
-    if pid and pid in st.session_state['data']['profiles']:
-        return st.session_state['data']['profiles'][pid]
-    return None
+Nuevos turnos:
+{turns}
 
-# --- SIDEBAR ---
-with st.sidebar:
-    st.title("🏭 Fábrica de Influencers")
+Actualiza el resumen integrando los nuevos turnos. Conserva los datos concretos del talento (nicho, jerga, opiniones polémicas, anécdotas, nombres y cifras). Responde solo con el resumen."""
+    return chat_completion(
+        client,
+        cache=completion_cache,
+        tags={"stage": STAGE_SUMMARY, "profile_id": pid},
+        route=route,
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": "Eres un asistente que resume entrevistas sin perder datos concretos."},
+            {"role": "user", "content": summary_prompt}
+        ]
+    )
+
+def interview_context(client, profile, token_budget, pid, route=None):
+    # Pliega los turnos viejos en el resumen (y lo persiste) antes de armar los mensajes a enviar
+    summary = update_summary(
+        profile.get('summary'),
+        profile['chat_history'],
+        lambda previous, messages: summarize_turns(client, previous, messages, pid, route),
+        token_budget=token_budget
+    )
+    if summary != profile.get('summary'):
+        profile['summary'] = summary
+        store.set_summary(pid, summary)
+    return context_messages(summary, profile['chat_history'])
+
+# ADN incremental (sin llamadas a st.*: corre en hilos de fondo)
+def profile_dna_lock(pid):
+    with dna_jobs['lock']:
+        return dna_jobs['locks'].setdefault(pid, threading.Lock())
+
+def update_dna_incrementally(client, pid, profile, route=None, token_budget=EXTRACTION_TOKEN_BUDGET):
+    # Incorpora al ADN los mensajes posteriores a dna_upto; devuelve False si lo pendiente no cabe en un delta
+    with profile_dna_lock(pid):
+        while profile.get('dna_upto', 0) < len(profile['chat_history']):
+            start = profile.get('dna_upto', 0)
+            # Hasta la última respuesta del usuario: la pregunta del asistente que viene detrás se
+            # incorpora junto con la respuesta que le corresponde
+            users = [i for i, m in enumerate(profile['chat_history'][start:], start) if m['role'] == "user"]
+            if not users:
+                break
+            upto = users[-1] + 1
+            turns = profile['chat_history'][start:upto]
+            if context_tokens(turns) > token_budget:
+                return False
+            profile['dna'] = merge_dna_turns(client, profile['dna'], turns, cache=completion_cache, tags={"profile_id": pid}, route=route)
+            profile['dna_upto'] = upto
+            store.set_dna(pid, profile['dna'], upto)
+    return True
+
+def schedule_dna_update(client, pid, profile):
+    # Los trabajos del mismo perfil se serializan con su lock; el último futuro sirve para mostrar el estado
+    route = stage_route("dna_delta")
+    with dna_jobs['lock']:
+        dna_jobs['futures'][pid] = dna_jobs['executor'].submit(update_dna_incrementally, client, pid, profile, route)
+
+def extract_dna_full(client, profile, pid, bypass_cache=False, route=None, summary_route=None):
+    # Extracción completa (perfiles sin ADN previo o regeneración desde cero)
+    interview_messages = interview_context(client, profile, EXTRACTION_TOKEN_BUDGET, pid, summary_route)
+    history_text = "\n".join([f"{m['role']}: {m['content']}" for m in interview_messages])
+    extraction_prompt = f"""
+    Analiza la siguiente entrevista y extrae el perfil del talento.
+    Conversación:
+    {history_text}
+    
+    Devuelve SOLO un JSON válido con estas claves exactas: 
+    'nombre', 'arquetipo', 'tono', 'jerga_tecnica', 'opiniones_polemicas', 'temas_pasion'.
+    """
+    
+    json_text = chat_completion(
+        client,
+        cache=completion_cache,
+        bypass_cache=bypass_cache,
+        tags={"stage": STAGE_DNA_EXTRACTION, "profile_id": pid},
+        route=route,
+        model=DEFAULT_MODEL,
+        messages=[
+            {"role": "system", "content": "Eres un asistente experto en extracción de datos JSON."},
+            {"role": "user", "content": extraction_prompt}
+        ],
+        response_format={"type": "json_object"}
+    )
+    return json.loads(json_text)
+
+# Trabajos en segundo plano (sin llamadas a st.*: corren en el pool de jobs.py). Cada uno escribe
+# su resultado en el almacén por id de perfil / tema y devuelve el texto del aviso final.
+def dna_job(client, pid, profile, bypass_cache, routes):
+    # routes: tabla de rutas por etapa (las etapas dna, dna_delta y summary intervienen aquí)
+    def run(job):
+        # Esperar al delta en curso y sumar solo los turnos que falten
+        pending = dna_jobs['futures'].get(pid)
+        if pending:
+            job.update(message="esperando la actualización incremental")
+            wait([pending])
+        job.update(message="analizando la entrevista")
+        if bypass_cache or not profile['dna'] or not update_dna_incrementally(client, pid, profile, route_for(routes, "dna_delta")):
+            profile['dna'] = extract_dna_full(
+                client, profile, pid, bypass_cache=bypass_cache, route=route_for(routes, "dna"), summary_route=route_for(routes, "summary")
+            )
+            profile['dna_upto'] = len(profile['chat_history'])
+            store.set_dna(pid, profile['dna'], profile['dna_upto'])
+        return "¡Perfil Generado!"
+    return run
+
+def ideas_job(client, template, topic_name, dna, pid, topic_id, bypass_cache, route, more=False, prefetch=None):
+    def run(job):
+        # El índice de similitud se arma aquí: el del tema en la sesión puede estar desactualizado
+        index = IdeaIndex(store.query_ideas(topic_id))
+        tags = {"profile_id": pid, "topic_id": topic_id}
+        report = {}
+        if more:
+            stream = stream_more_ideas(
+                client, topic_name, dna, cache=completion_cache, bypass_cache=bypass_cache, tags=tags,
+                existing_titles=index.titles, template=template, report=report, route=route
+            )
+            job.update(0, MORE_IDEAS_COUNT)
+        else:
+            stream = stream_new_ideas(client, template, topic_name, dna, cache=completion_cache, bypass_cache=bypass_cache, tags=tags, report=report, route=route)
+            job.update(0, requested_count(template))
+        added, duplicates = [], []
+        for idea in stream:
+            # Cada idea se guarda en cuanto llega; las que repiten ideas del tema (o entre sí) se descartan
+            unique, repeated = split_duplicates([idea], index)
+            store.add_ideas(topic_id, unique)
+            added += unique
+            duplicates += repeated
+            job.update(report['received'], message=f"«{idea['titulo']}»")
+        if prefetch and added and not job.cancelled:
+            prefetch(added)
+        text = f"{len(added)} ideas nuevas"
+        if report['repaired']:
+            text += f" ({report['repaired']} reparadas)"
+        if report['requested']:
+            text += f". 🔁 {report['requested']} pedidas de nuevo por llegar incompletas o inválidas"
+        if duplicates:
+            text += f". 🧹 {len(duplicates)} descartadas por parecerse a otras del tema: " + ", ".join(f"«{idea['titulo']}»" for idea, _, _ in duplicates)
+        return text
+    return run
+
+def scripts_job(client, template, dna, pid, topic_id, workers, bypass_cache, route):
+    def run(job):
+        pending_ideas = store.query_ideas(topic_id, scripted=False)
+        job.update(0, len(pending_ideas))
+        # Los borradores pre-generados con esta plantilla se aceptan sin volver a llamar
+        to_write = []
+        for idea in pending_ideas:
+            draft = None if bypass_cache else valid_draft(idea, template)
+            if draft:
+                idea['script'] = draft
+                idea.pop('draft')
+                store.update_idea(idea)
+                job.update(job.done + 1, message=f"📝 {idea['titulo']}")
+            else:
+                to_write.append(idea)
+        failed = 0
+        results = write_scripts_concurrently(
+            client, template, dna, to_write, max_workers=workers, cache=completion_cache,
+            bypass_cache=bypass_cache, tags={"profile_id": pid, "topic_id": topic_id}, route=route
+        )
+        for idea, script, error in results:
+            if error:
+                failed += 1
+                job.update(job.done + 1, message=f"❌ {idea['titulo']}: {error}")
+            else:
+                # Se guarda al llegar: un fallo posterior no descarta lo ya escrito
+                idea['script'] = script
+                idea.pop('draft', None)
+                store.update_idea(idea)
+                job.update(job.done + 1, message=f"✅ {idea['titulo']}")
+        if failed:
+            raise RuntimeError(f"{len(pending_ideas) - failed} guiones listos, {failed} con error. Vuelve a lanzarlo para reintentar los pendientes.")
+        return f"{len(pending_ideas)} guiones listos"
+    return run
+
+def prefetch_job(client, template, dna, pid, topic_id, ideas, config, route):
+    def run(job):
+        # Dentro del tope: se reserva el costo estimado de cada guion antes de pedirlo
+        remaining = config['cap_usd'] - prefetch_spent(store, pid)
+        chosen = []
+        for idea in pick_ideas(ideas, config['top_k'], config['pillars']):
+            cost = estimate_script_cost(route.model, script_messages(build_script_prompt(template, dna, idea)))
+            if cost > remaining:
+                break
+            remaining -= cost
+            chosen.append(idea)
+        if not chosen:
+            return "tope de gasto alcanzado, no se pre-generó nada" if pick_ideas(ideas, config['top_k'], config['pillars']) else "ninguna idea elegible"
+        job.update(0, len(chosen))
+        drafted = 0
+        # Al cancelar se esperan las llamadas en curso: su gasto también cuenta para el tope
+        results = write_scripts_concurrently(
+            client, template, dna, chosen, max_workers=PREFETCH_WORKERS, cache=completion_cache,
+            tags={"profile_id": pid, "topic_id": topic_id, "job_id": job.id}, route=route,
+            stage=STAGE_SCRIPT_PREFETCH, wait_running=True
+        )
+        try:
+            for idea, script, error in results:
+                if job.cancelled:
+                    break
+                # Releer la idea: el usuario pudo escribir su guión mientras tanto
+                current = store.get_idea(idea['id'])
+                if not error and current and not current.get('script'):
+                    current['draft'] = make_draft(script, template)
+                    store.update_idea(current)
+                    drafted += 1
+                job.update(job.done + 1, message=f"❌ {idea['titulo']}: {error}" if error else f"📝 {idea['titulo']}")
+        finally:
+            results.close()
+            add_prefetch_spent(store, pid, recorded_cost(pid, job.id))
+        return f"{drafted} borradores listos"
+    return run
+
+def analytics_job():
+    def run(job):
+        manifest = export_parquet(store, ANALYTICS_DIR, progress=lambda rows: job.update(rows, message=f"{rows} filas"))
+        return f"{manifest['rows']} filas de ideas y mensajes, {manifest['call_rows']} llamadas acumuladas"
+    return run
+
+def submit_job(kind, label, fn, profile_id=None, topic_id=None):
+    job_runner.submit(kind, label, fn, owner=st.session_state['session_id'], profile_id=profile_id, topic_id=topic_id)
+    # Rerun completo: la barra lateral empieza a seguir el trabajo
+    st.rerun()
+
+def prefetch_submitter(client, dna, pid, topic_id, topic_name):
+    # Lo que el trabajo de ideas llama con las ideas nuevas (None si la pre-generación está apagada);
+    # plantilla, ADN y modelo se toman ahora, no desde el hilo de fondo
+    config = dict(st.session_state['data']['prefetch'])
+    if not config['enabled']:
+        return None
+    owner = st.session_state['session_id']
+    template = st.session_state['data']['prompts']['scriptwriter']
+    route = stage_route("scriptwriter")
+    def submit(ideas):
+        # Una sola pre-generación por perfil: la nueva reemplaza a la anterior
+        job_runner.cancel(kind="prefetch", profile_id=pid)
+        job_runner.submit(
+            "prefetch", f"Borradores de {topic_name}", prefetch_job(client, template, dna, pid, topic_id, ideas, config, route),
+            owner=owner, profile_id=pid, topic_id=topic_id
+        )
+    return submit
+
+def cancel_prefetch(keep=None):
+    # Los borradores en curso de esta sesión dejan de servir al cambiar de tema, de perfil o de plantilla
+    job_runner.cancel(owner=st.session_state['session_id'], kind="prefetch", keep=keep)
+
+def cancel_prefetch_other_topics(selector_key):
+    # on_change de los selectores de tema
+    topic_id = st.session_state.get(selector_key)
+    cancel_prefetch(keep=lambda job: job.topic_id == topic_id)
+
+def active_job(kind, profile_id=None, topic_id=None):
+    # Trabajo en curso de este tipo para el perfil / tema (de cualquier sesión)
+    jobs = job_runner.list(kind=kind, profile_id=profile_id, topic_id=topic_id, active=True)
+    return jobs[0] if jobs else None
+
+def job_progress(job):
+    text = f"⏳ {job.label}" + (f" · {job.message}" if job.message else f" · {job.status}")
+    if job.total:
+        st.progress(job.progress, text=f"{text} ({job.done}/{job.total})")
+    else:
+        st.caption(text)
+
+@st.fragment(run_every=JOB_REFRESH_SECONDS)
+def render_ideas_arriving(job_id, topic_id):
+    # Ideas del trabajo en curso a medida que se guardan; al terminar se repinta la app
+    job = job_runner.get(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    job_progress(job)
+    for idea in store.query_ideas(topic_id, newest_first=True, limit=job.done):
+        st.caption(f"💡 [{idea['pilar']}] {idea['titulo']}")
+
+def collect_finished_jobs(jobs):
+    # Encola el aviso de los trabajos que terminaron desde la última vez; devuelve si hubo alguno
+    notified = st.session_state.setdefault('jobs_notified', set())
+    notices = st.session_state.setdefault('job_notices', [])
+    fresh = [job for job in jobs if job.finished and job.id not in notified]
+    for job in fresh:
+        notified.add(job.id)
+        notices.append(job_summary(job))
+    return bool(fresh)
+
+def job_summary(job):
+    if job.status == JOB_DONE:
+        return f"✅ {job.label}: {job.result}"
+    if job.status == JOB_CANCELLED:
+        return f"⏹️ {job.label}: cancelado" + (f" ({job.result})" if job.result else "")
+    return f"❌ {job.label}: {job.error}"
+
+def render_job_list(jobs):
+    for job in jobs[-JOBS_SHOWN:]:
+        if not job.finished:
+            job_progress(job)
+        else:
+            st.caption(job_summary(job))
+
+@st.fragment(run_every=JOB_REFRESH_SECONDS)
+def render_active_jobs():
+    # Se refresca solo mientras haya trabajos en curso; cuando uno termina se repinta la app con su resultado
+    jobs = job_runner.list(owner=st.session_state['session_id'])
+    if collect_finished_jobs(jobs):
+        st.rerun()
+    render_job_list(jobs)
+
+def render_jobs_sidebar():
+    jobs = job_runner.list(owner=st.session_state['session_id'])
+    collect_finished_jobs(jobs)
+    for notice in st.session_state.pop('job_notices', []):
+        st.toast(notice)
+    if not jobs:
+        return
+    st.header("⏳ Trabajos")
+    if any(not job.finished for job in jobs):
+        render_active_jobs()
+    else:
+        render_job_list(jobs)
+    st.divider()
+
+def render_dna_panel(current_profile):
+    future = dna_jobs['futures'].get(st.session_state['data']['current_profile_id'])
+    if future and not future.done():
+        render_dna_updating(current_profile)
+    else:
+        render_dna(current_profile, future)
+
+@st.fragment(run_every=DNA_REFRESH_SECONDS)
+def render_dna_updating(current_profile):
+    # Se refresca solo mientras el hilo de fondo incorpora turnos; al terminar se repinta la app
+    future = dna_jobs['futures'].get(st.session_state['data']['current_profile_id'])
+    if not future or future.done():
+        st.rerun()
+    render_dna(current_profile, future)
+
+def render_dna(current_profile, future):
+    if future and not future.done():
+        st.caption("🧬 Actualizando ADN con los últimos turnos...")
+    elif future and future.exception():
+        st.caption(f"⚠️ La última actualización del ADN falló: {future.exception()}")
     
+    if current_profile['dna']:
+        with st.expander("Ver ADN de Marca", expanded=True):
+            st.json(current_profile['dna'])
+        st.caption(f"🧬 {current_profile.get('dna_upto', 0)}/{len(current_profile['chat_history'])} mensajes incorporados al ADN")
+
+def topic_index(topic_id):
+    # Índice de similitud del tema: se arma una vez por sesión y se actualiza en cada inserción
+    indexes = st.session_state.setdefault('idea_indexes', {})
+    index = indexes.get(topic_id)
+    if index is None or len(index) != store.count_ideas(topic_id):
+        index = indexes[topic_id] = IdeaIndex(store.query_ideas(topic_id))
+    return index
+
+BATCH_STATUS_LABELS = {
+    "validating": "⏳ validando",
+    "in_progress": "⏳ en curso",
+    "finalizing": "⏳ terminando",
+    "cancelling": "⏳ cancelando",
+    "completed": "✅ completado",
+    "failed": "❌ falló",
+    "expired": "⌛ expiró",
+    "cancelled": "🚫 cancelado"
+}
+
+def render_batch_list(batches):
+    for batch in batches[:BATCHES_SHOWN]:
+        line = f"🌙 {batch['id']} · {BATCH_STATUS_LABELS.get(batch['status'], batch['status'])} · {len(batch['idea_ids'])} guiones"
+        if batch['status'] in FINAL_STATUSES:
+            line += f" · {batch['applied']} aplicados, {batch['failed']} con error"
+        st.caption(line)
+        if batch['error']:
+            st.caption(f"⚠️ {batch['error']}")
+        if batch['id'] in batch_poller.errors:
+            st.caption(f"⚠️ Última consulta falló: {batch_poller.errors[batch['id']]}")
+
+@st.fragment(run_every=BATCH_REFRESH_SECONDS)
+def render_pending_batches(topic_id):
+    # Se refresca solo mientras haya lotes en curso; al terminar repinta la app para mostrar los guiones
+    batches = store.list_batches(topic_id)
+    if not any(b['status'] in PENDING_STATUSES for b in batches):
+        st.rerun()
+    render_batch_list(batches)
+    if st.button("🔄 Consultar ahora", key=f"batch_poll_{topic_id}"):
+        batch_poller.poll_now()
+
+def render_batch_panel(client, profile, topic_id, key):
+    # Encola los guiones pendientes del tema en la Batch API (mitad de precio, listos en horas)
+    api_key = st.session_state.get('api_key')
+    if client:
+        batch_poller.resume(client, key_id(api_key))
+    queued = queued_idea_ids(store, topic_id)
+    pending_count = store.count_ideas(topic_id, scripted=False)
+    st.caption(f"🌙 Batch API: {pending_count} ideas sin guión" + (f", {len(queued)} ya en un lote en curso" if queued else "") + ". Los guiones llegan en segundo plano (hasta 24 h) a mitad de precio.")
+    if st.button("🌙 Encolar en lote", key=key, disabled=not pending_count, use_container_width=True):
+        ideas = [idea for idea in store.query_ideas(topic_id, scripted=False) if idea['id'] not in queued]
+        if not client:
+            st.error("Falta API Key.")
+        elif not ideas:
+            st.info("Todas las ideas sin guión ya están en un lote en curso.")
+        else:
+            try:
+                batch_id = submit_batch(
+                    client, store, st.session_state['data']['current_profile_id'], topic_id, key_id(api_key),
+                    st.session_state['data']['prompts']['scriptwriter'], profile['dna'], ideas,
+                    model=stage_route("scriptwriter").model
+                )
+                batch_poller.track(client, batch_id)
+                st.success(f"Lote {batch_id} enviado con {len(ideas)} guiones.")
+            except Exception as e:
+                st.error(f"Error: {e}")
+    batches = store.list_batches(topic_id)
+    if any(b['status'] in PENDING_STATUSES for b in batches):
+        render_pending_batches(topic_id)
+    else:
+        render_batch_list(batches)
+
+def idea_filters(topic_id, key):
+    # Búsqueda de texto y filtros por pilar / estado del guión (se resuelven en SQLite)
+    col_search, col_pilar, col_status = st.columns([2, 1, 1])
+    search = col_search.text_input("🔎 Buscar", key=f"{key}_search", placeholder="Título o gancho...")
+    pillars = store.idea_pillars(topic_id)
+    pilar = col_pilar.selectbox(
+        "Pilar",
+        [None] + list(pillars),
+        format_func=lambda p: "Todos" if p is None else f"{p} ({pillars[p]})",
+        key=f"{key}_pilar"
+    )
+    status = col_status.selectbox("Guión", ["Todos", "Pendiente", "Listo"], key=f"{key}_status")
+    newest_first = st.toggle("Más recientes primero", key=f"{key}_newest")
+    return {
+        "search": search,
+        "pilar": pilar,
+        "scripted": {"Todos": None, "Pendiente": False, "Listo": True}[status],
+        "newest_first": newest_first
+    }
+
+def idea_page(topic_id, filters, key):
+    # Solo se lee de la base de datos la página visible
+    total = store.count_ideas(topic_id, filters['pilar'], filters['scripted'], filters['search'])
+    pages = max(1, -(-total // IDEAS_PAGE_SIZE))
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    page = st.number_input(f"Página (de {pages})", min_value=1, max_value=pages, key=page_key) if pages > 1 else 1
+    offset = (page - 1) * IDEAS_PAGE_SIZE
+    ideas = store.query_ideas(topic_id, limit=IDEAS_PAGE_SIZE, offset=offset, **filters)
+    if total:
+        st.caption(f"{total} ideas · mostrando {offset + 1}–{offset + len(ideas)}")
+    else:
+        st.caption("Ninguna idea coincide con los filtros.")
+    return ideas
+
+def bypass_cache_toggle(key):
+    return st.checkbox("🎲 Respuesta nueva (ignorar caché)", key=key, help="Vuelve a llamar al modelo aunque esta misma petición ya tenga respuesta guardada.")
+
+# Streaming de respuestas para el chat y el teleprompter
+def stream_chat(client, messages, stats, route, bypass_cache=False, tags=None):
+    # Generador de texto para st.write_stream; deja el tiempo al primer token en stats['ttft']
+    return stream_completion(client, stats=stats, cache=completion_cache, bypass_cache=bypass_cache, tags=tags, route=route, model=DEFAULT_MODEL, messages=messages)
+
+def cached_prefix_note(stats):
+    cached_tokens = stats.get('cached_tokens')
+    return f" · 💾 {cached_tokens} tokens del prompt desde la caché del proveedor" if cached_tokens else ""
+
+def variant_label(metrics):
+    return f"{metrics['words']} palabras · ≈ {metrics['seconds']:.0f} s" + (" ⚠️" if metrics['over'] > 0 else " ✅")
+
+def instrumented(scope):
+    # Registra la duración de cada ejecución del bloque (dentro de un rerun completo o solo del fragmento)
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                recorder.record_rerun(scope, time.perf_counter() - start, st.session_state.get('stage'), st.session_state['data'].get('current_profile_id'))
+        return wrapper
+    return decorator
+
+def rerun_fragment():
+    # En un rerun de fragmento solo se repinta ese bloque; si el fragmento corre dentro de un rerun completo, se repinta la app
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()
+
+def get_client():
+    # Cliente construido desde la API Key guardada en session_state (accesible desde cualquier fragmento)
+    api_key = st.session_state.get('api_key')
+    if not api_key:
+        return None
+    try:
+        # Cliente del registro del proceso: reutiliza las conexiones keep-alive entre reruns y sesiones
+        return default_registry.get(api_key)
+    except Exception:
+        return None
+
+# --- SIDEBAR ---
+# Cada bloque es un fragmento: sus widgets solo re-ejecutan su propio bloque
+@st.fragment
+def render_profiles_sidebar():
     # --- GESTIÓN DE PERFILES ---
     st.header("👥 Perfiles")
     
@@ -150,7 +809,7 @@ with st.sidebar:
     )
     
     if selected_pid != st.session_state['data']['current_profile_id']:
-        st.session_state['data']['current_profile_id'] = selected_pid
+        set_current_profile(selected_pid)
         st.rerun()
 
     # Crear Nuevo Perfil
@@ -165,58 +824,148 @@ with st.sidebar:
                     "chat_history": [{"role": "assistant", "content": "Hola. Soy el Estratega Principal. Vamos a definir este nuevo perfil."}],
                     "topics": {}
                 }
-                st.session_state['data']['current_profile_id'] = new_id
+                store.save_profile(new_id, st.session_state['data']['profiles'][new_id])
+                set_current_profile(new_id)
                 st.success(f"Perfil '{new_profile_name}' creado.")
                 st.rerun()
             else:
                 st.warning("Escribe un nombre.")
 
     # Guardar/Cargar Datos
-    with st.expander("💾 Base de Datos (JSON)"):
-        # Descargar
-        json_str = json.dumps(st.session_state['data'], indent=2)
+    with st.expander("💾 Base de Datos"):
+        # Descargar (el volcado se arma desde la base de datos solo al pulsar, registro a registro)
         st.download_button(
             label="Descargar Todo",
-            data=json_str,
-            file_name="influencer_factory_data.json",
-            mime="application/json"
+            data=lambda: export_dump(store),
+            file_name="influencer_factory_data.ndjson.gz",
+            mime="application/gzip"
         )
         
-        # Cargar
-        uploaded_file = st.file_uploader("Cargar Archivo", type=['json'])
+        # Cargar (NDJSON comprimido o el JSON de versiones anteriores)
+        uploaded_file = st.file_uploader("Cargar Archivo", type=['gz', 'ndjson', 'json'])
         if uploaded_file is not None:
             try:
-                data = json.load(uploaded_file)
-                st.session_state['data'] = data
-                st.success("Datos cargados correctamente.")
-                st.rerun()
+                # Perfiles del archivo: se leen una vez por archivo subido
+                scan = st.session_state.get('import_scan')
+                if not scan or scan[0] != uploaded_file.file_id:
+                    scan = st.session_state['import_scan'] = (uploaded_file.file_id, scan_profiles(uploaded_file))
+                file_profiles = scan[1]
+                replace = st.radio(
+                    "Al importar",
+                    ["Combinar con los datos actuales", "Reemplazar todo"],
+                    key="import_mode",
+                    help="Al combinar, cada perfil elegido reemplaza al del mismo id y el resto se conserva."
+                ) == "Reemplazar todo"
+                selected_profiles = st.multiselect(
+                    "Perfiles a importar",
+                    options=list(file_profiles),
+                    default=list(file_profiles),
+                    format_func=lambda pid: file_profiles[pid],
+                    key="import_profiles",
+                    disabled=replace
+                )
+                if st.button("Importar", disabled=not replace and not selected_profiles, use_container_width=True):
+                    counts = store.import_records(
+                        read_records(uploaded_file),
+                        profile_ids=None if replace else set(selected_profiles),
+                        replace=replace
+                    )
+                    # Recargar la sesión desde la base de datos
+                    del st.session_state['data']
+                    init_session_state()
+                    st.toast(f"Datos cargados: {counts['profile']} perfiles, {counts['topic']} temas, {counts['idea']} ideas, {counts['message']} mensajes.")
+                    st.rerun()
             except Exception as e:
                 st.error(f"Error al cargar: {e}")
 
-    st.divider()
-    
-    # Navegación Principal
-    st.header("Navegación")
-    stage = st.radio(
-        "Ir a la etapa:",
-        ["1. El Perfilador 🕵️", "2. El Estratega 🧠", "3. El Guionista ✍️"]
-    )
-    
-    st.divider()
-    
+@st.fragment
+def render_config_sidebar():
     # Configuración API
     st.subheader("Configuración")
-    api_key = st.text_input("OpenAI API Key", type="password")
+    api_key = st.text_input("OpenAI API Key", type="password", key="api_key")
     
-    client = None
     if not api_key:
         st.warning("⚠️ Ingresa tu API Key.")
     else:
         try:
-            client = OpenAI(api_key=api_key)
+            default_registry.get(api_key)
         except Exception as e:
             st.error(f"Error: {e}")
     
+    # Llamadas ahorradas por la caché
+    cache_stats = completion_cache.stats()
+    st.caption(f"🗄️ Caché LLM: {cache_stats['hits']} aciertos / {cache_stats['misses']} fallos en esta ejecución · {cache_stats['total_hits']} llamadas ahorradas en total ({cache_stats['entries']} respuestas guardadas)")
+
+    # Estado del limitador compartido de llamadas a OpenAI
+    gateway_stats = default_gateway.stats()
+    st.caption(f"🚦 Límite {gateway_stats['rpm']} RPM / {gateway_stats['tpm']} TPM · {gateway_stats['queue_depth']} en cola, {gateway_stats['in_flight']} en curso · espera media {gateway_stats['avg_wait']:.1f} s (máx. {gateway_stats['max_wait']:.1f} s) · {gateway_stats['retries']} reintentos")
+    client_stats = default_registry.stats()
+    st.caption(f"🔌 {client_stats['clients']} clientes en el pool compartido · {client_stats['reused']} reutilizados, {client_stats['created']} creados")
+
+    render_routes_editor()
+
+@st.fragment
+def render_metrics_sidebar():
+    # Latencia, tokens y costo por etapa / perfil / tema (registro compartido por todo el proceso)
+    with st.expander("📊 Métricas (latencia, tokens y costo)"):
+        group = st.radio("Agrupar por", ["Etapa", "Perfil", "Tema"], horizontal=True, key="metrics_group")
+        only_current = st.checkbox("Solo el perfil activo", key="metrics_only_current")
+        profile_filter = st.session_state['data']['current_profile_id'] if only_current else None
+        group_by = {"Etapa": ("stage", "model"), "Perfil": "profile_id", "Tema": ("profile_id", "topic_id")}[group]
+        rows = recorder.aggregate(group_by, profile_id=profile_filter)
+        if not rows:
+            st.caption("Todavía no hay llamadas registradas.")
+        else:
+            # Nombres legibles en lugar de IDs (los temas solo se conocen para el perfil cargado)
+            profile_names = {pid: p['name'] for pid, p in st.session_state['data']['profiles'].items()}
+            topic_names = {tid: t['name'] for p in st.session_state['data']['profiles'].values() for tid, t in p.get('topics', {}).items()}
+            calls = pd.DataFrame(rows)
+            if 'profile_id' in calls:
+                calls['profile_id'] = calls['profile_id'].map(lambda pid: profile_names.get(pid, pid or "—"))
+            if 'topic_id' in calls:
+                calls['topic_id'] = calls['topic_id'].map(lambda tid: topic_names.get(tid, tid or "—"))
+            calls = calls.rename(columns={"stage": "etapa", "model": "modelo", "profile_id": "perfil", "topic_id": "tema"})
+            st.dataframe(calls, hide_index=True, use_container_width=True)
+            st.caption(f"💰 Costo estimado: ${calls['costo_usd'].sum():.4f} USD en {int(calls['llamadas'].sum())} llamadas")
+
+        routes = recorder.aggregate(("stage", "decision", "model"), kind="route", profile_id=profile_filter)
+        if routes:
+            st.markdown("**Enrutado de modelos**")
+            st.dataframe(pd.DataFrame(routes).rename(columns={"stage": "etapa", "decision": "decisión", "model": "modelo"}), hide_index=True, use_container_width=True)
+
+        reruns = recorder.aggregate(("scope", "stage"), kind="rerun", profile_id=profile_filter)
+        if reruns:
+            st.markdown("**Reruns**")
+            st.dataframe(pd.DataFrame(reruns).rename(columns={"scope": "bloque", "stage": "etapa"}), hide_index=True, use_container_width=True)
+
+        # Exportación para los dashboards (se arma solo al pulsar)
+        col_jsonl, col_prom = st.columns(2)
+        col_jsonl.download_button("JSONL", data=recorder.to_jsonl, file_name="influencer_factory_metrics.jsonl", mime="application/x-ndjson", use_container_width=True)
+        col_prom.download_button("Prometheus", data=recorder.to_prometheus, file_name="influencer_factory_metrics.prom", mime="text/plain", use_container_width=True)
+
+with st.sidebar:
+    st.title("🏭 Fábrica de Influencers")
+    
+    render_profiles_sidebar()
+
+    st.divider()
+    
+    # Navegación Principal (fuera de fragmentos: cambiar de etapa re-ejecuta toda la app)
+    st.header("Navegación")
+    stage = st.radio(
+        "Ir a la etapa:",
+        ["1. El Perfilador 🕵️", "2. El Estratega 🧠", "3. El Guionista ✍️", "4. Analítica 📊"],
+        key="stage"
+    )
+    
+    st.divider()
+
+    render_jobs_sidebar()
+    
+    render_config_sidebar()
+
+    render_metrics_sidebar()
+    
     st.divider()
 
     # Banco de Preguntas (Global o por Perfil? Por ahora Global)
@@ -228,23 +977,36 @@ with st.sidebar:
     # (Opcional: Podríamos mover custom_questions dentro del perfil, pero por simplicidad lo dejamos global o lo migramos luego)
 
 
-# --- LAYOUT PRINCIPAL (2 COLUMNAS) ---
-col_tools, col_chat = st.columns([1, 1])
-
-current_profile = get_current_profile()
-
 # --- COLUMNA DERECHA: CHAT PERSISTENTE ---
-with col_chat:
+@st.fragment
+@instrumented("chat")
+def render_chat(current_profile):
+    client = get_client()
+    pid = st.session_state['data']['current_profile_id']
+    
     # Contenedor de chat con altura fija (550px)
     chat_container = st.container(height=550)
     with chat_container:
         if current_profile:
-            for message in current_profile['chat_history']:
+            # Solo se pinta la página más reciente; las anteriores se cargan a demanda
+            history = current_profile['chat_history']
+            visible = st.session_state.setdefault('chat_visible', {}).get(pid, CHAT_PAGE_SIZE)
+            first_visible = max(0, len(history) - visible)
+            if first_visible > 0:
+                if st.button(f"⬆️ Cargar mensajes anteriores ({first_visible} ocultos)", key="load_older_messages"):
+                    st.session_state['chat_visible'][pid] = visible + CHAT_PAGE_SIZE
+                    rerun_fragment()
+            for message in history[first_visible:]:
                 with st.chat_message(message["role"]):
                     st.markdown(message["content"])
+            chat_ttft = st.session_state.get('chat_ttft', {}).get(st.session_state['data']['current_profile_id'])
+            if chat_ttft is not None and current_profile['chat_history'] and current_profile['chat_history'][-1]['role'] == "assistant":
+                st.caption(f"⚡ Primer token en {chat_ttft:.2f}s")
         else:
             st.info("Crea o selecciona un perfil para comenzar.")
 
+    chat_bypass_cache = bypass_cache_toggle("chat_bypass_cache")
+
     # Input del chat (siempre visible abajo)
     if prompt := st.chat_input("Tu respuesta..."):
         if not client:
@@ -253,63 +1015,122 @@ with col_chat:
             st.error("Primero crea un perfil en el menú lateral.")
         else:
             # Agregar usuario al historial
-            current_profile['chat_history'].append({"role": "user", "content": prompt})
+            add_message(current_profile, {"role": "user", "content": prompt})
+            # El ADN se actualiza en segundo plano mientras se genera la respuesta
+            schedule_dna_update(client, pid, current_profile)
             with chat_container:
                 with st.chat_message("user"):
                     st.markdown(prompt)
 
-            # Preparar preguntas (Base + Custom)
-            # (Nota: custom_questions sigue siendo global por ahora, se podría migrar a perfil si se desea)
-            final_questions = DEFAULT_QUESTIONS.copy()
-            if 'custom_questions' in st.session_state: # Check simple
-                 # Lógica simplificada para custom questions global
-                 pass 
+            # Llamada a OpenAI (instrucciones fijas: el mismo prefijo en todos los turnos)
+            system_prompt = INTERVIEW_SYSTEM_PROMPT
             
-            # Reconstruir questions_str (simplificado para no romper lógica anterior)
-            questions_str = "\n".join([f"- {q}" for q in final_questions])
+            try:
+                messages = [{"role": "system", "content": system_prompt}] + interview_context(client, current_profile, CHAT_TOKEN_BUDGET, pid, stage_route("summary"))
+                with chat_container:
+                    with st.chat_message("assistant"):
+                        stats = {}
+                        bot_reply = st.write_stream(stream_chat(client, messages, stats, stage_route("interview"), bypass_cache=chat_bypass_cache, tags={"stage": STAGE_CHAT, "profile_id": pid}))
+                        if 'ttft' in stats:
+                            st.caption(f"⚡ Primer token en {stats['ttft']:.2f}s" + (" (caché)" if stats.get('cached') else "") + f" · 🧠 {context_tokens(messages)} tokens de contexto" + cached_prefix_note(stats))
+                # Solo se persiste la respuesta completa (un stream cortado no deja mensajes a medias)
+                add_message(current_profile, {"role": "assistant", "content": bot_reply})
+                if 'ttft' in stats:
+                    st.session_state.setdefault('chat_ttft', {})[st.session_state['data']['current_profile_id']] = stats['ttft']
+                if st.session_state.get('stage') == "1. El Perfilador 🕵️":
+                    # El panel de ADN está en otro fragmento: un rerun completo para que siga el delta recién lanzado
+                    st.rerun()
+            except Exception as e:
+                st.error(f"Error de API: {e}")
 
-            # Llamada a OpenAI
-            system_prompt = f"""Eres el Estratega Principal de la agencia 'Brand People'. Tu misión es construir el perfil de un nuevo talento mediante una entrevista conversacional.
-         
-         BASE DE CONOCIMIENTO (ARQUETIPOS DE ÉXITO):
-         1. El Técnico/Analista (Estilo 'Chapu'/'Fer Pérez'): Datos duros, mecánica, sim-racing, costos reales.
-         2. El Insider/Aventurero (Estilo 'Char'): Detrás de cámaras, logística, experiencias exclusivas, enfoque femenino en nichos masculinos.
-         3. El Gen Z/Lifestyle (Estilo 'Julian'/'Mateo'): Aspiracional, retos, humor, cultura pop, karts, vlogs rápidos.
-         
-         TU TAREA:
-         Entrevista al usuario para encajarlo en uno de estos arquetipos o crear uno nuevo.
-         
-         DEBES CUBRIR ESTAS PREGUNTAS CLAVE (una a una, no todas juntas):
-         {questions_str}
-         
-         OBJETIVO FINAL: No generes el perfil aún, solo entrevista paso a paso.
-            """
-            
-            messages = [{"role": "system", "content": system_prompt}] + current_profile['chat_history']
-            
-            with st.spinner("El Estratega está pensando..."):
-                try:
-                    response = client.chat.completions.create(
-                        model="gpt-4o",
-                        messages=messages
-                    )
-                    bot_reply = response.choices[0].message.content
-                    
-                    current_profile['chat_history'].append({"role": "assistant", "content": bot_reply})
-                    with chat_container:
-                        with st.chat_message("assistant"):
-                            st.markdown(bot_reply)
-                except Exception as e:
-                    st.error(f"Error de API: {e}")
+# --- ANALÍTICA (tablas en columnas de todos los perfiles) ---
+@st.cache_data(show_spinner=False)
+def load_analytics(root, version):
+    # version cambia con cada exportación: mientras tanto los reruns reutilizan las tablas ya leídas
+    return load_tables(root)
+
+def render_analytics():
+    st.subheader("📊 Analítica")
+    if parquet_available():
+        manifest = read_manifest(ANALYTICS_DIR)
+        exporting = active_job("analytics")
+        col_info, col_refresh = st.columns([3, 1])
+        if manifest:
+            col_info.caption(f"Tablas exportadas a las {time.strftime('%H:%M:%S', time.localtime(manifest['exported_at']))} · {manifest['rows']} filas de ideas y mensajes · {manifest['call_rows']} llamadas · `{ANALYTICS_DIR}/`")
+        else:
+            col_info.caption("Todavía no se exportaron las tablas.")
+        if col_refresh.button("🔄 Actualizar", disabled=bool(exporting), use_container_width=True):
+            submit_job("analytics", "Tablas de analítica", analytics_job())
+        if exporting:
+            job_progress(exporting)
+        if not manifest:
+            return
+        tables = load_analytics(ANALYTICS_DIR, (manifest['exported_at'], manifest['call_rows']))
+    else:
+        # Sin pyarrow no hay Parquet: las tablas se arman en memoria solo al pulsar
+        st.caption("Sin pyarrow las tablas no se guardan en Parquet; se arman en memoria al pulsar.")
+        if st.button("🔄 Armar tablas"):
+            st.session_state['analytics_tables'] = build_tables(store)
+        tables = st.session_state.get('analytics_tables')
+        if tables is None:
+            return
+
+    ideas = tables['ideas']
+    if ideas.empty:
+        st.info("No hay ideas todavía.")
+        return
+    target_seconds = script_target_seconds(st.session_state['data']['prompts']['scriptwriter'])
+    lengths, over_target, stats = script_length_distribution(ideas, target_seconds)
+    col_ideas, col_coverage, col_talents, col_over = st.columns(4)
+    col_ideas.metric("Ideas", len(ideas))
+    col_coverage.metric("Con guión", f"{ideas['has_script'].mean():.0%}")
+    col_talents.metric("Talentos", ideas['profile_name'].nunique())
+    col_over.metric(f"Guiones > {target_seconds} s", over_target)
+
+    st.markdown("**Mezcla de pilares por talento**")
+    mix = pillar_mix(ideas)
+    st.bar_chart(mix, horizontal=True)
+    st.dataframe(mix.style.format("{:.0%}"), use_container_width=True)
+
+    st.markdown("**Cobertura de guiones por tema**")
+    st.dataframe(
+        coverage(ideas).rename(columns={"profile_name": "talento", "topic_name": "tema", "with_script": "con guión", "with_draft": "con borrador", "coverage": "cobertura"}),
+        hide_index=True,
+        use_container_width=True,
+        column_config={"cobertura": st.column_config.ProgressColumn("cobertura", min_value=0, max_value=1, format="percent")}
+    )
+
+    st.markdown("**Duración estimada de los guiones**")
+    if lengths.sum():
+        st.bar_chart(lengths)
+        st.caption(f"Mediana ≈ {stats['50%']:.0f} s · máx. ≈ {stats['max']:.0f} s · {over_target} se pasan del objetivo de {target_seconds} s")
+    else:
+        st.caption("Todavía no hay guiones.")
+
+    calls = tables['calls']
+    if not calls.empty:
+        st.markdown("**Llamadas exportadas por etapa**")
+        st.dataframe(
+            calls.groupby(["stage", "model"], as_index=False).agg(llamadas=("ts", "size"), tokens_salida=("completion_tokens", "sum"), costo_usd=("cost", "sum")).rename(columns={"stage": "etapa", "model": "modelo"}),
+            hide_index=True,
+            use_container_width=True
+        )
 
 # --- COLUMNA IZQUIERDA: HERRAMIENTAS POR ETAPA ---
-with col_tools:
+@st.fragment
+@instrumented("herramientas")
+def render_tools(current_profile):
+    client = get_client()
+    stage = st.session_state['stage']
     
     # Wrapper con altura fija (550px) para scroll independiente
     tools_container = st.container(height=550)
     
     with tools_container:
-        if not current_profile:
+        if stage == "4. Analítica 📊":
+            # Reportes de todos los talentos: no depende del perfil activo
+            render_analytics()
+        elif not current_profile:
             st.warning("👈 Crea un perfil nuevo en la barra lateral para comenzar.")
         else:
             # --- VISTA 1: EL PERFILADOR ---
@@ -324,59 +1145,48 @@ with col_tools:
                         if not client:
                             st.error("Falta API Key.")
                         else:
-                            with st.spinner("Transcribiendo..."):
-                                try:
-                                    transcription = client.audio.transcriptions.create(
-                                        model="whisper-1", 
-                                        file=audio_file
-                                    )
-                                    text = transcription.text
-                                    st.success("¡Listo!")
-                                    current_profile['chat_history'].append({"role": "user", "content": f"[AUDIO]: {text}"})
-                                    st.rerun()
-                                except Exception as e:
-                                    st.error(f"Error: {e}")
+                            # El audio se corta en fragmentos que se transcriben en paralelo;
+                            # los ya transcritos quedan en caché y un reintento solo reenvía los fallidos
+                            progress = st.progress(0.0, text="Preparando audio...")
+
+                            def show_progress(done, total):
+                                progress.progress(done / total, text=f"Transcribiendo fragmento {done} de {total}...")
+
+                            try:
+                                text = transcribe_audio(
+                                    client, audio_file.getvalue(), audio_file.name, cache=completion_cache,
+                                    tags={"profile_id": st.session_state['data']['current_profile_id']},
+                                    on_progress=show_progress
+                                )
+                                st.success("¡Listo!")
+                                add_message(current_profile, {"role": "user", "content": f"[AUDIO]: {text}"})
+                                schedule_dna_update(client, st.session_state['data']['current_profile_id'], current_profile)
+                                st.rerun()
+                            except TranscriptionError as e:
+                                progress.empty()
+                                st.error(f"{e}. Pulsa 'Transcribir' de nuevo: solo se reenviarán los fragmentos fallidos.")
+                            except Exception as e:
+                                progress.empty()
+                                st.error(f"Error: {e}")
 
                 st.write("") # Espacio mínimo
                 
                 # Generar Perfil
-                if st.button("✅ Finalizar y Generar Perfil", type="primary", use_container_width=True):
+                dna_bypass_cache = bypass_cache_toggle("dna_bypass_cache")
+                pid = st.session_state['data']['current_profile_id']
+                dna_running = active_job("dna", profile_id=pid)
+                if st.button("✅ Finalizar y Generar Perfil", type="primary", use_container_width=True, disabled=bool(dna_running)):
                     if not client:
                         st.error("Falta API Key.")
                     elif len(current_profile['chat_history']) < 3:
                         st.warning("Conversación muy corta.")
                     else:
-                        with st.spinner("Analizando..."):
-                            history_text = "\n".join([f"{m['role']}: {m['content']}" for m in current_profile['chat_history']])
-                            extraction_prompt = f"""
-                            Analiza la siguiente entrevista y extrae el perfil del talento.
-                            Conversación:
-                            {history_text}
-                            
-                            Devuelve SOLO un JSON válido con estas claves exactas: 
-                            'nombre', 'arquetipo', 'tono', 'jerga_tecnica', 'opiniones_polemicas', 'temas_pasion'.
-                            """
-                            
-                            try:
-                                response = client.chat.completions.create(
-                                    model="gpt-4o",
-                                    messages=[
-                                        {"role": "system", "content": "Eres un asistente experto en extracción de datos JSON."},
-                                        {"role": "user", "content": extraction_prompt}
-                                    ],
-                                    response_format={"type": "json_object"}
-                                )
-                                json_text = response.choices[0].message.content
-                                current_profile['dna'] = json.loads(json_text)
-                                st.success("¡Perfil Generado!")
-                                st.rerun()
-                            except Exception as e:
-                                st.error(f"Error: {e}")
+                        submit_job("dna", f"Perfil de {current_profile['name']}", dna_job(client, pid, current_profile, dna_bypass_cache, dict(st.session_state['data']['routes'])), profile_id=pid)
+                if dna_running:
+                    job_progress(dna_running)
 
-                # Visualizador de Perfil
-                if current_profile['dna']:
-                    with st.expander("Ver ADN de Marca", expanded=True):
-                        st.json(current_profile['dna'])
+                # Visualizador de Perfil (se completa en vivo durante la entrevista)
+                render_dna_panel(current_profile)
             # --- VISTA 2: EL ESTRATEGA ---
             elif stage == "2. El Estratega 🧠":
                 st.subheader("🧠 Estrategia")
@@ -399,12 +1209,10 @@ with col_tools:
                         if st.button("Crear Tema"):
                             if new_topic_name:
                                 topic_id = str(uuid.uuid4())
-                                current_profile['topics'][topic_id] = {
-                                    "name": new_topic_name,
-                                    "ideas": []
-                                }
+                                current_profile['topics'][topic_id] = {"name": new_topic_name}
+                                store.create_topic(st.session_state['data']['current_profile_id'], topic_id, new_topic_name)
                                 st.success(f"Tema '{new_topic_name}' creado.")
-                                st.rerun()
+                                rerun_fragment()
                     
                     # Seleccionar Tema Activo
                     if not current_profile['topics']:
@@ -414,7 +1222,10 @@ with col_tools:
                         selected_topic_id = st.selectbox(
                             "Seleccionar Tema Activo:",
                             options=list(topic_options.keys()),
-                            format_func=lambda x: topic_options[x]
+                            format_func=lambda x: topic_options[x],
+                            key="strategist_topic_selector",
+                            on_change=cancel_prefetch_other_topics,
+                            args=("strategist_topic_selector",)
                         )
                         
                         current_topic = current_profile['topics'][selected_topic_id]
@@ -424,88 +1235,80 @@ with col_tools:
                         
                         # Configuración del Estratega (Prompt Editable)
                         with st.expander("⚙️ Configuración del Estratega (Prompt)", expanded=False):
-                            st.session_state['data']['prompts']['strategist'] = st.text_area(
+                            save_prompt("strategist", st.text_area(
                                 "Instrucciones para el Estratega:", 
                                 value=st.session_state['data']['prompts']['strategist'],
                                 height=300,
-                                help="Edita las instrucciones para cambiar cómo se generan las ideas. Mantén {topic_name} y {profile_str}."
-                            )
+                                help="Edita las instrucciones para cambiar cómo se generan las ideas. Mantén {profile_str} y {topic_name}; deja {topic_name} al final para aprovechar la caché de prompts."
+                            ))
+
+                        render_prefetch_settings(st.session_state['data']['current_profile_id'])
 
                         # Generar Ideas (Si está vacío)
-                        if not current_topic['ideas']:
-                            if st.button(f"Generar Ideas para {current_topic['name']}", type="primary", use_container_width=True):
+                        if not store.count_ideas(selected_topic_id):
+                            ideas_bypass_cache = bypass_cache_toggle("ideas_bypass_cache")
+                            ideas_running = active_job("ideas", topic_id=selected_topic_id)
+                            if st.button(f"Generar Ideas para {current_topic['name']}", type="primary", use_container_width=True, disabled=bool(ideas_running)):
                                 if not client:
                                     st.error("Falta API Key.")
                                 else:
-                                    with st.spinner("Pensando..."):
-                                        profile_str = json.dumps(current_profile['dna'])
-                                        
-                                        # Usar el prompt editable
-                                        raw_prompt = st.session_state['data']['prompts']['strategist']
-                                        ideas_prompt = raw_prompt.replace("{topic_name}", current_topic['name']).replace("{profile_str}", profile_str)
-                                        
-                                        try:
-                                            response = client.chat.completions.create(
-                                                model="gpt-4o",
-                                                messages=[
-                                                    {"role": "system", "content": "Eres un experto en crear conexión humana y contenido auténtico. Devuelve JSON."},
-                                                    {"role": "user", "content": ideas_prompt}
-                                                ],
-                                                response_format={"type": "json_object"}
-                                            )
-                                            data = json.loads(response.choices[0].message.content)
-                                            new_ideas = data.get('ideas', []) if isinstance(data, dict) else data
-                                            
-                                            # Asegurar ID y script null
-                                            for idea in new_ideas:
-                                                idea['id'] = str(uuid.uuid4())
-                                                if 'script' not in idea: idea['script'] = None
-                                                
-                                            current_topic['ideas'] = new_ideas
-                                            st.rerun()
-                                        except Exception as e:
-                                            st.error(f"Error: {e}")
+                                    submit_job(
+                                        "ideas",
+                                        f"Ideas para {current_topic['name']}",
+                                        ideas_job(
+                                            client,
+                                            st.session_state['data']['prompts']['strategist'],
+                                            current_topic['name'],
+                                            current_profile['dna'],
+                                            st.session_state['data']['current_profile_id'],
+                                            selected_topic_id,
+                                            ideas_bypass_cache,
+                                            stage_route("strategist"),
+                                            prefetch=prefetch_submitter(client, current_profile['dna'], st.session_state['data']['current_profile_id'], selected_topic_id, current_topic['name'])
+                                        ),
+                                        profile_id=st.session_state['data']['current_profile_id'],
+                                        topic_id=selected_topic_id
+                                    )
+                            if ideas_running:
+                                render_ideas_arriving(ideas_running.id, selected_topic_id)
 
                         # Mostrar Ideas Existentes
                         else:
                             # Botón para generar MÁS ideas
-                            if st.button("🔄 Generar 5 Ideas Más"):
+                            more_ideas_bypass_cache = bypass_cache_toggle("more_ideas_bypass_cache")
+                            ideas_running = active_job("ideas", topic_id=selected_topic_id)
+                            if st.button("🔄 Generar 5 Ideas Más", disabled=bool(ideas_running)):
                                 if not client:
                                     st.error("Falta API Key.")
                                 else:
-                                    with st.spinner("Pensando más ideas..."):
-                                        profile_str = json.dumps(current_profile['dna'])
-                                        more_ideas_prompt = f"""
-                                        Genera 5 ideas ADICIONALES de video para el tema '{current_topic['name']}' y este perfil.
-                                        MANTÉN EL ENFOQUE: Simple, humano, relatable, sin forzar la viralidad.
-                                        Perfil: {profile_str}
-                                        Output: JSON con clave 'ideas' (lista de objetos {{'titulo', 'pilar', 'gancho_visual'}}).
-                                        """
-                                        try:
-                                            response = client.chat.completions.create(
-                                                model="gpt-4o",
-                                                messages=[
-                                                    {"role": "system", "content": "Eres un experto en contenido auténtico. Devuelve JSON."},
-                                                    {"role": "user", "content": more_ideas_prompt}
-                                                ],
-                                                response_format={"type": "json_object"}
-                                            )
-                                            data = json.loads(response.choices[0].message.content)
-                                            new_ideas = data.get('ideas', []) if isinstance(data, dict) else data
-                                            for idea in new_ideas:
-                                                idea['id'] = str(uuid.uuid4())
-                                                idea['script'] = None
-                                            current_topic['ideas'].extend(new_ideas)
-                                            st.rerun()
-                                        except Exception as e:
-                                            st.error(f"Error: {e}")
+                                    submit_job(
+                                        "ideas",
+                                        f"5 ideas más para {current_topic['name']}",
+                                        ideas_job(
+                                            client,
+                                            st.session_state['data']['prompts']['strategist'],
+                                            current_topic['name'],
+                                            current_profile['dna'],
+                                            st.session_state['data']['current_profile_id'],
+                                            selected_topic_id,
+                                            more_ideas_bypass_cache,
+                                            stage_route("strategist"),
+                                            more=True,
+                                            prefetch=prefetch_submitter(client, current_profile['dna'], st.session_state['data']['current_profile_id'], selected_topic_id, current_topic['name'])
+                                        ),
+                                        profile_id=st.session_state['data']['current_profile_id'],
+                                        topic_id=selected_topic_id
+                                    )
+                            if ideas_running:
+                                render_ideas_arriving(ideas_running.id, selected_topic_id)
                             
                             # Agregar Idea Personalizada
                             with st.expander("➕ Agregar Idea Personalizada"):
                                 with st.form("custom_idea_form"):
                                     custom_title = st.text_input("Título de la Idea")
                                     custom_hook = st.text_input("Gancho Visual (Opcional)")
-                                    custom_pilar = st.selectbox("Pilar", ["EDUCACIÓN", "CURIOSIDAD", "POLÉMICA", "LIFESTYLE", "GAMIFICACIÓN", "OTRO"])
+                                    custom_pilar = st.selectbox("Pilar", [*IDEA_PILLARS, OTHER_PILLAR])
+                                    allow_duplicate = st.checkbox("Agregar aunque se parezca a otra idea del tema")
                                     
                                     if st.form_submit_button("Agregar Idea"):
                                         if custom_title:
@@ -516,18 +1319,30 @@ with col_tools:
                                                 "gancho_visual": custom_hook if custom_hook else "N/A",
                                                 "script": None
                                             }
-                                            current_topic['ideas'].append(new_custom_idea)
-                                            st.success("Idea agregada.")
-                                            st.rerun()
+                                            index = topic_index(selected_topic_id)
+                                            similarity, similar_title = index.most_similar(new_custom_idea)
+                                            if similarity >= DUPLICATE_THRESHOLD and not allow_duplicate:
+                                                st.warning(f"Se parece a «{similar_title}» ({similarity:.0%}). Marca la casilla para agregarla de todos modos.")
+                                            else:
+                                                index.add([new_custom_idea])
+                                                store.add_ideas(selected_topic_id, [new_custom_idea])
+                                                st.success("Idea agregada.")
+                                                rerun_fragment()
                                         else:
                                             st.warning("El título es obligatorio.")
 
+                            # Guiones de todo el tema en diferido (Batch API)
+                            with st.expander("🌙 Guiones en lote (Batch API)"):
+                                render_batch_panel(client, current_profile, selected_topic_id, "strategist_batch")
+
                             st.write("---")
-                            for idea in current_topic['ideas']:
+                            for idea in idea_page(selected_topic_id, idea_filters(selected_topic_id, "strategist_ideas"), "strategist_ideas"):
                                 with st.expander(f"[{idea['pilar']}] {idea['titulo']}"):
                                     st.write(f"**Gancho:** {idea['gancho_visual']}")
                                     if idea.get('script'):
                                         st.success("✅ Guión listo")
+                                    elif valid_draft(idea, st.session_state['data']['prompts']['scriptwriter']):
+                                        st.info("📝 Borrador listo para El Guionista")
 
             # --- VISTA 3: EL GUIONISTA ---
             elif stage == "3. El Guionista ✍️":
@@ -542,61 +1357,157 @@ with col_tools:
                         "Seleccionar Tema:",
                         options=list(topic_options.keys()),
                         format_func=lambda x: topic_options[x],
-                        key="script_topic_selector"
+                        key="script_topic_selector",
+                        on_change=cancel_prefetch_other_topics,
+                        args=("script_topic_selector",)
                     )
-                    current_topic = current_profile['topics'][selected_topic_id]
-                    
-                    if not current_topic['ideas']:
+                    if not store.count_ideas(selected_topic_id):
                         st.warning("Este tema no tiene ideas aún.")
                     else:
-                        # Selector de Idea
-                        idea_options = {idea['id']: idea['titulo'] for idea in current_topic['ideas']}
+                        # Guionización en lote (solo ideas sin guión; la lista se lee al pulsar)
+                        pending_count = store.count_ideas(selected_topic_id, scripted=False)
+                        with st.expander(f"⚡ Guionizar Todo el Tema ({pending_count} pendientes)"):
+                            script_workers = st.slider("Guiones en paralelo", 1, MAX_SCRIPT_WORKERS, DEFAULT_SCRIPT_WORKERS, key="script_workers")
+                            bulk_bypass_cache = bypass_cache_toggle("bulk_bypass_cache")
+                            scripts_running = active_job("scripts", topic_id=selected_topic_id)
+                            if st.button("Escribir Guiones Pendientes", disabled=not pending_count or bool(scripts_running), use_container_width=True):
+                                if not client:
+                                    st.error("Falta API Key.")
+                                else:
+                                    submit_job(
+                                        "scripts",
+                                        f"Guiones de {topic_options[selected_topic_id]}",
+                                        scripts_job(
+                                            client,
+                                            st.session_state['data']['prompts']['scriptwriter'],
+                                            current_profile['dna'],
+                                            st.session_state['data']['current_profile_id'],
+                                            selected_topic_id,
+                                            script_workers,
+                                            bulk_bypass_cache,
+                                            stage_route("scriptwriter")
+                                        ),
+                                        profile_id=st.session_state['data']['current_profile_id'],
+                                        topic_id=selected_topic_id
+                                    )
+                            if scripts_running:
+                                job_progress(scripts_running)
+
+                            st.divider()
+                            render_batch_panel(client, current_profile, selected_topic_id, "script_batch")
+
+                        # Selector de Idea (entre las de la página visible)
+                        page_ideas = {idea['id']: idea for idea in idea_page(selected_topic_id, idea_filters(selected_topic_id, "script_ideas"), "script_ideas")}
+                        scriptwriter_template = st.session_state['data']['prompts']['scriptwriter']
                         selected_idea_id = st.selectbox(
                             "Seleccionar Idea:",
-                            options=list(idea_options.keys()),
-                            format_func=lambda x: idea_options[x],
+                            options=list(page_ideas.keys()),
+                            format_func=lambda x: ("✅ " if page_ideas[x].get('script') else "📝 " if valid_draft(page_ideas[x], scriptwriter_template) else "") + page_ideas[x]['titulo'],
                             key="script_idea_selector"
                         )
                         
                         # Encontrar objeto idea seleccionado
-                        selected_idea = next((i for i in current_topic['ideas'] if i['id'] == selected_idea_id), None)
+                        selected_idea = page_ideas.get(selected_idea_id)
                         
                         if selected_idea:
                             st.caption(f"Gancho: {selected_idea['gancho_visual']}")
                             
                             # Configuración Avanzada (Prompt Editable)
                             with st.expander("⚙️ Configuración Avanzada del Guionista", expanded=False):
-                                st.session_state['data']['prompts']['scriptwriter'] = st.text_area(
+                                save_prompt("scriptwriter", st.text_area(
                                     "Instrucciones para el Guionista (Prompt):", 
                                     value=st.session_state['data']['prompts']['scriptwriter'],
                                     height=300,
-                                    help="Puedes editar estas instrucciones. Mantén {profile_str} y {idea_str} donde quieras que se inserten los datos."
-                                )
+                                    help="Puedes editar estas instrucciones. Mantén {profile_str} y {idea_str}; deja {idea_str} al final para aprovechar la caché de prompts."
+                                ))
                             
+                            script_bypass_cache = bypass_cache_toggle("script_bypass_cache")
+                            variant_count = st.number_input(
+                                "Variantes por petición", 1, MAX_SCRIPT_VARIANTS, 1, key="script_variant_count",
+                                help="Con más de una se piden guiones alternativos en una sola llamada: el prompt se paga una vez y quedan todos guardados en la idea."
+                            )
                             if st.button("Escribir Guión", type="primary", use_container_width=True):
                                 if not client:
                                     st.error("Falta API Key.")
                                 else:
-                                    with st.spinner("Escribiendo..."):
-                                        profile_str = json.dumps(current_profile['dna'])
-                                        idea_str = json.dumps(selected_idea)
-                                        
-                                        # Usar el prompt editable
-                                        raw_prompt = st.session_state['data']['prompts']['scriptwriter']
-                                        final_script_prompt = raw_prompt.replace("{profile_str}", profile_str).replace("{idea_str}", idea_str)
-                                        
-                                        try:
-                                            response = client.chat.completions.create(
-                                                model="gpt-4o",
-                                                messages=[
-                                                    {"role": "system", "content": "Eres un guionista experto."},
-                                                    {"role": "user", "content": final_script_prompt}
-                                                ]
-                                            )
-                                            selected_idea['script'] = response.choices[0].message.content
-                                            st.rerun()
-                                        except Exception as e:
-                                            st.error(f"Error: {e}")
+                                    # Usar el prompt editable
+                                    raw_prompt = st.session_state['data']['prompts']['scriptwriter']
+                                    final_script_prompt = build_script_prompt(raw_prompt, current_profile['dna'], selected_idea)
+                                    script_tags = {"stage": STAGE_SCRIPT, "profile_id": st.session_state['data']['current_profile_id'], "topic_id": selected_topic_id}
+                                    
+                                    try:
+                                        if variant_count > 1:
+                                            with st.spinner(f"Escribiendo {variant_count} variantes..."):
+                                                scripts = write_script_variants(
+                                                    client, final_script_prompt, variant_count, cache=completion_cache,
+                                                    bypass_cache=script_bypass_cache, tags=script_tags, route=stage_route("scriptwriter")
+                                                )
+                                            add_script_variants(selected_idea, scripts)
+                                            store.update_idea(selected_idea)
+                                            rerun_fragment()
+                                        stats = {}
+                                        with st.container(border=True):
+                                            script = st.write_stream(stream_chat(
+                                                client,
+                                                script_messages(final_script_prompt),
+                                                stats,
+                                                stage_route("scriptwriter"),
+                                                bypass_cache=script_bypass_cache,
+                                                tags=script_tags
+                                            ))
+                                        # El guión solo se guarda completo (como una variante más de la idea)
+                                        add_script_variants(selected_idea, [script])
+                                        store.update_idea(selected_idea)
+                                        if 'ttft' in stats:
+                                            st.session_state.setdefault('script_ttft', {})[selected_idea['id']] = (stats['ttft'], cached_prefix_note(stats))
+                                        rerun_fragment()
+                                    except Exception as e:
+                                        st.error(f"Error: {e}")
                             
+                            draft = valid_draft(selected_idea, st.session_state['data']['prompts']['scriptwriter'])
+                            if draft:
+                                st.caption("📝 Borrador pre-generado en segundo plano")
+                                st.text_area("Teleprompter (borrador):", value=draft, height=300)
+                                if st.button("✅ Usar Borrador", use_container_width=True):
+                                    add_script_variants(selected_idea, [draft])
+                                    store.update_idea(selected_idea)
+                                    rerun_fragment()
+
                             if selected_idea.get('script'):
+                                target_seconds = script_target_seconds(st.session_state['data']['prompts']['scriptwriter'])
+                                variants = script_variants(selected_idea)
+                                if len(variants) > 1:
+                                    # Cambiar de variante no llama al modelo: solo cambia la activa
+                                    variant_index = st.radio(
+                                        "Variante activa:",
+                                        range(len(variants)),
+                                        index=variants.index(selected_idea['script']),
+                                        format_func=lambda i: f"V{i + 1} · " + variant_label(script_metrics(variants[i], target_seconds)),
+                                        horizontal=True,
+                                        key=f"script_variant_{selected_idea['id']}_{len(variants)}"
+                                    )
+                                    if variants[variant_index] != selected_idea['script']:
+                                        set_active_variant(selected_idea, variants, variant_index)
+                                        store.update_idea(selected_idea)
                                 st.text_area("Teleprompter:", value=selected_idea['script'], height=300)
+                                metrics = script_metrics(selected_idea['script'], target_seconds)
+                                st.caption(f"📏 {metrics['words']} palabras · ≈ {metrics['seconds']:.0f} s hablado" + (
+                                    f" · ⚠️ se pasa {metrics['over']:.0f} s del objetivo de {target_seconds} s" if metrics['over'] > 0 else f" · dentro del objetivo de {target_seconds} s"
+                                ))
+                                script_ttft = st.session_state.get('script_ttft', {}).get(selected_idea['id'])
+                                if script_ttft is not None:
+                                    st.caption(f"⚡ Primer token en {script_ttft[0]:.2f}s" + script_ttft[1])
+
+
+# --- LAYOUT PRINCIPAL (2 COLUMNAS) ---
+col_tools, col_chat = st.columns([1, 1])
+
+current_profile = get_current_profile()
+
+with col_chat:
+    render_chat(current_profile)
+
+with col_tools:
+    render_tools(current_profile)
+
+recorder.record_rerun("app", time.perf_counter() - rerun_started, st.session_state.get('stage'), st.session_state['data'].get('current_profile_id'))
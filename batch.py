@@ -0,0 +1,150 @@
+# Guiones en diferido con la Batch API de OpenAI (mitad de precio, sin bloquear la interfaz):
+# se arma un JSONL con una petición por idea sin guión, se sube y se crea el lote; un hilo de
+# fondo consulta su estado y escribe cada guión en su idea (custom_id = id de la idea).
+import json
+import threading
+import time
+
+from openai.types.chat import ChatCompletion
+
+from factory import DEFAULT_MODEL, build_script_prompt, script_messages
+from gateway import default_gateway
+from metrics import STAGE_SCRIPT_BATCH, recorder
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+COMPLETION_WINDOW = "24h"
+# Cada cuánto el hilo de fondo consulta los lotes pendientes (segundos)
+POLL_SECONDS = 60
+# Estados en los que el lote todavía puede avanzar / ya no cambia
+PENDING_STATUSES = ("validating", "in_progress", "finalizing", "cancelling")
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def build_batch_lines(template, dna, ideas, model=DEFAULT_MODEL):
+    # Una línea JSONL por idea con la misma petición que haría "Escribir Guión"
+    return [
+        json.dumps({
+            "custom_id": idea['id'],
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {"model": model, "messages": script_messages(build_script_prompt(template, dna, idea))}
+        }, ensure_ascii=False)
+        for idea in ideas
+    ]
+
+
+def submit_batch(client, store, profile_id, topic_id, owner, template, dna, ideas, model=DEFAULT_MODEL):
+    # Sube el JSONL, crea el lote y lo registra; owner: hash de la API Key (para retomarlo tras reiniciar)
+    payload = ("\n".join(build_batch_lines(template, dna, ideas, model)) + "\n").encode("utf-8")
+    uploaded = default_gateway.call(client.files.create, file=("guiones.jsonl", payload), purpose="batch")
+    batch = default_gateway.call(
+        client.batches.create,
+        input_file_id=uploaded.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=COMPLETION_WINDOW,
+        metadata={"profile_id": profile_id, "topic_id": topic_id}
+    )
+    store.add_batch(batch.id, profile_id, topic_id, owner, [idea['id'] for idea in ideas], model, batch.status)
+    return batch.id
+
+
+def queued_idea_ids(store, topic_id):
+    # Ideas que ya están en un lote pendiente (para no encolarlas dos veces)
+    return {idea_id for batch in store.list_batches(topic_id, PENDING_STATUSES) for idea_id in batch['idea_ids']}
+
+
+def read_file(client, file_id):
+    if not file_id:
+        return ""
+    return default_gateway.call(client.files.content, file_id=file_id).text
+
+
+def apply_results(store, batch, output):
+    # Escribe cada guión en su idea; devuelve (aplicados, fallidos). Las ideas que ya tienen
+    # guión (escrito a mano mientras tanto) o que se borraron no se tocan.
+    applied, failed = 0, 0
+    elapsed = time.time() - batch['created_at']
+    tags = {"profile_id": batch['profile_id'], "topic_id": batch['topic_id']}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get('response') or {}
+        if result.get('error') or response.get('status_code') != 200:
+            failed += 1
+            recorder.record_call(STAGE_SCRIPT_BATCH, batch['model'], elapsed, error=result.get('error') or response.get('status_code'), tags=tags)
+            continue
+        completion = ChatCompletion.model_validate(response['body'])
+        recorder.record_call(STAGE_SCRIPT_BATCH, batch['model'], elapsed, usage=completion.usage, tags=tags, batch=True)
+        idea = store.get_idea(result['custom_id'])
+        if idea is not None and not idea.get('script'):
+            idea['script'] = completion.choices[0].message.content
+            store.update_idea(idea)
+            applied += 1
+    return applied, failed
+
+
+class BatchPoller:
+    # Un hilo por proceso que sigue los lotes enviados; se detiene solo cuando no queda ninguno
+    def __init__(self, store, interval=POLL_SECONDS):
+        self.store = store
+        self.interval = interval
+        self.clients = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def track(self, client, batch_id):
+        with self.lock:
+            self.clients[batch_id] = client
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="batch-poller", daemon=True)
+                self.thread.start()
+        self.wake.set()
+
+    def resume(self, client, owner):
+        # Lotes pendientes de esta API Key que nadie sigue (p. ej. después de reiniciar la app)
+        for batch in self.store.list_batches(statuses=PENDING_STATUSES, key_id=owner):
+            if batch['id'] not in self.clients:
+                self.track(client, batch['id'])
+
+    def poll_now(self):
+        self.wake.set()
+
+    def check(self, client, batch_id):
+        # Actualiza el estado guardado; si el lote terminó aplica sus resultados y devuelve True
+        batch = default_gateway.call(client.batches.retrieve, batch_id=batch_id)
+        if batch.status not in FINAL_STATUSES:
+            self.store.update_batch(batch_id, batch.status)
+            return False
+        row = self.store.get_batch(batch_id)
+        applied, failed = apply_results(self.store, row, read_file(client, batch.output_file_id))
+        # Las peticiones que la API rechazó vienen en el archivo de errores
+        failed += sum(1 for line in read_file(client, batch.error_file_id).splitlines() if line.strip())
+        errors = getattr(batch, "errors", None)
+        messages = [e.message for e in (getattr(errors, "data", None) or []) if getattr(e, "message", None)]
+        self.store.update_batch(batch_id, batch.status, applied, failed, "; ".join(messages) or None)
+        return True
+
+    def _run(self):
+        while True:
+            with self.lock:
+                pending = dict(self.clients)
+            for batch_id, client in pending.items():
+                try:
+                    finished = self.check(client, batch_id)
+                    self.errors.pop(batch_id, None)
+                except Exception as e:
+                    # Error de red o de la API: se reintenta en la próxima vuelta
+                    self.errors[batch_id] = str(e)
+                    finished = False
+                if finished:
+                    with self.lock:
+                        self.clients.pop(batch_id, None)
+            with self.lock:
+                if not self.clients:
+                    self.thread = None
+                    return
+            self.wake.wait(self.interval)
+            self.wake.clear()
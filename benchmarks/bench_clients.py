@@ -0,0 +1,71 @@
+# Mide el costo por llamada de construir un cliente de OpenAI en cada rerun (como hacía app.py)
+# frente a reutilizar el cliente del registro con pool keep-alive (clients.py), contra el mock.
+# Uso: python benchmarks/bench_clients.py --calls 200 --threads 8
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from openai import OpenAI
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from clients import ClientRegistry
+from metrics import percentile
+from mock_openai import MockConfig, start
+
+API_KEY = "sk-bench"
+REQUEST = {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": "Hola"}], "max_tokens": 5}
+
+
+def per_call_client(base_url):
+    # Comportamiento anterior: un cliente (y un pool HTTP) nuevo por rerun
+    return OpenAI(api_key=API_KEY, base_url=base_url, max_retries=0)
+
+
+def measure(get_client, calls, threads):
+    def one_call(_):
+        start = time.perf_counter()
+        get_client().chat.completions.create(**REQUEST)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        return list(executor.map(one_call, range(calls)))
+
+
+def report(name, timings, connections, calls):
+    print(f"{name}: mediana {statistics.median(timings) * 1000:.2f} ms, p95 {percentile(timings, 0.95) * 1000:.2f} ms, "
+          f"{connections} conexiones TCP para {calls} llamadas")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=1, help="Llamadas simultáneas (sesiones concurrentes)")
+    args = parser.parse_args()
+
+    # Sin latencia simulada: lo que queda es el costo de cliente, conexión y HTTP
+    config = MockConfig(latency=0.0, tokens_per_second=1e6)
+    server, base_url = start(config=config)
+    try:
+        measure(lambda: per_call_client(base_url), 5, 1)
+        config.connections = 0
+        timings = measure(lambda: per_call_client(base_url), args.calls, args.threads)
+        report("Cliente por rerun", timings, config.connections, args.calls)
+
+        registry = ClientRegistry()
+        measure(lambda: registry.get(API_KEY, base_url), 5, 1)
+        config.connections = 0
+        timings = measure(lambda: registry.get(API_KEY, base_url), args.calls, args.threads)
+        report("Registro con pool", timings, config.connections, args.calls)
+        registry.close()
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
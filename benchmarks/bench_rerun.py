@@ -0,0 +1,89 @@
+# Mide el tiempo de rerun de app.py con un perfil sintético grande (sin llamadas a la API).
+# Uso: python benchmarks/bench_rerun.py --messages 600 --ideas 400 --reruns 10
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+
+from streamlit.testing.v1 import AppTest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from dump import legacy_records
+from storage import FactoryStore
+
+APP_PATH = os.path.join(REPO_DIR, "app.py")
+STAGES = ["1. El Perfilador 🕵️", "2. El Estratega 🧠", "3. El Guionista ✍️"]
+
+
+def synthetic_profile(name, n_messages, n_ideas):
+    ideas = [
+        {
+            "id": str(uuid.uuid4()),
+            "titulo": f"Idea sintética {k}",
+            "pilar": ["EDUCACIÓN", "CURIOSIDAD", "LIFESTYLE"][k % 3],
+            "gancho_visual": "Plano cerrado al volante " * 3,
+            "script": ("Guión de prueba. " * 40) if k % 2 else None
+        }
+        for k in range(n_ideas)
+    ]
+    history = [
+        {"role": "assistant" if k % 2 == 0 else "user", "content": f"Mensaje {k}: " + "respuesta larga de entrevista " * 20}
+        for k in range(n_messages)
+    ]
+    return {
+        "name": name,
+        "dna": {"nombre": "Bench", "arquetipo": "Técnico"},
+        "chat_history": history,
+        "topics": {str(uuid.uuid4()): {"name": "Campaña", "ideas": ideas}}
+    }
+
+
+def synthetic_data(n_messages, n_ideas):
+    return {
+        "current_profile_id": "bench",
+        "profiles": {"bench": synthetic_profile("Perfil Benchmark", n_messages, n_ideas)}
+    }
+
+
+def measure(at, reruns):
+    timings = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(at.exception)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=600)
+    parser.add_argument("--ideas", type=int, default=400)
+    parser.add_argument("--reruns", type=int, default=10)
+    args = parser.parse_args()
+
+    # Base de datos y caché temporales para no tocar los datos reales
+    tmp_dir = tempfile.mkdtemp()
+    os.environ["INFLUENCER_FACTORY_DB"] = os.path.join(tmp_dir, "bench.db")
+    os.environ["INFLUENCER_FACTORY_CACHE"] = os.path.join(tmp_dir, "bench_cache.db")
+
+    # Las ideas se leen por página desde la base de datos: el perfil se siembra ahí
+    FactoryStore(os.environ["INFLUENCER_FACTORY_DB"]).import_records(legacy_records(synthetic_data(args.messages, args.ideas)), replace=True)
+
+    at = AppTest.from_file(APP_PATH, default_timeout=120)
+    at.run()
+    for stage in STAGES:
+        at.sidebar.radio[0].set_value(stage)
+        timings = measure(at, args.reruns)
+        print(f"{stage}: mediana {statistics.median(timings) * 1000:.1f} ms, máx {max(timings) * 1000:.1f} ms "
+              f"({args.messages} mensajes, {args.ideas} ideas, {args.reruns} reruns)")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,337 @@
+# Suite de benchmarks de punta a punta contra el mock local de OpenAI (sin gastar dinero).
+# Mide: latencia de rerun según cantidad de perfiles/ideas/mensajes, el flujo completo
+# entrevista → ADN → ideas → guiones, el rendimiento con varias sesiones concurrentes y que la
+# detección de duplicados no descarte ideas distintas.
+# Los resultados se guardan en benchmarks/results/<commit>.json para comparar entre commits.
+# Uso:
+#   python benchmarks/bench_suite.py
+#   python benchmarks/bench_suite.py --quick --compare HEAD~1
+#   python benchmarks/bench_suite.py --latency 0.5 --tokens-per-second 60 --error-rate 0.1
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+
+from bench_rerun import APP_PATH, REPO_DIR, STAGES, synthetic_profile
+from factory import DEFAULT_PROMPTS
+from gateway import default_gateway
+from dedupe import IdeaIndex, split_duplicates
+from mock_openai import IDEA_FORMATS, IDEA_SUBJECTS, MockConfig, start
+from storage import FactoryStore
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# (perfiles, mensajes por perfil, ideas por perfil)
+RERUN_GRID = [(1, 50, 50), (1, 600, 50), (1, 50, 400), (1, 600, 400), (50, 50, 50)]
+QUICK_RERUN_GRID = [(1, 50, 50), (1, 600, 400)]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(timings):
+    return {
+        "p50_ms": round(percentile(timings, 0.5) * 1000, 1),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 1),
+        "max_ms": round(max(timings) * 1000, 1),
+        "n": len(timings)
+    }
+
+
+def fresh_environment(profiles):
+    # Base de datos y caché nuevas por escenario; se vacían los singletons de st.cache_resource
+    tmp_dir = tempfile.mkdtemp(prefix="bench_")
+    os.environ["INFLUENCER_FACTORY_DB"] = os.path.join(tmp_dir, "bench.db")
+    os.environ["INFLUENCER_FACTORY_CACHE"] = os.path.join(tmp_dir, "bench_cache.db")
+    st.cache_resource.clear()
+    seed = FactoryStore(os.environ["INFLUENCER_FACTORY_DB"])
+    for pid, profile in profiles.items():
+        seed.save_profile(pid, profile)
+    seed.set_setting("current_profile_id", next(iter(profiles), None))
+    seed.set_setting("prompts", dict(DEFAULT_PROMPTS))
+
+
+def open_session(profile_id=None, profile_name=None):
+    at = AppTest.from_file(APP_PATH, default_timeout=300)
+    if profile_id:
+        # Sesión apuntando a un perfil propio (se carga desde la base de datos bajo demanda)
+        at.session_state["data"] = {
+            "current_profile_id": profile_id,
+            "profiles": {profile_id: {"name": profile_name}},
+            "prompts": dict(DEFAULT_PROMPTS)
+        }
+    at.run()
+    at.text_input(key="api_key").set_value("sk-mock").run()
+    check(at)
+    return at
+
+
+def check(at):
+    if at.exception:
+        raise RuntimeError(at.exception)
+
+
+def timed(action):
+    start_time = time.perf_counter()
+    action()
+    return time.perf_counter() - start_time
+
+
+def find(widgets, label):
+    for widget in widgets:
+        if widget.label.startswith(label):
+            return widget
+    raise KeyError(label)
+
+
+def wait_for_jobs(at, timeout=120):
+    # Los trabajos largos corren en segundo plano: reruns hasta que la barra lateral no muestre ninguno en curso
+    deadline = time.perf_counter() + timeout
+    while any(c.value.startswith("⏳") for c in at.sidebar.caption) or at.sidebar.get("progress"):
+        if time.perf_counter() > deadline:
+            raise TimeoutError("Trabajos en segundo plano sin terminar")
+        time.sleep(0.05)
+        at.run()
+        check(at)
+
+
+def bench_reruns(grid, reruns):
+    results = []
+    for n_profiles, n_messages, n_ideas in grid:
+        profiles = {f"bench-{k}": synthetic_profile(f"Perfil {k}", n_messages, n_ideas) for k in range(n_profiles)}
+        fresh_environment(profiles)
+        at = open_session()
+        entry = {"profiles": n_profiles, "messages": n_messages, "ideas": n_ideas, "stages": {}}
+        for stage in STAGES:
+            at.sidebar.radio(key="stage").set_value(stage).run()
+            timings = []
+            for _ in range(reruns):
+                timings.append(timed(at.run))
+                check(at)
+            entry["stages"][stage] = summarize(timings)
+        results.append(entry)
+        print(f"rerun {n_profiles} perfiles × {n_messages} mensajes × {n_ideas} ideas: " + ", ".join(
+            f"{stage.split()[2]} p50 {s['p50_ms']} ms" for stage, s in entry["stages"].items()
+        ))
+    return results
+
+
+def bench_end_to_end(turns):
+    fresh_environment({"e2e": {"name": "Talento E2E", "dna": None, "chat_history": [], "topics": {}}})
+    at = open_session()
+    phases = {}
+
+    def interview():
+        for k in range(turns):
+            at.chat_input[0].set_value(f"Respuesta {k} de la entrevista sobre karting y simuladores").run()
+            check(at)
+
+    def finalize_dna():
+        find(at.button, "✅ Finalizar y Generar Perfil").click().run()
+        check(at)
+        wait_for_jobs(at)
+
+    def ideas():
+        at.sidebar.radio(key="stage").set_value(STAGES[1]).run()
+        find(at.text_input, "Nombre del Tema").set_value("Temporada").run()
+        find(at.button, "Crear Tema").click().run()
+        find(at.button, "Generar Ideas para").click().run()
+        check(at)
+        wait_for_jobs(at)
+
+    def scripts():
+        at.sidebar.radio(key="stage").set_value(STAGES[2]).run()
+        find(at.button, "Escribir Guiones Pendientes").click().run()
+        check(at)
+        wait_for_jobs(at)
+
+    phases["interview_s"] = timed(interview)
+    phases["dna_s"] = timed(finalize_dna)
+    phases["ideas_s"] = timed(ideas)
+    phases["scripts_s"] = timed(scripts)
+    profile = at.session_state["data"]["profiles"]["e2e"]
+    results_store = FactoryStore(os.environ["INFLUENCER_FACTORY_DB"])
+    ideas_list = [i for tid in profile["topics"] for i in results_store.query_ideas(tid)]
+    result = {key: round(value, 2) for key, value in phases.items()}
+    result.update({
+        "total_s": round(sum(phases.values()), 2),
+        "turns": turns,
+        "ideas": len(ideas_list),
+        "scripts": sum(1 for i in ideas_list if i.get("script"))
+    })
+    print(f"e2e: entrevista {result['interview_s']} s, ADN {result['dna_s']} s, ideas {result['ideas_s']} s, "
+          f"guiones {result['scripts_s']} s ({result['scripts']}/{result['ideas']}) → total {result['total_s']} s")
+    return result
+
+
+def bench_dedupe():
+    # Títulos con el mismo formato y distinto tema no pueden marcarse como duplicados;
+    # el mismo título con otros signos o artículos sí
+    start_time = time.perf_counter()
+    for format_ in IDEA_FORMATS:
+        ideas = [{"id": str(k), "titulo": f"{format_} {subject}"} for k, subject in enumerate(IDEA_SUBJECTS)]
+        unique, duplicates = split_duplicates(ideas, IdeaIndex())
+        if duplicates:
+            raise AssertionError(f"Marcadas como duplicadas: {[(i['titulo'], t) for i, t, _ in duplicates]}")
+    index = IdeaIndex([{"id": "0", "titulo": "3 errores con el setup"}])
+    for title in ("¡3 errores con el setup!", "Los 3 errores con el setup"):
+        if split_duplicates([{"id": "1", "titulo": title}], index)[1] == []:
+            raise AssertionError(f"No marcada como duplicada: {title}")
+    if split_duplicates([{"id": "2", "titulo": ""}], IdeaIndex([{"id": "3", "titulo": ""}]))[1]:
+        raise AssertionError("Ideas sin título marcadas como duplicadas")
+    result = {"titles": len(IDEA_FORMATS) * len(IDEA_SUBJECTS), "elapsed_s": round(time.perf_counter() - start_time, 2)}
+    print(f"dedupe: {result['titles']} títulos distintos sin falsos duplicados ({result['elapsed_s']} s)")
+    return result
+
+
+def bench_concurrency(sessions, turns):
+    profiles = {f"session-{k}": synthetic_profile(f"Sesión {k}", 20, 20) for k in range(sessions)}
+    fresh_environment(profiles)
+    apps = [open_session(pid, profile["name"]) for pid, profile in profiles.items()]
+    turn_timings, errors = [], []
+    lock = threading.Lock()
+
+    def worker(index, at):
+        for k in range(turns):
+            try:
+                elapsed = timed(lambda: at.chat_input[0].set_value(f"Sesión {index}, turno {k}").run())
+                check(at)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                return
+            with lock:
+                turn_timings.append(elapsed)
+
+    threads = [threading.Thread(target=worker, args=(index, at)) for index, at in enumerate(apps)]
+    wall = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall
+    result = {
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "wall_s": round(wall, 2),
+        "turns_per_s": round(len(turn_timings) / wall, 2),
+        "turn": summarize(turn_timings) if turn_timings else None,
+        "errors": len(errors)
+    }
+    print(f"concurrencia: {sessions} sesiones × {turns} turnos en {result['wall_s']} s "
+          f"({result['turns_per_s']} turnos/s, {result['errors']} errores)")
+    return result
+
+
+def git_revision(ref="HEAD"):
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", ref], cwd=REPO_DIR, text=True, stderr=subprocess.DEVNULL).strip()
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def git_dirty():
+    try:
+        return bool(subprocess.check_output(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR, text=True).strip())
+    except (subprocess.CalledProcessError, FileNotFoundError):
+        return None
+
+
+def compare(current, previous):
+    # Diferencia de las métricas principales contra otra ejecución guardada
+    print(f"\nComparación con {previous['commit']}:")
+
+    def line(label, new, old):
+        if new is None or old is None:
+            return
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"  {label}: {old} → {new} ({change:+.1f}%)")
+
+    old_reruns = {(r["profiles"], r["messages"], r["ideas"]): r for r in previous.get("rerun", [])}
+    for entry in current.get("rerun", []):
+        old = old_reruns.get((entry["profiles"], entry["messages"], entry["ideas"]))
+        if old:
+            for stage, stats in entry["stages"].items():
+                if stage in old["stages"]:
+                    line(f"rerun {entry['profiles']}/{entry['messages']}/{entry['ideas']} {stage} p50 ms", stats["p50_ms"], old["stages"][stage]["p50_ms"])
+    if current.get("e2e") and previous.get("e2e"):
+        for key in ["interview_s", "dna_s", "ideas_s", "scripts_s", "total_s"]:
+            line(f"e2e {key}", current["e2e"].get(key), previous["e2e"].get(key))
+    if current.get("concurrency") and previous.get("concurrency"):
+        line("concurrencia turnos/s", current["concurrency"]["turns_per_s"], previous["concurrency"]["turns_per_s"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de punta a punta contra el mock de OpenAI.")
+    parser.add_argument("--quick", action="store_true", help="Grilla de reruns reducida")
+    parser.add_argument("--reruns", type=int, default=5)
+    parser.add_argument("--turns", type=int, default=6, help="Turnos de entrevista en el flujo completo")
+    parser.add_argument("--sessions", type=int, default=4, help="Sesiones concurrentes")
+    parser.add_argument("--session-turns", type=int, default=3)
+    parser.add_argument("--only", choices=["rerun", "e2e", "concurrency", "dedupe"], action="append")
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    # Por defecto sin límite efectivo: se mide la app, no el limitador; pasar los de la organización para simularlo
+    parser.add_argument("--rpm", type=int, default=1_000_000, help="Límite de peticiones por minuto del gateway")
+    parser.add_argument("--tpm", type=int, default=1_000_000_000, help="Límite de tokens por minuto del gateway")
+    parser.add_argument("--compare", metavar="REF", help="Commit (o archivo JSON) contra el que comparar")
+    parser.add_argument("--output", help="Archivo de resultados (por defecto, benchmarks/results/<commit>.json)")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.tokens_per_second, args.error_rate, seed=args.seed)
+    server, base_url = start(config=config)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    default_gateway.configure(args.rpm, args.tpm)
+    only = set(args.only or ["rerun", "e2e", "concurrency", "dedupe"])
+
+    commit = git_revision()
+    results = {
+        "commit": commit,
+        "dirty": git_dirty(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "streamlit": st.__version__,
+        "mock": {"latency": args.latency, "tokens_per_second": args.tokens_per_second, "error_rate": args.error_rate}
+    }
+    try:
+        if "rerun" in only:
+            results["rerun"] = bench_reruns(QUICK_RERUN_GRID if args.quick else RERUN_GRID, args.reruns)
+        if "e2e" in only:
+            results["e2e"] = bench_end_to_end(args.turns)
+        if "dedupe" in only:
+            results["dedupe"] = bench_dedupe()
+        if "concurrency" in only:
+            results["concurrency"] = bench_concurrency(args.sessions, args.session_turns)
+    finally:
+        server.shutdown()
+    results["mock"]["requests"] = len(config.calls)
+    results["gateway"] = default_gateway.stats()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit or 'local'}{'-dirty' if results['dirty'] else ''}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Resultados guardados en {output}")
+
+    if args.compare:
+        path = args.compare if args.compare.endswith(".json") else os.path.join(RESULTS_DIR, f"{git_revision(args.compare)}.json")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                compare(results, json.load(f))
+        else:
+            print(f"No hay resultados guardados para {args.compare} ({path})")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+# Servidor local que imita la API de OpenAI (chat completions con JSON y streaming, y
+# transcripción de audio, archivos y lotes de la Batch API) para medir la app sin gastar dinero.
+# Uso:
+#   python benchmarks/mock_openai.py --port 8765 --latency 0.3 --tokens-per-second 80 --error-rate 0.05
+#   OPENAI_BASE_URL=http://127.0.0.1:8765/v1 streamlit run app.py
+import argparse
+import email.policy
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DNA_RESPONSE = {
+    "nombre": "Talento Mock",
+    "arquetipo": "El Mentor Técnico",
+    "tono": "Cercano y directo",
+    "jerga_tecnica": ["telemetría", "apex", "setup"],
+    "opiniones_polemicas": ["El talento sin datos no alcanza"],
+    "temas_pasion": ["karting", "simuladores"]
+}
+PILLARS = ["EDUCACIÓN", "CURIOSIDAD", "OPINIÓN/REFLEXIÓN", "LIFESTYLE", "GAMIFICACIÓN"]
+# Vocabulario para ideas variadas (títulos casi idénticos se descartarían como duplicados)
+IDEA_FORMATS = ["3 errores con", "El mito de", "Reto:", "Un día con", "Cuánto cuesta", "Mi opinión honesta sobre",
+                "Lo que aprendí de", "Guía rápida de", "Preguntas sobre", "Detrás de cámaras:"]
+IDEA_SUBJECTS = ["los neumáticos", "la telemetría", "el simulador", "la frenada", "el paddock", "los karts de alquiler",
+                 "el casco", "la primera carrera", "el setup", "la curva rápida", "los patrocinadores", "el viaje al circuito",
+                 "la lluvia", "el entrenamiento físico", "la dieta del piloto", "la licencia", "el equipo", "los nervios",
+                 "la vuelta rápida", "el mecánico"]
+IDEA_SHOTS = ["Plano cenital", "Cámara en mano", "Primer plano", "Cámara lenta", "Pantalla dividida", "Toma desde el casco"]
+SCRIPT_LINE = "Frase corta con jerga explicada rápido para el cuerpo del video."
+# Caché de prompts simulada: 1024 tokens mínimos, bloques de 128 (≈4 caracteres por token)
+CACHE_MIN_CHARS = 4096
+CACHE_BLOCK_CHARS = 512
+
+
+class MockConfig:
+    def __init__(self, latency=0.2, tokens_per_second=200.0, error_rate=0.0, error_status=429,
+                 retry_after_ms=200, script_words=120, seed=None, batch_seconds=2.0, idea_defect_rate=0.0,
+                 model_latency=None):
+        # latency: segundos hasta el primer token; tokens_per_second: ritmo de generación;
+        # batch_seconds: lo que tarda un lote de la Batch API en completarse;
+        # idea_defect_rate: probabilidad de que cada idea (y la cola del JSON) llegue defectuosa;
+        # model_latency: latencia propia de algunos modelos ({"gpt-4o": 3.0}) para probar el enrutado
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after_ms = retry_after_ms
+        self.script_words = script_words
+        self.batch_seconds = batch_seconds
+        self.idea_defect_rate = idea_defect_rate
+        self.model_latency = model_latency or {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counter = 0
+        self.calls = []
+        # Conexiones TCP aceptadas (con keep-alive, menos que peticiones)
+        self.connections = 0
+        # Prefijos de prompt ya vistos (imita la caché de prompts del proveedor)
+        self.prefixes = set()
+        # Archivos subidos / generados y lotes de la Batch API
+        self.files = {}
+        self.batches = {}
+
+    def record(self, kind, request):
+        with self.lock:
+            self.counter += 1
+            self.calls.append((kind, request))
+            return self.counter
+
+    def usage(self, request, completion_tokens):
+        prompt_tokens = sum(estimate_tokens(m['content']) for m in request['messages'] if isinstance(m.get('content'), str))
+        return {
+            "prompt_tokens": prompt_tokens,
+            # Cada alternativa de n= se cobra como salida; el prompt, una vez
+            "completion_tokens": completion_tokens * (request.get('n') or 1),
+            "total_tokens": prompt_tokens + completion_tokens * (request.get('n') or 1),
+            "prompt_tokens_details": {"cached_tokens": self.cached_tokens(prompt_text(request))}
+        }
+
+    def cached_tokens(self, prompt):
+        # Como el proveedor: solo prompts de ≥1024 tokens, en bloques de 128 tokens de prefijo idéntico
+        blocks = [prompt[:end] for end in range(CACHE_BLOCK_CHARS, len(prompt) + 1, CACHE_BLOCK_CHARS)]
+        with self.lock:
+            hits = 0
+            for block in blocks:
+                if block not in self.prefixes:
+                    break
+                hits += 1
+            self.prefixes.update(blocks)
+        if len(prompt) < CACHE_MIN_CHARS:
+            return 0
+        return estimate_tokens(prompt[:hits * CACHE_BLOCK_CHARS]) if hits else 0
+
+    def should_fail(self):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def prompt_text(request):
+    return "\n".join(m['content'] for m in request['messages'] if isinstance(m.get('content'), str))
+
+
+def completion(request, content, usage):
+    return {
+        "id": "mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request['model'],
+        "choices": [
+            # Con n= cada alternativa cierra distinto para que no se confundan
+            {"index": k, "message": {"role": "assistant", "content": content if k == 0 else f"{content}\n\n(Variante {k + 1})"}, "finish_reason": "stop"}
+            for k in range(request.get('n') or 1)
+        ],
+        "usage": usage
+    }
+
+
+def damage_idea(idea, rng):
+    # Defectos que la app debe reparar (clave con otra grafía, pilar raro) o volver a pedir (sin gancho)
+    defect = rng.choice(["key_case", "pillar", "no_pillar", "no_hook"])
+    if defect == "key_case":
+        idea["Título"] = idea.pop("titulo")
+    elif defect == "pillar":
+        idea["pilar"] = idea["pilar"].split("/")[0].lower()
+    elif defect == "no_pillar":
+        del idea["pilar"]
+    else:
+        del idea["gancho_visual"]
+    return idea
+
+
+def chat_content(request, call_number, script_words, idea_defect_rate=0.0):
+    prompt = prompt_text(request)
+    if (request.get('response_format') or {}).get('type') == "json_object":
+        if "'ideas'" in prompt:
+            # La última cifra pedida manda ("10 ideas" y luego "5 ideas ADICIONALES")
+            counts = re.findall(r"(\d+) ideas", prompt)
+            count = int(counts[-1]) if counts else 10
+            rng = random.Random(call_number)
+            ideas = [
+                {
+                    "titulo": f"{rng.choice(IDEA_FORMATS)} {subject}",
+                    "pilar": PILLARS[k % len(PILLARS)],
+                    "gancho_visual": f"{rng.choice(IDEA_SHOTS)}: {subject}"
+                }
+                for k, subject in enumerate(rng.sample(IDEA_SUBJECTS, min(count, len(IDEA_SUBJECTS))))
+            ]
+            if idea_defect_rate:
+                ideas = [damage_idea(idea, rng) if rng.random() < idea_defect_rate else idea for idea in ideas]
+            content = json.dumps({"ideas": ideas}, ensure_ascii=False)
+            if idea_defect_rate and rng.random() < idea_defect_rate:
+                # Respuesta cortada (como con max_tokens): la última idea queda a medias
+                content = content[:int(len(content) * 0.93)]
+            return content
+        return json.dumps(DNA_RESPONSE, ensure_ascii=False)
+    if "Idea:" in prompt:
+        repeats = max(1, script_words // len(SCRIPT_LINE.split()))
+        return f"Guión mock {call_number}\n\n" + " ".join([SCRIPT_LINE] * repeats)
+    return f"Respuesta mock {call_number}: cuéntame más sobre eso."
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    config = MockConfig()
+    # HTTP/1.1 para que los clientes puedan reutilizar la conexión (keep-alive)
+    protocol_version = "HTTP/1.1"
+    # Cabeceras y cuerpo van en escrituras separadas: sin esto Nagle + ACK diferido suman ~40 ms
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.config.lock:
+            self.config.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('content-length', 0)))
+        if self.config.should_fail():
+            return self._error(self.config.error_status)
+        if self.path.endswith("/audio/transcriptions"):
+            call_number = self.config.record("audio", {"bytes": len(body)})
+            time.sleep(self.config.latency)
+            return self._json({"text": f"Transcripción mock número {call_number} del audio."})
+        if self.path.endswith("/chat/completions"):
+            request = json.loads(body)
+            call_number = self.config.record("chat", request)
+            return self._chat(request, call_number)
+        if self.path.endswith("/files"):
+            return self._json(self._upload(body))
+        if self.path.endswith("/batches"):
+            return self._json(self._create_batch(json.loads(body)))
+        self._error(404)
+
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get('content-length', 0)))
+        match = re.search(r"/batches/([\w-]+)$", self.path)
+        if match and match.group(1) in self.config.batches:
+            return self._json(self._batch_status(match.group(1)))
+        match = re.search(r"/files/([\w-]+)/content$", self.path)
+        if match and match.group(1) in self.config.files:
+            data = self.config.files[match.group(1)]
+            self.send_response(200)
+            self.send_header('content-type', "application/octet-stream")
+            self.send_header('content-length', str(len(data)))
+            self.end_headers()
+            return self.wfile.write(data)
+        self._error(404)
+
+    def _upload(self, body):
+        # multipart/form-data con el JSONL en el campo "file"
+        message = BytesParser(policy=email.policy.default).parsebytes(
+            b"Content-Type: " + self.headers['content-type'].encode() + b"\r\n\r\n" + body
+        )
+        part = next(p for p in message.iter_parts() if p.get_param("name", header="content-disposition") == "file")
+        data = part.get_payload(decode=True)
+        file_id = f"file-mock-{len(self.config.files) + 1}"
+        self.config.files[file_id] = data
+        return {"id": file_id, "object": "file", "bytes": len(data), "created_at": int(time.time()),
+                "filename": part.get_filename(), "purpose": "batch", "status": "processed"}
+
+    def _create_batch(self, request):
+        lines = [json.loads(line) for line in self.config.files[request['input_file_id']].decode("utf-8").splitlines() if line.strip()]
+        batch_id = f"batch_mock_{len(self.config.batches) + 1}"
+        self.config.batches[batch_id] = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": request['endpoint'],
+            "input_file_id": request['input_file_id'],
+            "completion_window": request['completion_window'],
+            "status": "validating",
+            "created_at": int(time.time()),
+            "metadata": request.get('metadata'),
+            "request_counts": {"total": len(lines), "completed": 0, "failed": 0},
+            "started": time.monotonic(),
+            "lines": lines
+        }
+        return self._batch_status(batch_id)
+
+    def _batch_status(self, batch_id):
+        # validating → in_progress → completed (a los batch_seconds); al completarse se generan
+        # el archivo de salida y el de errores (error_rate se aplica por petición)
+        batch = self.config.batches[batch_id]
+        elapsed = time.monotonic() - batch['started']
+        if batch['status'] != "completed":
+            batch['status'] = "completed" if elapsed >= self.config.batch_seconds else "in_progress" if elapsed > 0 else "validating"
+            if batch['status'] == "completed":
+                output, errors = [], []
+                for line in batch['lines']:
+                    if self.config.should_fail():
+                        errors.append({"id": f"req_{line['custom_id']}", "custom_id": line['custom_id'], "response": None,
+                                       "error": {"code": "mock_error", "message": "Error simulado"}})
+                        continue
+                    call_number = self.config.record("batch", line['body'])
+                    content = chat_content(line['body'], call_number, self.config.script_words)
+                    usage = self.config.usage(line['body'], len(content.split()))
+                    output.append({"id": f"req_{line['custom_id']}", "custom_id": line['custom_id'], "error": None,
+                                   "response": {"status_code": 200, "request_id": "mock", "body": completion(line['body'], content, usage)}})
+                for kind, rows in (("output_file_id", output), ("error_file_id", errors)):
+                    if rows:
+                        file_id = f"file-mock-{len(self.config.files) + 1}"
+                        self.config.files[file_id] = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in rows).encode("utf-8")
+                        batch[kind] = file_id
+                batch['request_counts'] = {"total": len(batch['lines']), "completed": len(output), "failed": len(errors)}
+                batch['completed_at'] = int(time.time())
+        return {k: v for k, v in batch.items() if k not in ("started", "lines")}
+
+    def _chat(self, request, call_number):
+        content = chat_content(request, call_number, self.config.script_words, self.config.idea_defect_rate)
+        pieces = re.findall(r"\S+\s*", content)
+        usage = self.config.usage(request, len(pieces))
+        time.sleep(self.config.model_latency.get(request['model'], self.config.latency))
+        if request.get('stream'):
+            self.send_response(200)
+            self.send_header('content-type', "text/event-stream")
+            # El stream no lleva content-length: se cierra la conexión al terminar
+            self.send_header('connection', "close")
+            self.close_connection = True
+            self.end_headers()
+            for piece in pieces:
+                self._event(self._chunk(request, {"content": piece}))
+                time.sleep(1 / self.config.tokens_per_second)
+            self._event(self._chunk(request, {}, finish_reason="stop"))
+            if (request.get('stream_options') or {}).get('include_usage'):
+                self._event({"id": "mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": request['model'], "choices": [], "usage": usage})
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+        time.sleep(len(pieces) / self.config.tokens_per_second)
+        self._json(completion(request, content, usage))
+
+    def _chunk(self, request, delta, finish_reason=None):
+        return {
+            "id": "mock",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": request['model'],
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+
+    def _event(self, payload):
+        self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _json(self, payload, status=200, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header('content-type', "application/json")
+        self.send_header('content-length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _error(self, status):
+        headers = {"retry-after-ms": str(self.config.retry_after_ms)} if status == 429 else {}
+        self._json({"error": {"message": f"Error simulado {status}", "type": "mock_error", "code": None}}, status, headers)
+
+
+def start(port=0, config=None):
+    # Arranca el servidor en un hilo; devuelve (servidor, base_url)
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"config": config or MockConfig()})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor mock de la API de OpenAI.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="Segundos hasta el primer token")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fracción de peticiones que fallan")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--idea-defect-rate", type=float, default=0.0, help="Fracción de ideas que llegan con defectos")
+    args = parser.parse_args()
+    config = MockConfig(args.latency, args.tokens_per_second, args.error_rate, args.error_status, seed=args.seed,
+                        idea_defect_rate=args.idea_defect_rate)
+    server, base_url = start(args.port, config)
+    print(f"Mock de OpenAI escuchando en {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+# Generación por lotes sin Streamlit: ideas y guiones faltantes para cada perfil × tema.
+# Uso:
+#   python cli.py influencer_factory_data.ndjson.gz -o resultado.ndjson.gz --workers 8
+#   python cli.py manifiesto.json -o resultado.json
+# Lee la exportación de la app (NDJSON con gzip), el JSON único de versiones anteriores o un
+# manifiesto, y por defecto escribe el resultado en el mismo formato que la entrada.
+# La API Key se lee de OPENAI_API_KEY. El progreso se guarda en un checkpoint JSONL para
+# que una ejecución interrumpida se reanude sin repetir llamadas pagadas.
+import argparse
+import json
+import os
+import sys
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from clients import default_registry
+from dump import DumpError, is_dump, legacy_records, read_records, records_to_data, write_records
+from factory import DEFAULT_PROMPTS, build_script_prompt, generate_ideas, upgrade_prompts, write_script
+from llm_cache import CompletionCache
+from metrics import recorder
+
+DEFAULT_WORKERS = 8
+# Espacio de nombres para IDs deterministas de manifiestos (reanudar con los mismos IDs)
+MANIFEST_NAMESPACE = uuid.UUID("5b0f3a4e-6f1c-4d8e-9a57-2c1d7e0b9f42")
+
+
+def manifest_to_data(manifest):
+    # Manifiesto: {"profiles": [{"name", "dna", "topics": ["Tema", ...]}], "prompts": {...}}
+    profiles = {}
+    for entry in manifest['profiles']:
+        pid = str(uuid.uuid5(MANIFEST_NAMESPACE, entry['name']))
+        profiles[pid] = {
+            "name": entry['name'],
+            "dna": entry.get('dna'),
+            "chat_history": [],
+            "topics": {
+                str(uuid.uuid5(MANIFEST_NAMESPACE, f"{entry['name']}/{topic_name}")): {"name": topic_name, "ideas": []}
+                for topic_name in entry.get('topics', [])
+            }
+        }
+    return {
+        "current_profile_id": next(iter(profiles), None),
+        "profiles": profiles,
+        "prompts": upgrade_prompts(manifest.get('prompts') or dict(DEFAULT_PROMPTS))
+    }
+
+
+def load_input(path):
+    # (datos, formato): "ndjson" para los volcados de la app, "json" para el JSON anterior o un manifiesto
+    with open(path, "rb") as f:
+        if is_dump(f):
+            data, input_format = records_to_data(read_records(f)), "ndjson"
+        else:
+            try:
+                data = json.load(f)
+            except ValueError as e:
+                raise DumpError(f"{path} no es una exportación ni un manifiesto válido ({e})")
+            if isinstance(data, dict) and isinstance(data.get('profiles'), list):
+                return manifest_to_data(data), "json"
+            f.seek(0)
+            data, input_format = records_to_data(read_records(f)), "json"
+    data['prompts'] = upgrade_prompts(data.get('prompts') or dict(DEFAULT_PROMPTS))
+    return data, input_format
+
+
+def apply_checkpoint(data, path):
+    # Reaplica los resultados ya pagados de una ejecución anterior
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    applied = 0
+    for record in records:
+        topic = data['profiles'].get(record['profile_id'], {}).get('topics', {}).get(record['topic_id'])
+        if record['kind'] == "ideas" and topic is not None and not topic['ideas']:
+            topic['ideas'] = record['ideas']
+            applied += 1
+    ideas_by_id = {i['id']: i for p in data['profiles'].values() for t in p.get('topics', {}).values() for i in t['ideas']}
+    for record in records:
+        idea = ideas_by_id.get(record.get('idea_id'))
+        if record['kind'] == "script" and idea is not None and not idea.get('script'):
+            idea['script'] = record['script']
+            applied += 1
+    return applied
+
+
+def write_output(data, path, output_format="json"):
+    # Escritura atómica para no dejar un archivo a medias si el proceso muere
+    tmp_path = path + ".tmp"
+    if output_format == "ndjson":
+        with open(tmp_path, "wb") as f:
+            write_records(legacy_records(data), f)
+    else:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def run(data, client, workers=DEFAULT_WORKERS, checkpoint_path=None, cache=None, profile_filter=None,
+        skip_ideas=False, skip_scripts=False, log=print):
+    prompts = data['prompts']
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8") if checkpoint_path else None
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = {}
+    done_count, failures = 0, 0
+
+    def submit_scripts(pid, tid, profile, ideas):
+        if skip_scripts:
+            return
+        for idea in ideas:
+            if not idea.get('script'):
+                script_prompt = build_script_prompt(prompts['scriptwriter'], profile['dna'], idea)
+                future = executor.submit(write_script, client, script_prompt, cache, False, {"profile_id": pid, "topic_id": tid})
+                pending[future] = ("script", pid, tid, idea)
+
+    for pid, profile in data['profiles'].items():
+        if profile_filter and pid not in profile_filter and profile['name'] not in profile_filter:
+            continue
+        if not profile.get('dna'):
+            log(f"⚠️ {profile['name']}: sin ADN, se omite")
+            continue
+        for tid, topic in profile.get('topics', {}).items():
+            if not topic['ideas']:
+                if not skip_ideas:
+                    future = executor.submit(
+                        generate_ideas, client, prompts['strategist'], topic['name'], profile['dna'], cache, False,
+                        {"profile_id": pid, "topic_id": tid}
+                    )
+                    pending[future] = ("ideas", pid, tid, None)
+            else:
+                submit_scripts(pid, tid, profile, topic['ideas'])
+
+    try:
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                kind, pid, tid, idea = pending.pop(future)
+                profile = data['profiles'][pid]
+                topic = profile['topics'][tid]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failures += 1
+                    label = topic['name'] if kind == "ideas" else idea.get('titulo', idea['id'])
+                    log(f"❌ {profile['name']} / {label}: {e}")
+                    continue
+                done_count += 1
+                if kind == "ideas":
+                    topic['ideas'] = result
+                    record = {"kind": "ideas", "profile_id": pid, "topic_id": tid, "ideas": result}
+                    log(f"💡 {profile['name']} / {topic['name']}: {len(result)} ideas")
+                    submit_scripts(pid, tid, profile, result)
+                else:
+                    idea['script'] = result
+                    record = {"kind": "script", "profile_id": pid, "topic_id": tid, "idea_id": idea['id'], "script": result}
+                    log(f"✍️ {profile['name']} / {idea.get('titulo', idea['id'])}")
+                if checkpoint:
+                    checkpoint.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    checkpoint.flush()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if checkpoint:
+            checkpoint.close()
+    return done_count, failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Genera ideas y guiones faltantes para todos los perfiles y temas.")
+    parser.add_argument("input", help="Exportación de la app (.ndjson.gz), JSON anterior o manifiesto de perfiles/temas")
+    parser.add_argument("-o", "--output", help="Archivo de salida (por defecto, el de entrada)")
+    parser.add_argument("--format", choices=["ndjson", "json"], help="Formato de salida (por defecto, el de la entrada)")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="Llamadas en paralelo")
+    parser.add_argument("--checkpoint", help="Checkpoint JSONL (por defecto, <salida>.checkpoint.jsonl)")
+    parser.add_argument("--profile", action="append", dest="profiles", help="Limitar a estos perfiles (ID o nombre); repetible")
+    parser.add_argument("--cache", default=os.environ.get("INFLUENCER_FACTORY_CACHE", "llm_cache.db"), help="Caché de respuestas del LLM")
+    parser.add_argument("--no-cache", action="store_true", help="No leer ni escribir la caché de respuestas")
+    parser.add_argument("--skip-ideas", action="store_true", help="No generar ideas para temas vacíos")
+    parser.add_argument("--skip-scripts", action="store_true", help="No escribir guiones")
+    parser.add_argument("--metrics", help="Guardar las métricas de cada llamada en este archivo (.jsonl o .prom)")
+    args = parser.parse_args(argv)
+
+    output = args.output or args.input
+    checkpoint_path = args.checkpoint or output + ".checkpoint.jsonl"
+
+    try:
+        data, input_format = load_input(args.input)
+    except DumpError as e:
+        print(f"❌ {e}")
+        return 2
+    resumed = apply_checkpoint(data, checkpoint_path)
+    if resumed:
+        print(f"↩️ {resumed} resultados recuperados del checkpoint {checkpoint_path}")
+
+    cache = None if args.no_cache else CompletionCache(args.cache)
+    # Los reintentos y el límite de RPM/TPM los gestiona gateway.py; las conexiones, clients.py
+    client = default_registry.get()
+    done_count, failures = run(
+        data,
+        client,
+        workers=args.workers,
+        checkpoint_path=checkpoint_path,
+        cache=cache,
+        profile_filter=set(args.profiles) if args.profiles else None,
+        skip_ideas=args.skip_ideas,
+        skip_scripts=args.skip_scripts
+    )
+    default_registry.close()
+    write_output(data, output, args.format or input_format)
+    if args.metrics:
+        with open(args.metrics, "w", encoding="utf-8") as f:
+            f.write(recorder.to_prometheus() if args.metrics.endswith(".prom") else recorder.to_jsonl())
+    print(f"✅ {done_count} generaciones nuevas, {failures} errores. Resultado en {output}")
+    if not failures and os.path.exists(checkpoint_path):
+        # Todo quedó en la salida: el checkpoint ya no hace falta
+        os.remove(checkpoint_path)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+# Registro de clientes de OpenAI del proceso: un cliente por API Key (guardada solo como hash)
+# sobre un pool HTTP keep-alive compartido, para no repetir la conexión TCP/TLS en cada rerun.
+# Los clientes que no se usan en IDLE_SECONDS se descartan.
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import weakref
+
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, DefaultHttpxClient, OpenAI
+
+# Límites del pool y timeouts (se pueden ajustar por variable de entorno)
+MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "50"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("OPENAI_MAX_KEEPALIVE", "20"))
+KEEPALIVE_EXPIRY_SECONDS = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "60"))
+TIMEOUT_SECONDS = float(os.environ.get("OPENAI_TIMEOUT", "120"))
+CONNECT_TIMEOUT_SECONDS = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "10"))
+# Segundos sin uso tras los que un cliente se descarta
+IDLE_SECONDS = 30 * 60
+
+
+def key_id(api_key):
+    # Identificador estable de la API Key que se puede mostrar o registrar sin exponerla
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+
+
+class ClientRegistry:
+    def __init__(self, max_connections=MAX_CONNECTIONS, max_keepalive=MAX_KEEPALIVE_CONNECTIONS,
+                 keepalive_expiry=KEEPALIVE_EXPIRY_SECONDS, timeout=TIMEOUT_SECONDS,
+                 connect_timeout=CONNECT_TIMEOUT_SECONDS, idle_seconds=IDLE_SECONDS):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.idle_seconds = idle_seconds
+        self.lock = threading.Lock()
+        self.http = None
+        # Un pool asíncrono por event loop (un AsyncClient no se puede compartir entre loops)
+        self.async_http = weakref.WeakKeyDictionary()
+        # (hash de la key, base_url) -> [cliente, último uso]
+        self.clients = {}
+        # Lo mismo para los clientes asíncronos, por event loop: se indexa por el loop (no por su
+        # id, que se puede reutilizar) y sus clientes desaparecen con él
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.created = 0
+        self.reused = 0
+        self.closed = 0
+
+    def _entry(self, api_key, base_url, loop, build):
+        base_url = base_url or os.environ.get("OPENAI_BASE_URL")
+        entry_key = (key_id(api_key), base_url)
+        now = time.monotonic()
+        with self.lock:
+            self._close_idle(now)
+            clients = self.clients if loop is None else self.async_clients.setdefault(loop, {})
+            entry = clients.get(entry_key)
+            if entry is not None:
+                entry[1] = now
+                self.reused += 1
+                return entry[0]
+            client = build(base_url)
+            clients[entry_key] = [client, now]
+            self.created += 1
+            return client
+
+    def get(self, api_key=None, base_url=None):
+        # Cliente síncrono; sin api_key se usa OPENAI_API_KEY como en OpenAI()
+        api_key = api_key or os.environ.get("OPENAI_API_KEY")
+
+        def build(url):
+            if self.http is None or self.http.is_closed:
+                self.http = DefaultHttpxClient(limits=self.limits, timeout=self.timeout)
+            # Los reintentos los hace la puerta de llamadas (gateway.py), no el SDK
+            return OpenAI(api_key=api_key, base_url=url, http_client=self.http, timeout=self.timeout, max_retries=0)
+
+        return self._entry(api_key, base_url, None, build)
+
+    def get_async(self, api_key=None, base_url=None):
+        # Cliente asíncrono para el event loop en curso (debe llamarse dentro del loop)
+        api_key = api_key or os.environ.get("OPENAI_API_KEY")
+        loop = asyncio.get_running_loop()
+
+        def build(url):
+            http = self.async_http.get(loop)
+            if http is None or http.is_closed:
+                http = self.async_http[loop] = DefaultAsyncHttpxClient(limits=self.limits, timeout=self.timeout)
+            return AsyncOpenAI(api_key=api_key, base_url=url, http_client=http, timeout=self.timeout, max_retries=0)
+
+        return self._entry(api_key, base_url, loop, build)
+
+    def _close_idle(self, now):
+        # Los clientes comparten el pool, así que basta con soltarlos; las conexiones ociosas
+        # del pool las cierra httpx al vencer keepalive_expiry
+        for clients in [self.clients, *self.async_clients.values()]:
+            stale = [k for k, (_, last_used) in clients.items() if now - last_used > self.idle_seconds]
+            for k in stale:
+                del clients[k]
+            self.closed += len(stale)
+
+    def close_idle(self):
+        with self.lock:
+            self._close_idle(time.monotonic())
+
+    def close(self):
+        # Cierra el pool síncrono y olvida sus clientes (p. ej. al terminar el CLI)
+        with self.lock:
+            self.closed += len(self.clients)
+            self.clients.clear()
+            if self.http is not None:
+                self.http.close()
+                self.http = None
+
+    async def aclose(self):
+        # Cierra el pool asíncrono del loop en curso
+        loop = asyncio.get_running_loop()
+        http = self.async_http.pop(loop, None)
+        with self.lock:
+            self.closed += len(self.async_clients.pop(loop, {}))
+        if http is not None:
+            await http.aclose()
+
+    def stats(self):
+        with self.lock:
+            return {
+                "clients": len(self.clients) + sum(len(c) for c in self.async_clients.values()),
+                "created": self.created,
+                "reused": self.reused,
+                "closed": self.closed
+            }
+
+
+# Registro compartido por todas las sesiones y hilos del proceso
+default_registry = ClientRegistry()
@@ -0,0 +1,78 @@
+# Ventana de contexto acotada para la entrevista: los últimos turnos van literales y los
+# anteriores se pliegan en un resumen persistente que se actualiza de forma incremental.
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Turnos recientes que siempre se envían literales (si caben en el presupuesto)
+KEEP_LAST_MESSAGES = 12
+# Mensajes pendientes acumulados antes de pagar una llamada de resumen
+FOLD_BATCH = 6
+# Presupuestos de tokens para los mensajes literales
+CHAT_TOKEN_BUDGET = 6000
+EXTRACTION_TOKEN_BUDGET = 24000
+# Costo fijo aproximado por mensaje (rol y separadores)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+
+
+def count_tokens(text):
+    # Conteo local: tiktoken si está disponible, si no una aproximación de ~4 caracteres por token
+    global _encoding
+    if tiktoken is not None and _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def message_tokens(message):
+    return count_tokens(message['content']) + MESSAGE_OVERHEAD_TOKENS
+
+
+def empty_summary():
+    return {"text": "", "upto": 0}
+
+
+def verbatim_start(history, summary_upto, keep_last, token_budget):
+    # Índice desde el que los mensajes caben literales (siempre al menos el último)
+    start = len(history)
+    used = 0
+    while start > summary_upto and len(history) - start < keep_last:
+        tokens = message_tokens(history[start - 1])
+        if used + tokens > token_budget and start < len(history):
+            break
+        used += tokens
+        start -= 1
+    return start
+
+
+def update_summary(summary, history, summarize, keep_last=KEEP_LAST_MESSAGES, token_budget=CHAT_TOKEN_BUDGET, fold_batch=FOLD_BATCH):
+    # Devuelve el resumen actualizado; summarize(texto_previo, mensajes) -> texto nuevo
+    summary = summary or empty_summary()
+    split = verbatim_start(history, summary['upto'], keep_last, token_budget)
+    pending = split - summary['upto']
+    if pending <= 0:
+        return summary
+    over_budget = sum(message_tokens(m) for m in history[summary['upto']:]) > token_budget
+    if pending < fold_batch and not over_budget:
+        return summary
+    return {"text": summarize(summary['text'], history[summary['upto']:split]), "upto": split}
+
+
+def context_messages(summary, history):
+    # Resumen (si existe) + mensajes aún no plegados
+    summary = summary or empty_summary()
+    messages = []
+    if summary['text']:
+        messages.append({"role": "system", "content": "Resumen de la entrevista hasta ahora:\n" + summary['text']})
+    return messages + history[summary['upto']:]
+
+
+def context_tokens(messages):
+    return sum(message_tokens(m) for m in messages)
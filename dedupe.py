@@ -0,0 +1,90 @@
+# Detección local de ideas casi duplicadas (MinHash con NumPy, sin llamadas a la red).
+# Cada idea se reduce a una firma de MINHASH_PERMUTATIONS enteros sobre los trigramas de
+# caracteres del título; la fracción de posiciones iguales estima su similitud de Jaccard.
+# Comparar una idea contra miles es una sola operación vectorizada. El gancho visual no entra:
+# suele repetir el plano ("Plano detalle: ...") y acercaba ideas de temas distintos.
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+
+MINHASH_PERMUTATIONS = 128
+SHINGLE_SIZE = 3
+# Similitud de Jaccard estimada a partir de la cual dos ideas se consideran duplicadas. Títulos
+# con el mismo formato y otro tema ("3 errores con el setup" / "3 errores con los neumáticos")
+# quedan por debajo; el mismo título con otros signos o artículos ("¡Los 3 errores...!") por encima.
+DUPLICATE_THRESHOLD = 0.75
+# Primo de Mersenne 2^31 - 1: a * x + b cabe en uint64 sin desbordar
+_PRIME = np.uint64((1 << 31) - 1)
+# Palabras vacías: no distinguen una idea de otra ("Un día con el mecánico" / "Un día con la lluvia")
+STOPWORDS = frozenset("""
+a al ante con como cual cuando de del desde el en entre es esta este hay la las le lo los mas me mi mis
+muy no o para pero por que se sin sobre su sus te tu tus un una unos y ya yo
+""".split())
+_rng = np.random.default_rng(20240501)
+_A = _rng.integers(1, (1 << 31) - 1, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, (1 << 31) - 1, size=MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def normalize(text):
+    # Minúsculas, sin acentos ni signos: "¡5 Mitos!" y "5 mitos" comparten trigramas
+    text = unicodedata.normalize("NFKD", text or "").encode("ascii", "ignore").decode("ascii").lower()
+    return re.sub(r"[^a-z0-9]+", " ", text).strip()
+
+
+def idea_text(idea):
+    words = normalize(idea.get('titulo', '')).split()
+    return " ".join(w for w in words if w not in STOPWORDS)
+
+
+def signature(text):
+    padded = f" {text} "
+    shingles = {padded[i:i + SHINGLE_SIZE] for i in range(max(1, len(padded) - SHINGLE_SIZE + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) & 0x7FFFFFFF for s in shingles), dtype=np.uint64, count=len(shingles))
+    # (permutaciones × trigramas) → mínimo por permutación
+    return ((np.outer(_A, hashes) + _B[:, None]) % _PRIME).min(axis=1).astype(np.uint32)
+
+
+class IdeaIndex:
+    # Firmas de las ideas de un tema, en el mismo orden que la lista de ideas
+    def __init__(self, ideas=()):
+        self.ids = []
+        self.titles = []
+        self.signatures = np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint32)
+        self.add(ideas)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, ideas):
+        ideas = list(ideas)
+        if not ideas:
+            return
+        self.ids.extend(idea['id'] for idea in ideas)
+        self.titles.extend(idea.get('titulo', '') for idea in ideas)
+        self.signatures = np.vstack([self.signatures, np.stack([signature(idea_text(idea)) for idea in ideas])])
+
+    def most_similar(self, idea):
+        # (similitud, título) de la idea más parecida del índice, o (0.0, None) si está vacío
+        # o si la idea no tiene título que comparar (dos textos vacíos darían similitud 1)
+        text = idea_text(idea)
+        if not self.ids or not text:
+            return 0.0, None
+        similarities = (self.signatures == signature(text)).mean(axis=1)
+        best = int(similarities.argmax())
+        return float(similarities[best]), self.titles[best]
+
+
+def split_duplicates(ideas, index, threshold=DUPLICATE_THRESHOLD):
+    # Separa las ideas nuevas en (únicas, duplicadas) contra el índice y entre sí;
+    # las únicas se agregan al índice. duplicadas: lista de (idea, título parecido, similitud)
+    unique, duplicates = [], []
+    for idea in ideas:
+        similarity, title = index.most_similar(idea)
+        if similarity >= threshold:
+            duplicates.append((idea, title, similarity))
+        else:
+            unique.append(idea)
+            index.add([idea])
+    return unique, duplicates
@@ -0,0 +1,236 @@
+# Volcado de la base de datos en NDJSON comprimido con gzip: una cabecera y luego un registro
+# por línea (perfil, mensaje, tema, idea), que se escribe y se lee en streaming sin armar todo
+# el volcado en memoria. Al importar también se acepta el JSON único de versiones anteriores.
+import gzip
+import io
+import itertools
+import json
+
+FORMAT = "influencer_factory"
+FORMAT_VERSION = 1
+GZIP_MAGIC = b"\x1f\x8b"
+ROLES = ("user", "assistant", "system")
+
+# Campos obligatorios de cada tipo de registro y su tipo
+RECORD_FIELDS = {
+    "factory": {"format": str, "version": int},
+    "profile": {"id": str, "name": str},
+    "message": {"profile_id": str, "role": str, "content": str},
+    "topic": {"id": str, "profile_id": str, "name": str},
+    "idea": {"topic_id": str, "idea": dict}
+}
+IDEA_FIELDS = ("id", "titulo")
+
+
+class DumpError(ValueError):
+    pass
+
+
+def header(store):
+    return {
+        "type": "factory",
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "current_profile_id": store.get_setting("current_profile_id"),
+        "prompts": store.get_setting("prompts"),
+        "routes": store.get_setting("routes")
+    }
+
+
+def write_records(records, fileobj):
+    # Escribe la cabecera y los registros, de a uno, en fileobj (binario); no lo cierra
+    with gzip.GzipFile(fileobj=fileobj, mode="wb", mtime=0) as gz:
+        for record in records:
+            gz.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+
+
+def write_dump(store, fileobj):
+    write_records(itertools.chain([header(store)], store.iter_records()), fileobj)
+
+
+def export_dump(store):
+    # Para st.download_button(data=...): se arma solo al pulsar y en memoria queda solo lo comprimido
+    buffer = io.BytesIO()
+    write_dump(store, buffer)
+    return buffer.getvalue()
+
+
+def legacy_records(data):
+    # El JSON único de versiones anteriores convertido a la misma secuencia de registros
+    yield {
+        "type": "factory",
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "current_profile_id": data.get('current_profile_id'),
+        "prompts": data.get('prompts'),
+        "routes": data.get('routes')
+    }
+    for pid, profile in (data.get('profiles') or {}).items():
+        yield {
+            "type": "profile",
+            "id": pid,
+            "name": profile.get('name'),
+            "dna": profile.get('dna'),
+            "summary": profile.get('summary'),
+            "dna_upto": profile.get('dna_upto', 0)
+        }
+        for message in profile.get('chat_history') or []:
+            yield {"type": "message", "profile_id": pid, **message}
+        for topic_id, topic in (profile.get('topics') or {}).items():
+            yield {"type": "topic", "id": topic_id, "profile_id": pid, "name": topic.get('name')}
+            for idea in topic.get('ideas') or []:
+                yield {"type": "idea", "topic_id": topic_id, "idea": idea}
+
+
+def records_to_data(records):
+    # Al revés que legacy_records: los registros de un volcado como el JSON anidado de antes
+    # (perfiles → temas → ideas), para quien necesita todo en memoria (cli.py)
+    data = {"current_profile_id": None, "prompts": None, "routes": None, "profiles": {}}
+    topics = {}
+    for record in records:
+        kind = record['type']
+        if kind == "factory":
+            data.update(current_profile_id=record.get('current_profile_id'), prompts=record.get('prompts'), routes=record.get('routes'))
+        elif kind == "profile":
+            data['profiles'][record['id']] = {
+                "name": record['name'],
+                "dna": record.get('dna'),
+                "summary": record.get('summary'),
+                "dna_upto": record.get('dna_upto', 0),
+                "chat_history": [],
+                "topics": {}
+            }
+        elif kind == "message":
+            data['profiles'][record['profile_id']]['chat_history'].append({"role": record['role'], "content": record['content']})
+        elif kind == "topic":
+            topics[record['id']] = data['profiles'][record['profile_id']]['topics'][record['id']] = {"name": record['name'], "ideas": []}
+        elif kind == "idea":
+            topics[record['topic_id']]['ideas'].append(record['idea'])
+    return data
+
+
+def is_dump(fileobj):
+    # Volcado NDJSON (con o sin gzip), a diferencia del JSON único anterior o un manifiesto
+    stream = _open(fileobj)
+    try:
+        head = json.loads(stream.readline())
+    except ValueError:
+        head = None
+    fileobj.seek(0)
+    return isinstance(head, dict) and head.get('type') == "factory"
+
+
+def _open(fileobj):
+    # Con o sin gzip: se decide por los primeros bytes, no por la extensión
+    fileobj.seek(0)
+    start = fileobj.read(2)
+    fileobj.seek(0)
+    return gzip.GzipFile(fileobj=fileobj, mode="rb") if start == GZIP_MAGIC else fileobj
+
+
+def _numbered(stream):
+    # (número de línea, registro) del NDJSON; las líneas vacías se ignoran
+    for number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as e:
+            raise DumpError(f"Línea {number}: JSON inválido ({e})")
+
+
+def _raw_records(fileobj):
+    stream = _open(fileobj)
+    first = stream.readline()
+    try:
+        head = json.loads(first)
+    except ValueError:
+        head = None
+    if isinstance(head, dict) and head.get('type') == "factory":
+        yield 1, head
+        for number, record in _numbered(stream):
+            yield number + 1, record
+        return
+    # Formato anterior: un único JSON (se carga entero, como antes)
+    try:
+        data = json.loads(first + stream.read())
+    except ValueError as e:
+        raise DumpError(f"El archivo no es un volcado válido ({e})")
+    if not isinstance(data, dict) or not isinstance(data.get('profiles', {}), dict):
+        raise DumpError("El archivo no es un volcado válido.")
+    yield from enumerate(legacy_records(data), start=1)
+
+
+def validate(record, seen):
+    # Devuelve el motivo por el que el registro no sirve, o None; seen lleva los ids ya vistos
+    if not isinstance(record, dict):
+        return "no es un objeto"
+    kind = record.get('type')
+    if kind not in RECORD_FIELDS:
+        return f"tipo de registro desconocido: {kind!r}"
+    for field, field_type in RECORD_FIELDS[kind].items():
+        if not isinstance(record.get(field), field_type):
+            return f"falta '{field}' o no es válido"
+    if kind == "factory":
+        if record['format'] != FORMAT or record['version'] > FORMAT_VERSION:
+            return f"formato no soportado ({record['format']} v{record['version']})"
+    elif kind == "profile":
+        if record['id'] in seen['profile']:
+            return f"perfil repetido: {record['id']}"
+        seen['profile'].add(record['id'])
+    elif kind in ("message", "topic") and record['profile_id'] not in seen['profile']:
+        return f"el perfil {record['profile_id']} no aparece antes en el archivo"
+    if kind == "message" and record['role'] not in ROLES:
+        return f"rol desconocido: {record['role']!r}"
+    if kind == "topic":
+        if record['id'] in seen['topic']:
+            return f"tema repetido: {record['id']}"
+        seen['topic'].add(record['id'])
+    if kind == "idea":
+        if record['topic_id'] not in seen['topic']:
+            return f"el tema {record['topic_id']} no aparece antes en el archivo"
+        idea = record['idea']
+        if not all(isinstance(idea.get(field), str) for field in IDEA_FIELDS):
+            return "la idea no tiene 'id' y 'titulo'"
+        if idea['id'] in seen['idea']:
+            return f"idea repetida: {idea['id']}"
+        seen['idea'].add(idea['id'])
+    return None
+
+
+def read_records(fileobj):
+    # Registros validados de un volcado (NDJSON con o sin gzip, o el JSON anterior), de a uno;
+    # el primer registro inválido corta la lectura con DumpError
+    seen = {"profile": set(), "topic": set(), "idea": set()}
+    for number, record in _raw_records(fileobj):
+        problem = validate(record, seen)
+        if problem:
+            raise DumpError(f"Registro {number}: {problem}")
+        if record['type'] == "factory" and number != 1:
+            raise DumpError(f"Registro {number}: cabecera repetida")
+        yield record
+
+
+def scan_profiles(fileobj):
+    # {id: nombre} de los perfiles del archivo, para elegir cuáles importar. En NDJSON solo se
+    # decodifican las líneas de perfil; el resto se descarta sin parsear.
+    profiles = {}
+    stream = _open(fileobj)
+    first = stream.readline()
+    try:
+        head = json.loads(first)
+    except ValueError:
+        head = None
+    if isinstance(head, dict) and head.get('type') == "factory":
+        for line in stream:
+            if b'"profile"' in line[:40]:
+                record = json.loads(line)
+                if record.get('type') == "profile":
+                    profiles[record['id']] = record['name']
+    else:
+        fileobj.seek(0)
+        for record in read_records(fileobj):
+            if record['type'] == "profile":
+                profiles[record['id']] = record['name']
+    fileobj.seek(0)
+    return profiles
@@ -0,0 +1,478 @@
+# Lógica de generación de la fábrica (ADN → ideas → guiones) sin dependencias de Streamlit.
+# La usan tanto app.py como el CLI por lotes (cli.py).
+import itertools
+import json
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from gateway import default_gateway
+from ideas_json import IdeaStreamParser, normalize_idea, requested_count, template_pillars
+from llm_cache import request_key
+from metrics import STAGE_DNA_DELTA, STAGE_IDEAS, STAGE_MORE_IDEAS, STAGE_SCRIPT, recorder, usage_fields
+from prompts import canonical_json, compile_template
+from routing import first_chunk, routed_call
+
+DEFAULT_MODEL = "gpt-4o"
+# Modelo barato para los deltas incrementales del ADN (sin ruta; con ruta lo decide la etapa dna_delta)
+DNA_DELTA_MODEL = "gpt-4o-mini"
+DNA_KEYS = ['nombre', 'arquetipo', 'tono', 'jerga_tecnica', 'opiniones_polemicas', 'temas_pasion']
+
+# Títulos existentes que se envían para que el modelo no los repita (los más recientes)
+MAX_AVOID_TITLES = 60
+
+# Ideas que pide "5 Ideas Más"
+MORE_IDEAS_COUNT = 5
+# Veces que se vuelven a pedir solo las ideas que faltaron o llegaron inválidas
+IDEA_RETRY_ATTEMPTS = 1
+
+# Concurrencia por defecto para la guionización en lote
+DEFAULT_SCRIPT_WORKERS = 4
+# Campos de la idea que no entran en el prompt del Guionista (el borrador pre-generado no debe
+# cambiar la clave de caché ni colarse en el guion nuevo)
+SCRIPT_PROMPT_EXCLUDED = ("draft", "variants", "active_variant")
+# Variantes de guion en una sola petición (n=): el prompt se paga una vez
+MAX_SCRIPT_VARIANTS = 5
+# Ritmo de locución para estimar la duración de un guion y fin del cuerpo si la plantilla no lo dice
+SPOKEN_WORDS_PER_SECOND = 2.5
+SCRIPT_TARGET_SECONDS = 50
+_BODY_TARGET = re.compile(r"CUERPO\s*\(\s*\d+\s*-\s*(\d+)\s*seg", re.IGNORECASE)
+
+STRATEGIST_SYSTEM = "Eres un experto en crear conexión humana y contenido auténtico. Devuelve JSON."
+SCRIPTWRITER_SYSTEM = "Eres un guionista experto."
+
+# El dato que cambia en cada llamada (tema, idea) va al final: todo lo anterior es un prefijo
+# idéntico entre llamadas del mismo perfil y el proveedor lo cachea (ver prompts.py)
+DEFAULT_PROMPTS = {
+    "strategist": """Actúa como un Estratega de Contenido "Relatable" y Humano.
+Tu objetivo es generar ideas que conecten desde la EMPATÍA y la SIMPLICIDAD, no desde el "marketing agresivo".
+
+Usa el perfil JSON para generar 10 ideas de video para el tema indicado al final.
+
+REGLAS DE ORO:
+- Nada de "trucos virales" forzados.
+- Busca lo cotidiano, lo simple, lo que le pasa a todo el mundo.
+- Lenguaje natural, como si le hablaras a un amigo.
+
+Usa estos pilares pero con enfoque SIMPLE:
+1. EDUCACIÓN (Tips rápidos y útiles, sin tecnicismos)
+2. CURIOSIDAD (Cosas que no sabías, datos curiosos simples)
+3. OPINIÓN/REFLEXIÓN (Pensamientos honestos, no polémicas vacías)
+4. LIFESTYLE (Vlog, día a día, detrás de cámaras real)
+5. GAMIFICACIÓN (Retos sencillos, preguntas a la audiencia)
+
+Perfil: {profile_str}
+
+Output esperado: JSON con clave 'ideas' (lista de objetos {'id': 'uuid', 'titulo', 'pilar', 'gancho_visual', 'script': null}).
+
+Tema: {topic_name}""",
+    "scriptwriter": """Eres el Guionista Senior de Brand People. Escribe el guión para la idea seleccionada.
+
+LA FÓRMULA MATEMÁTICA DEL GUIÓN (NO TE DESVÍES):
+1. EL GANCHO (0-3 seg): Prohibido saludar. Inicia con Afirmación Polémica, Lista o Reto.
+2. EL CUERPO (4-50 seg): Velocidad alta. Frases cortas. Jerga técnica explicada rápido.
+3. EL CTA (Final): Llamado a la acción específico.
+
+Formato: Texto plano, líneas dobles.
+
+Perfil: {profile_str}
+
+Idea: {idea_str}"""
+}
+
+# Versiones anteriores de las plantillas por defecto (con el tema y la idea al principio);
+# si el usuario no las editó se sustituyen por las actuales
+LEGACY_DEFAULT_PROMPTS = {
+    "strategist": """Actúa como un Estratega de Contenido "Relatable" y Humano.
+Tu objetivo es generar ideas que conecten desde la EMPATÍA y la SIMPLICIDAD, no desde el "marketing agresivo".
+
+Usa el perfil JSON para generar 10 ideas de video para el tema '{topic_name}'.
+
+REGLAS DE ORO:
+- Nada de "trucos virales" forzados.
+- Busca lo cotidiano, lo simple, lo que le pasa a todo el mundo.
+- Lenguaje natural, como si le hablaras a un amigo.
+
+Usa estos pilares pero con enfoque SIMPLE:
+1. EDUCACIÓN (Tips rápidos y útiles, sin tecnicismos)
+2. CURIOSIDAD (Cosas que no sabías, datos curiosos simples)
+3. OPINIÓN/REFLEXIÓN (Pensamientos honestos, no polémicas vacías)
+4. LIFESTYLE (Vlog, día a día, detrás de cámaras real)
+5. GAMIFICACIÓN (Retos sencillos, preguntas a la audiencia)
+
+Perfil: {profile_str}
+
+Output esperado: JSON con clave 'ideas' (lista de objetos {'id': 'uuid', 'titulo', 'pilar', 'gancho_visual', 'script': null}).""",
+    "scriptwriter": """Eres el Guionista Senior de Brand People. Escribe el guión para la idea seleccionada.
+
+LA FÓRMULA MATEMÁTICA DEL GUIÓN (NO TE DESVÍES):
+1. EL GANCHO (0-3 seg): Prohibido saludar. Inicia con Afirmación Polémica, Lista o Reto.
+2. EL CUERPO (4-50 seg): Velocidad alta. Frases cortas. Jerga técnica explicada rápido.
+3. EL CTA (Final): Llamado a la acción específico.
+
+Perfil: {profile_str}
+Idea: {idea_str}
+
+Formato: Texto plano, líneas dobles."""
+}
+
+
+def upgrade_prompts(prompts):
+    return {name: DEFAULT_PROMPTS[name] if text == LEGACY_DEFAULT_PROMPTS.get(name) else text for name, text in prompts.items()}
+
+
+def chat_completion(client, cache=None, bypass_cache=False, tags=None, route=None, **request):
+    # Devuelve el texto de la respuesta; con bypass_cache se pide una muestra nueva y se reemplaza la guardada.
+    # tags: etapa, perfil y tema con los que se registra la llamada en las métricas.
+    # route (routing.py): el modelo lo decide la etapa, con presupuesto de latencia y alternativo
+    if route is None:
+        return _chat_completion(client, cache, bypass_cache, tags, None, **request)
+    return routed_call(
+        route,
+        lambda model, **options: _chat_completion(client, cache, bypass_cache, tags, options, **dict(request, model=model)),
+        previous=lambda: cache.get(request_key(dict(request, model=route.model))) if cache is not None else None,
+        tags=tags
+    )
+
+
+def _chat_completion(client, cache, bypass_cache, tags, options, **request):
+    # options: timeout / reintentos de la llamada (no forman parte de la clave de caché)
+    tags = tags or {}
+    key = request_key(request)
+    start = time.perf_counter()
+    if cache is not None and not bypass_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            recorder.record_call(tags.get("stage"), request['model'], time.perf_counter() - start, cached=True, tags=tags)
+            return cached
+    try:
+        response = default_gateway.chat_completion(client, **(options or {}), **request)
+    except Exception as e:
+        recorder.record_call(tags.get("stage"), request['model'], time.perf_counter() - start, error=e, tags=tags)
+        raise
+    recorder.record_call(tags.get("stage"), request['model'], time.perf_counter() - start, usage=response.usage, tags=tags)
+    # Con n= se devuelven todas las alternativas
+    content = [choice.message.content for choice in response.choices] if request.get('n') else response.choices[0].message.content
+    if cache is not None:
+        cache.put(key, content)
+    return content
+
+
+def stream_completion(client, stats=None, cache=None, bypass_cache=False, tags=None, route=None, **request):
+    # Como chat_completion pero entrega el texto por trozos; deja en stats el tiempo al primer
+    # token ('ttft'), si vino de la caché ('cached') y los tokens del prompt cacheados por el proveedor
+    if route is None:
+        yield from _stream_completion(client, stats, cache, bypass_cache, tags, None, **request)
+        return
+
+    def start(model, **options):
+        # El presupuesto de latencia cubre hasta el primer trozo: se espera antes de decidir
+        chunks = _stream_completion(client, stats, cache, bypass_cache, tags, options, **dict(request, model=model))
+        if model == route.model and route.budget:
+            return first_chunk(chunks, route.budget)
+        return itertools.chain([next(chunks, "")], chunks)
+
+    def previous():
+        cached = cache.get(request_key(dict(request, model=route.model))) if cache is not None else None
+        return None if cached is None else iter([cached])
+
+    yield from routed_call(route, start, previous, tags, stream=True)
+
+
+def _stream_completion(client, stats, cache, bypass_cache, tags, options, **request):
+    tags = tags or {}
+    stats = stats if stats is not None else {}
+    key = request_key(request)
+    start = time.perf_counter()
+    if cache is not None and not bypass_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            stats['ttft'] = time.perf_counter() - start
+            stats['cached'] = True
+            recorder.record_call(tags.get("stage"), request['model'], stats['ttft'], ttft=stats['ttft'], cached=True, tags=tags)
+            yield cached
+            return
+    stream = None
+    parts, usage, error = [], None, "interrumpido"
+    try:
+        # include_usage: el último chunk trae los tokens consumidos
+        stream = default_gateway.chat_completion(client, stream=True, stream_options={"include_usage": True}, **(options or {}), **request)
+        for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+                # Tokens del prompt que el proveedor sirvió desde su caché de prefijos
+                stats['cached_tokens'] = usage_fields(usage)['cached_tokens']
+            if chunk.choices and chunk.choices[0].delta.content:
+                if 'ttft' not in stats:
+                    stats['ttft'] = time.perf_counter() - start
+                parts.append(chunk.choices[0].delta.content)
+                yield chunk.choices[0].delta.content
+        error = None
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        # Si el consumidor corta el stream, liberar la conexión
+        if stream is not None:
+            stream.close()
+        recorder.record_call(tags.get("stage"), request['model'], time.perf_counter() - start, ttft=stats.get('ttft'), usage=usage, error=error, tags=tags)
+    # Solo se cachea la respuesta completa
+    if cache is not None:
+        cache.put(key, "".join(parts))
+
+
+# --- ADN ---
+def merge_dna_turns(client, dna, turns, cache=None, tags=None, route=None):
+    turns_text = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+    delta_prompt = f"""ADN de marca actual (JSON):
+{canonical_json(dna or {})}
+
+Nuevos turnos de la entrevista:
+{turns_text}
+
+Actualiza el ADN solo con lo que aportan los nuevos turnos y conserva lo demás tal cual.
+Devuelve SOLO un JSON válido con estas claves exactas:
+'nombre', 'arquetipo', 'tono', 'jerga_tecnica', 'opiniones_polemicas', 'temas_pasion'."""
+    content = chat_completion(
+        client,
+        cache=cache,
+        tags=dict(tags or {}, stage=STAGE_DNA_DELTA),
+        route=route,
+        model=DNA_DELTA_MODEL,
+        messages=[
+            {"role": "system", "content": "Eres un asistente experto en extracción de datos JSON."},
+            {"role": "user", "content": delta_prompt}
+        ],
+        response_format={"type": "json_object"}
+    )
+    updated = json.loads(content)
+    merged = dict(dna or {})
+    for key in DNA_KEYS:
+        if updated.get(key) not in (None, "", [], {}):
+            merged[key] = updated[key]
+    return merged
+
+
+# --- Estratega ---
+def build_ideas_prompt(template, topic_name, dna):
+    return compile_template("strategist", template).render(dna, topic_name=topic_name)
+
+
+def ideas_messages(template, topic_name, dna):
+    # Mismo inicio para "Generar Ideas" y "5 Ideas Más": comparten el prefijo cacheado
+    return [
+        {"role": "system", "content": STRATEGIST_SYSTEM},
+        {"role": "user", "content": build_ideas_prompt(template, topic_name, dna)}
+    ]
+
+
+def avoid_titles_text(existing_titles):
+    if not existing_titles:
+        return ""
+    titles = "\n".join(f"- {title}" for title in list(existing_titles)[-MAX_AVOID_TITLES:])
+    return f"\nYa existen estas ideas; no las repitas ni propongas variaciones cercanas:\n{titles}\n"
+
+
+def build_more_ideas_prompt(existing_titles=()):
+    return f"""Ahora genera solo {MORE_IDEAS_COUNT} ideas ADICIONALES de video para ese tema y ese perfil.
+MANTÉN EL ENFOQUE: Simple, humano, relatable, sin forzar la viralidad.
+{avoid_titles_text(existing_titles)}Output: JSON con clave 'ideas' (lista de objetos {{'titulo', 'pilar', 'gancho_visual'}})."""
+
+
+def build_missing_ideas_prompt(missing, existing_titles=()):
+    # Segunda vuelta: solo las ideas que faltaron, sin regenerar las que ya llegaron bien
+    return f"""Tu respuesta llegó incompleta o con ideas sin 'titulo' o 'gancho_visual'. Genera solo {missing} ideas más para ese tema y ese perfil.
+{avoid_titles_text(existing_titles)}Output: JSON con clave 'ideas' (lista de objetos {{'titulo', 'pilar', 'gancho_visual'}})."""
+
+
+def accept_idea(raw, pillars, report, truncated=False):
+    # Idea lista para guardar (con ID propio y script vacío), o None si no se pudo reparar
+    idea, repaired = normalize_idea(raw, pillars)
+    if idea is None:
+        report['discarded'] += 1
+        return None
+    report['repaired'] += int(repaired or truncated)
+    report['received'] += 1
+    return dict(idea, id=str(uuid.uuid4()), script=None)
+
+
+def stream_ideas(client, messages, count, pillars, cache=None, bypass_cache=False, tags=None, report=None, existing_titles=(), route=None):
+    # Entrega cada idea validada en cuanto su objeto se cierra en el stream (con ID propio y script
+    # vacío). Los defectos se reparan en local; si aun así faltan ideas se piden solo esas, y si
+    # el modelo manda de más se entregan solo las `count` primeras.
+    # report: cuántas se repararon, descartaron y volvieron a pedir
+    report = report if report is not None else {}
+    report.update(received=0, repaired=0, discarded=0, requested=0)
+    titles = list(existing_titles)
+    request_messages = messages
+    for attempt in range(IDEA_RETRY_ATTEMPTS + 1):
+        parser = IdeaStreamParser()
+        chunks = []
+        for chunk in stream_completion(
+            client,
+            cache=cache,
+            bypass_cache=bypass_cache,
+            tags=tags,
+            route=route,
+            model=DEFAULT_MODEL,
+            messages=request_messages,
+            response_format={"type": "json_object"}
+        ):
+            chunks.append(chunk)
+            if report['received'] >= count:
+                # Sobran ideas: el stream se lee hasta el final (uso y caché) pero no se entregan
+                continue
+            for raw in parser.feed(chunk):
+                idea = accept_idea(raw, pillars, report) if report['received'] < count else None
+                if idea:
+                    titles.append(idea['titulo'])
+                    yield idea
+        tail, truncated = parser.finish()
+        for raw in tail:
+            idea = accept_idea(raw, pillars, report, truncated) if report['received'] < count else None
+            if idea:
+                titles.append(idea['titulo'])
+                yield idea
+        missing = count - report['received']
+        if missing <= 0 or attempt == IDEA_RETRY_ATTEMPTS:
+            return
+        report['requested'] += missing
+        request_messages = messages + [
+            {"role": "assistant", "content": "".join(chunks)},
+            {"role": "user", "content": build_missing_ideas_prompt(missing, titles)}
+        ]
+
+
+def stream_new_ideas(client, template, topic_name, dna, cache=None, bypass_cache=False, tags=None, report=None, route=None):
+    return stream_ideas(
+        client,
+        ideas_messages(template, topic_name, dna),
+        requested_count(template),
+        template_pillars(template),
+        cache=cache,
+        bypass_cache=bypass_cache,
+        tags=dict(tags or {}, stage=STAGE_IDEAS),
+        report=report,
+        route=route
+    )
+
+
+def stream_more_ideas(client, topic_name, dna, cache=None, bypass_cache=False, tags=None, existing_titles=(), template=None, report=None, route=None):
+    template = template or DEFAULT_PROMPTS['strategist']
+    return stream_ideas(
+        client,
+        ideas_messages(template, topic_name, dna) + [
+            {"role": "user", "content": build_more_ideas_prompt(existing_titles)}
+        ],
+        MORE_IDEAS_COUNT,
+        template_pillars(template),
+        cache=cache,
+        bypass_cache=bypass_cache,
+        tags=dict(tags or {}, stage=STAGE_MORE_IDEAS),
+        report=report,
+        existing_titles=existing_titles,
+        route=route
+    )
+
+
+def generate_ideas(client, template, topic_name, dna, cache=None, bypass_cache=False, tags=None):
+    return list(stream_new_ideas(client, template, topic_name, dna, cache=cache, bypass_cache=bypass_cache, tags=tags))
+
+
+def generate_more_ideas(client, topic_name, dna, cache=None, bypass_cache=False, tags=None, existing_titles=(), template=None):
+    return list(stream_more_ideas(
+        client, topic_name, dna, cache=cache, bypass_cache=bypass_cache, tags=tags, existing_titles=existing_titles, template=template
+    ))
+
+
+# --- Guionista ---
+def build_script_prompt(template, dna, idea):
+    idea = {key: value for key, value in idea.items() if key not in SCRIPT_PROMPT_EXCLUDED}
+    return compile_template("scriptwriter", template).render(dna, idea_str=canonical_json(idea))
+
+
+def script_messages(script_prompt):
+    return [
+        {"role": "system", "content": SCRIPTWRITER_SYSTEM},
+        {"role": "user", "content": script_prompt}
+    ]
+
+
+def write_script(client, script_prompt, cache=None, bypass_cache=False, tags=None, route=None, stage=STAGE_SCRIPT):
+    return chat_completion(
+        client,
+        cache=cache,
+        bypass_cache=bypass_cache,
+        tags=dict(tags or {}, stage=stage),
+        route=route,
+        model=DEFAULT_MODEL,
+        messages=script_messages(script_prompt)
+    )
+
+
+def write_script_variants(client, script_prompt, n, cache=None, bypass_cache=False, tags=None, route=None):
+    # n guiones alternativos para el mismo prompt en una sola llamada (lista de textos)
+    return chat_completion(
+        client,
+        cache=cache,
+        bypass_cache=bypass_cache,
+        tags=dict(tags or {}, stage=STAGE_SCRIPT),
+        route=route,
+        model=DEFAULT_MODEL,
+        messages=script_messages(script_prompt),
+        n=n
+    )
+
+
+def script_variants(idea):
+    # Variantes guardadas de la idea; un guión anterior sin variantes cuenta como la primera
+    variants = list(idea.get('variants') or [])
+    if idea.get('script') and idea['script'] not in variants:
+        variants.append(idea['script'])
+    return variants
+
+
+def add_script_variants(idea, scripts):
+    # Suma las variantes nuevas (sin repetir) a las de la idea y deja activa la primera recibida
+    variants = script_variants(idea)
+    variants += [script for script in dict.fromkeys(scripts) if script not in variants]
+    set_active_variant(idea, variants, variants.index(scripts[0]))
+
+
+def set_active_variant(idea, variants, index):
+    idea['variants'] = variants
+    idea['active_variant'] = index
+    idea['script'] = variants[index]
+    idea.pop('draft', None)
+
+
+def script_target_seconds(template):
+    # Fin del cuerpo en la fórmula de la plantilla ("EL CUERPO (4-50 seg)")
+    match = _BODY_TARGET.search(template or "")
+    return int(match.group(1)) if match else SCRIPT_TARGET_SECONDS
+
+
+def script_metrics(script, target_seconds=SCRIPT_TARGET_SECONDS):
+    # Palabras y duración hablada estimada, sin llamar al modelo
+    words = len(script.split())
+    seconds = words / SPOKEN_WORDS_PER_SECOND
+    return {"words": words, "seconds": seconds, "over": seconds - target_seconds}
+
+
+def write_scripts_concurrently(client, template, dna, ideas, max_workers=DEFAULT_SCRIPT_WORKERS, cache=None, bypass_cache=False, tags=None, route=None, stage=STAGE_SCRIPT, wait_running=False):
+    # Genera guiones en paralelo y los entrega (idea, script, error) en orden de llegada.
+    # wait_running: al cerrar, esperar a las llamadas ya en curso (para contar todo su gasto)
+    prompts = {idea['id']: build_script_prompt(template, dna, idea) for idea in ideas}
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    futures = {executor.submit(write_script, client, prompts[idea['id']], cache, bypass_cache, tags, route, stage): idea for idea in ideas}
+    try:
+        for future in as_completed(futures):
+            idea = futures[future]
+            try:
+                yield idea, future.result(), None
+            except Exception as e:
+                yield idea, None, e
+    finally:
+        # Si el consumidor se interrumpe, no seguir pagando por lo que quedó en cola
+        executor.shutdown(wait=wait_running, cancel_futures=True)
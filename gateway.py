@@ -0,0 +1,222 @@
+# Puerta única para todas las llamadas a OpenAI del proceso: limitador de RPM/TPM compartido
+# (token bucket) y reintentos con backoff exponencial con jitter que respetan Retry-After.
+import os
+import random
+import threading
+import time
+
+import openai
+
+from context import count_tokens
+
+# Límites de la organización (se pueden ajustar por variable de entorno)
+DEFAULT_RPM = int(os.environ.get("OPENAI_RPM_LIMIT", "500"))
+DEFAULT_TPM = int(os.environ.get("OPENAI_TPM_LIMIT", "30000"))
+# Tokens de salida que se reservan cuando la petición no fija max_tokens
+DEFAULT_COMPLETION_ESTIMATE = 1000
+MAX_RETRIES = 5
+BASE_DELAY_SECONDS = 1.0
+MAX_DELAY_SECONDS = 60.0
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, amount):
+        # Bloquea hasta tener saldo; devuelve los segundos esperados
+        amount = min(amount, self.capacity)
+        start = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.level >= amount:
+                    self.level -= amount
+                    return now - start
+                missing = (amount - self.level) / self.rate
+            time.sleep(min(missing, 1.0))
+
+    def adjust(self, delta):
+        # Corrige la reserva con el consumo real (positivo consume, negativo devuelve)
+        with self.lock:
+            self._refill(time.monotonic())
+            self.level = min(self.capacity, self.level - delta)
+
+
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+
+def is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+class GatewayStream:
+    # Envuelve el stream de la API: la llamada sigue contando como en curso hasta que el stream se
+    # agota o se cierra, y entonces se ajusta la reserva de TPM con el uso real del último chunk
+    def __init__(self, gateway, stream, estimated):
+        self.gateway = gateway
+        self.stream = stream
+        self.estimated = estimated
+        self.usage = None
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            for chunk in self.stream:
+                if getattr(chunk, "usage", None):
+                    self.usage = chunk.usage
+                yield chunk
+        finally:
+            self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        try:
+            self.stream.close()
+        finally:
+            if self.usage is not None:
+                self.gateway.token_bucket.adjust(self.usage.total_tokens - self.estimated)
+            self.gateway._release()
+
+
+def estimate_request_tokens(request):
+    prompt_tokens = sum(count_tokens(m['content']) for m in request.get('messages', []) if isinstance(m.get('content'), str))
+    completion_tokens = request.get('max_tokens') or request.get('max_completion_tokens') or DEFAULT_COMPLETION_ESTIMATE
+    return prompt_tokens + completion_tokens * (request.get('n') or 1)
+
+
+class CallGateway:
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_retries=MAX_RETRIES):
+        self.max_retries = max_retries
+        self.configure(rpm, tpm)
+        self._stats_lock = threading.Lock()
+        self.waiting = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.last_wait = 0.0
+
+    def configure(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+
+    def _admit(self, tokens):
+        with self._stats_lock:
+            self.waiting += 1
+        waited = 0.0
+        try:
+            waited = self.request_bucket.acquire(1)
+            if tokens:
+                waited += self.token_bucket.acquire(tokens)
+        finally:
+            with self._stats_lock:
+                self.waiting -= 1
+                self.total_wait += waited
+                self.last_wait = waited
+                self.max_wait = max(self.max_wait, waited)
+        # Solo cuenta como en curso si llegó a admitirse (si no, nadie llamaría a _release)
+        with self._stats_lock:
+            self.in_flight += 1
+            self.calls += 1
+
+    def _release(self):
+        with self._stats_lock:
+            self.in_flight -= 1
+
+    def call(self, fn, estimated_tokens=0, max_retries=None, retry_timeouts=True, hold=False, **kwargs):
+        # max_retries / retry_timeouts: para llamadas con plan B (routing.py), que prefieren fallar rápido.
+        # hold: la llamada sigue en curso al volver (streams) y la libera quien la termine
+        max_retries = self.max_retries if max_retries is None else max_retries
+        attempt = 0
+        while True:
+            self._admit(estimated_tokens)
+            try:
+                response = fn(**kwargs)
+            except Exception as e:
+                self._release()
+                if not is_retryable(e) or attempt >= max_retries or (not retry_timeouts and isinstance(e, openai.APITimeoutError)):
+                    raise
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    cap = min(MAX_DELAY_SECONDS, BASE_DELAY_SECONDS * 2 ** attempt)
+                    delay = random.uniform(cap / 2, cap)
+                with self._stats_lock:
+                    self.retries += 1
+                attempt += 1
+                time.sleep(delay)
+                continue
+            except BaseException:
+                self._release()
+                raise
+            if not hold:
+                self._release()
+            return response
+
+    def chat_completion(self, client, max_retries=None, retry_timeouts=True, **request):
+        # Devuelve la respuesta cruda (o el stream si stream=True, envuelto en GatewayStream: hay que
+        # agotarlo o cerrarlo). En streaming se pide el uso en el último chunk para ajustar el TPM
+        estimated = estimate_request_tokens(request)
+        if request.get('stream'):
+            request['stream_options'] = dict(request.get('stream_options') or {}, include_usage=True)
+            stream = self.call(client.chat.completions.create, estimated, max_retries, retry_timeouts, hold=True, **request)
+            return GatewayStream(self, stream, estimated)
+        response = self.call(client.chat.completions.create, estimated, max_retries, retry_timeouts, **request)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.token_bucket.adjust(usage.total_tokens - estimated)
+        return response
+
+    def transcription(self, client, **request):
+        return self.call(client.audio.transcriptions.create, 0, **request)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "queue_depth": self.waiting,
+                "in_flight": self.in_flight,
+                "calls": self.calls,
+                "retries": self.retries,
+                "avg_wait": self.total_wait / self.calls if self.calls else 0.0,
+                "max_wait": self.max_wait,
+                "last_wait": self.last_wait,
+                "rpm": self.rpm,
+                "tpm": self.tpm
+            }
+
+
+# Instancia compartida por todas las sesiones y hilos del proceso
+default_gateway = CallGateway()
@@ -0,0 +1,158 @@
+# Lectura incremental de la respuesta JSON del Estratega y reparación local de sus defectos
+# más comunes (cola cortada, claves con otra grafía, pilar desconocido) para no pagar una
+# llamada nueva por cada respuesta imperfecta.
+import json
+import re
+
+from dedupe import normalize
+
+# Pilares por defecto (los de la plantilla del Estratega y los del formulario de idea propia)
+IDEA_PILLARS = ("EDUCACIÓN", "CURIOSIDAD", "OPINIÓN/REFLEXIÓN", "POLÉMICA", "LIFESTYLE", "GAMIFICACIÓN")
+OTHER_PILLAR = "OTRO"
+# Ideas que se piden si la plantilla no dice cuántas
+DEFAULT_IDEA_COUNT = 10
+IDEA_FIELDS = ("titulo", "pilar", "gancho_visual")
+# Otras grafías de las claves de la idea (ya normalizadas: minúsculas, sin acentos, "_" entre palabras)
+KEY_ALIASES = {
+    "title": "titulo",
+    "pillar": "pilar",
+    "gancho": "gancho_visual",
+    "hook": "gancho_visual",
+    "visual_hook": "gancho_visual",
+    "hook_visual": "gancho_visual"
+}
+
+_PILLAR_LINE = re.compile(r"^\s*\d+\.\s*([^\W\d_][^(\n]*?)\s*(?:\(|$)", re.MULTILINE)
+_IDEA_COUNT = re.compile(r"(\d+)\s+ideas")
+# Lo que no se puede cerrar al final de un objeto cortado: coma colgante o clave sin valor
+_DANGLING_TAIL = re.compile(r'(?:,\s*"[^"]*"\s*:?|"[^"]*"\s*:|,)\s*$')
+
+
+def template_pillars(template):
+    # Pilares de la lista numerada de la plantilla ("1. EDUCACIÓN (...)"); si no hay, los de siempre
+    pillars = [p.strip().upper() for p in _PILLAR_LINE.findall(template or "") if p.strip().isupper()]
+    return tuple(pillars) or IDEA_PILLARS
+
+
+def requested_count(prompt):
+    # La última cifra pedida manda ("10 ideas" en la plantilla, "5 ideas" al pedir más)
+    counts = _IDEA_COUNT.findall(prompt or "")
+    return int(counts[-1]) if counts else DEFAULT_IDEA_COUNT
+
+
+def match_pillar(value, pillars):
+    # "educacion", "1. Educación", "Opinión" o "EDUC" → el pilar canónico; si no se parece a ninguno, OTRO
+    words = set(normalize(value if isinstance(value, str) else "").split())
+    if not words:
+        return OTHER_PILLAR
+    for pillar in pillars:
+        if words == set(normalize(pillar).split()):
+            return pillar
+    for pillar in pillars:
+        if words & set(normalize(pillar).split()):
+            return pillar
+    # Pilar cortado ("EDUC"): prefijo de alguna palabra del pilar
+    for pillar in pillars:
+        if any(len(w) >= 3 and p.startswith(w) for w in words for p in normalize(pillar).split()):
+            return pillar
+    return OTHER_PILLAR
+
+
+def normalize_idea(raw, pillars=IDEA_PILLARS):
+    # Devuelve (idea, reparada) con solo los campos del esquema, o (None, motivo) si no sirve
+    if not isinstance(raw, dict):
+        return None, "no es un objeto"
+    idea, repaired = {}, False
+    for key, value in raw.items():
+        field = normalize(key).replace(" ", "_")
+        field = KEY_ALIASES.get(field, field)
+        if field in IDEA_FIELDS and field not in idea:
+            idea[field] = value.strip() if isinstance(value, str) else value
+            repaired = repaired or field != key
+    for field in ("titulo", "gancho_visual"):
+        if not isinstance(idea.get(field), str) or not idea[field]:
+            return None, f"sin '{field}'"
+    pillar = match_pillar(idea.get('pilar'), pillars)
+    repaired = repaired or pillar != idea.get('pilar')
+    idea['pilar'] = pillar
+    return idea, repaired
+
+
+class IdeaStreamParser:
+    # Recibe el texto por trozos y entrega cada objeto de la lista de ideas en cuanto se cierra.
+    # La lista es la raíz ([...]) o la primera lista dentro del objeto raíz ({"ideas": [...]}).
+    def __init__(self):
+        self.text = ""
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.item_start = None
+        self.items = 0
+
+    def _at_list(self):
+        return self.stack in (["["], ["{", "["])
+
+    def feed(self, chunk):
+        # Devuelve los objetos que se completaron con este trozo (ya decodificados)
+        self.text += chunk
+        items = []
+        for i in range(self.pos, len(self.text)):
+            c = self.text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in "{[":
+                if c == "{" and self._at_list():
+                    self.item_start = i
+                self.stack.append(c)
+            elif c in "}]":
+                if self.stack:
+                    self.stack.pop()
+                if c == "}" and self.item_start is not None and self._at_list():
+                    items.append(self.text[self.item_start:i + 1])
+                    self.item_start = None
+        self.pos = len(self.text)
+        decoded = []
+        for item in items:
+            try:
+                decoded.append(json.loads(item))
+            except ValueError:
+                decoded.append(None)
+        self.items += len(decoded)
+        return decoded
+
+    def finish(self):
+        # Al terminar el stream: (ideas que faltaba entregar, si se reparó una cola cortada)
+        if self.item_start is not None:
+            # Objeto cortado a la mitad: cerrar la cadena y los contenedores abiertos
+            tail = self.text[self.item_start:]
+            if self.escape:
+                tail = tail[:-1]
+            if self.in_string:
+                tail += '"'
+            tail = _DANGLING_TAIL.sub("", tail)
+            base = 2 if self.stack[:1] == ["{"] else 1
+            tail += "".join("}" if c == "{" else "]" for c in reversed(self.stack[base:]))
+            try:
+                return [json.loads(tail)], True
+            except ValueError:
+                return [], False
+        if self.items:
+            return [], False
+        # Nada salió como lista: otras formas ({"ideas": {...}}, {"1": {...}, ...}, una sola idea)
+        try:
+            data = json.loads(self.text)
+        except ValueError:
+            return [], False
+        if isinstance(data, dict) and isinstance(data.get('ideas'), (list, dict)):
+            data = data['ideas']
+        if isinstance(data, dict):
+            data = [data] if any(normalize(k) in ("titulo", "title") for k in data) else list(data.values())
+        return [raw for raw in data if isinstance(raw, dict)] if isinstance(data, list) else [], False
@@ -0,0 +1,132 @@
+# Trabajos de generación en segundo plano, independientes de los reruns de Streamlit: cada
+# trabajo corre en un hilo del pool, informa su progreso y guarda su resultado por id. Las
+# funciones de trabajo escriben directamente en el almacén (por id de perfil / tema), así que
+# el resultado llega a su sitio aunque el usuario haya cambiado de etapa o de perfil.
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Trabajos simultáneos del proceso (el gateway sigue aplicando los límites de RPM/TPM)
+JOB_WORKERS = 4
+# Trabajos terminados que se conservan para consultarlos (segundos)
+FINISHED_TTL_SECONDS = 3600
+
+QUEUED = "en cola"
+RUNNING = "en curso"
+DONE = "listo"
+FAILED = "error"
+CANCELLED = "cancelado"
+
+
+class Job:
+    def __init__(self, kind, label, owner=None, profile_id=None, topic_id=None):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.label = label
+        # Sesión que lo lanzó (para listar solo sus trabajos)
+        self.owner = owner
+        self.profile_id = profile_id
+        self.topic_id = topic_id
+        self.status = QUEUED
+        self.done = 0
+        self.total = None
+        self.message = None
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancel = threading.Event()
+
+    def update(self, done=None, total=None, message=None):
+        # Lo llama la función del trabajo para informar su avance
+        if done is not None:
+            self.done = done
+        if total is not None:
+            self.total = total
+        if message is not None:
+            self.message = message
+
+    def cancel(self):
+        # La función del trabajo consulta job.cancelled entre pasos y termina antes
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def progress(self):
+        return min(1.0, self.done / self.total) if self.total else None
+
+
+class JobRunner:
+    def __init__(self, max_workers=JOB_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, kind, label, fn, owner=None, profile_id=None, topic_id=None):
+        # fn(job) corre en segundo plano; lo que devuelve queda en job.result
+        job = Job(kind, label, owner, profile_id, topic_id)
+        with self.lock:
+            self._prune()
+            self.jobs[job.id] = job
+        self.executor.submit(self._run, job, fn)
+        return job.id
+
+    def _run(self, job, fn):
+        # finished_at se fija antes del estado final: en cuanto job.finished es cierto, _prune
+        # (desde otro hilo) ya puede restar la hora de fin
+        if job.cancelled:
+            job.finished_at = time.time()
+            job.status = CANCELLED
+            return
+        job.status = RUNNING
+        # Si fn sale con algo que no es Exception (KeyboardInterrupt, SystemExit) el trabajo queda
+        # fallido igual (no en curso para siempre) y la excepción sigue su camino
+        status = FAILED
+        try:
+            job.result = fn(job)
+            status = CANCELLED if job.cancelled else DONE
+        except Exception as e:
+            job.error = e
+        except BaseException as e:
+            job.error = e
+            raise
+        finally:
+            job.finished_at = time.time()
+            job.status = status
+
+    def _prune(self):
+        now = time.time()
+        for job_id in [j.id for j in self.jobs.values() if j.finished and j.finished_at is not None and now - j.finished_at > FINISHED_TTL_SECONDS]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self, owner=None, kind=None, profile_id=None, topic_id=None, active=None):
+        with self.lock:
+            jobs = list(self.jobs.values())
+        return [
+            j for j in sorted(jobs, key=lambda j: j.created_at)
+            if (owner is None or j.owner == owner) and (kind is None or j.kind == kind)
+            and (profile_id is None or j.profile_id == profile_id) and (topic_id is None or j.topic_id == topic_id)
+            and (active is None or active != j.finished)
+        ]
+
+    def cancel(self, owner=None, kind=None, profile_id=None, topic_id=None, keep=None):
+        # Cancela los trabajos activos que coinciden, salvo los que keep(job) quiera conservar
+        cancelled = [job for job in self.list(owner, kind, profile_id, topic_id, active=True) if not (keep and keep(job))]
+        for job in cancelled:
+            job.cancel()
+        return cancelled
+
+    def forget(self, job_id):
+        with self.lock:
+            self.jobs.pop(job_id, None)
@@ -0,0 +1,226 @@
+# Instrumentación de llamadas al LLM y reruns: latencia, tiempo al primer token, tokens y costo
+# estimado por etapa, perfil y tema. Exportable como JSONL o texto de Prometheus.
+import json
+import threading
+import time
+from collections import deque
+
+# Etapas instrumentadas
+STAGE_CHAT = "perfilador_chat"
+STAGE_SUMMARY = "resumen_entrevista"
+STAGE_DNA_DELTA = "adn_delta"
+STAGE_DNA_EXTRACTION = "adn_extraccion"
+STAGE_IDEAS = "estratega_ideas"
+STAGE_MORE_IDEAS = "estratega_mas_ideas"
+STAGE_SCRIPT = "guionista"
+STAGE_SCRIPT_BATCH = "guionista_lote"
+STAGE_SCRIPT_PREFETCH = "guionista_prefetch"
+STAGE_WHISPER = "whisper"
+
+# USD por millón de tokens (entrada, entrada cacheada, salida); Whisper en USD por minuto de audio
+MODEL_PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60)
+}
+WHISPER_PRICE_PER_MINUTE = 0.006
+# La Batch API cobra la mitad
+BATCH_PRICE_FACTOR = 0.5
+# Nombre de la columna con la cantidad de registros en aggregate()
+COUNT_LABELS = {"call": "llamadas", "rerun": "reruns", "route": "decisiones"}
+# Registros conservados en memoria (los más viejos se descartan)
+MAX_RECORDS = 20000
+
+
+def estimate_cost(model, prompt_tokens=0, completion_tokens=0, cached_tokens=0):
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    input_price, cached_price, output_price = prices
+    return ((prompt_tokens - cached_tokens) * input_price + cached_tokens * cached_price + completion_tokens * output_price) / 1_000_000
+
+
+def usage_fields(usage):
+    # Tokens de un objeto usage del SDK (o None si la respuesta no los trae)
+    if usage is None:
+        return {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0}
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_label_value(value)}"' for name, value in labels.items() if value is not None) + "}"
+
+
+class MetricsRecorder:
+    def __init__(self, max_records=MAX_RECORDS):
+        self.records = deque(maxlen=max_records)
+        self.lock = threading.Lock()
+
+    def record_call(self, stage, model, latency, ttft=None, usage=None, cached=False, error=None, tags=None, audio_seconds=None, batch=False):
+        fields = usage_fields(usage)
+        if cached:
+            cost = 0.0
+        elif audio_seconds is not None:
+            cost = audio_seconds / 60 * WHISPER_PRICE_PER_MINUTE
+        else:
+            cost = estimate_cost(model, **fields)
+            if batch and cost is not None:
+                cost *= BATCH_PRICE_FACTOR
+        record = {
+            "kind": "call",
+            "ts": time.time(),
+            "stage": stage,
+            "model": model,
+            "latency": latency,
+            "ttft": ttft,
+            **fields,
+            "cost": cost,
+            "cached": cached,
+            "error": str(error) if error else None,
+            "profile_id": (tags or {}).get("profile_id"),
+            "topic_id": (tags or {}).get("topic_id"),
+            # Trabajo en segundo plano que hizo la llamada (para imputarle su gasto)
+            "job_id": (tags or {}).get("job_id")
+        }
+        with self.lock:
+            self.records.append(record)
+
+    def record_route(self, stage, model, decision, latency, error=None, tags=None):
+        # Decisión del enrutado por etapa (routing.py): qué modelo respondió y en cuánto tiempo
+        with self.lock:
+            self.records.append({
+                "kind": "route",
+                "ts": time.time(),
+                "stage": stage,
+                "model": model,
+                "decision": decision,
+                "latency": latency,
+                "error": str(error) if error else None,
+                "profile_id": (tags or {}).get("profile_id"),
+                "topic_id": (tags or {}).get("topic_id")
+            })
+
+    def record_rerun(self, scope, duration, stage=None, profile_id=None):
+        with self.lock:
+            self.records.append({
+                "kind": "rerun",
+                "ts": time.time(),
+                "scope": scope,
+                "stage": stage,
+                "latency": duration,
+                "profile_id": profile_id
+            })
+
+    def snapshot(self, kind=None, profile_id=None):
+        with self.lock:
+            records = list(self.records)
+        return [
+            r for r in records
+            if (kind is None or r['kind'] == kind) and (profile_id is None or r.get('profile_id') == profile_id)
+        ]
+
+    def aggregate(self, group_by, kind="call", profile_id=None):
+        # Una fila por valor de group_by (campo o tupla de campos) con p50/p95 y totales
+        fields = (group_by,) if isinstance(group_by, str) else tuple(group_by)
+        groups = {}
+        for record in self.snapshot(kind, profile_id):
+            groups.setdefault(tuple(record.get(f) for f in fields), []).append(record)
+        rows = []
+        for key, records in groups.items():
+            latencies = [r['latency'] for r in records]
+            ttfts = [r['ttft'] for r in records if r.get('ttft') is not None]
+            row = dict(zip(fields, key))
+            row.update({
+                COUNT_LABELS[kind]: len(records),
+                "p50_s": percentile(latencies, 0.5),
+                "p95_s": percentile(latencies, 0.95)
+            })
+            if kind == "call":
+                row.update({
+                    "ttft_p50_s": percentile(ttfts, 0.5),
+                    "ttft_p95_s": percentile(ttfts, 0.95),
+                    "tokens_entrada": sum(r['prompt_tokens'] for r in records),
+                    "tokens_cacheados": sum(r['cached_tokens'] for r in records),
+                    "tokens_salida": sum(r['completion_tokens'] for r in records),
+                    "cache_hits": sum(1 for r in records if r['cached']),
+                    "errores": sum(1 for r in records if r['error']),
+                    "costo_usd": sum(r['cost'] or 0.0 for r in records)
+                })
+            rows.append(row)
+        return sorted(rows, key=lambda row: tuple(str(row[f]) for f in fields))
+
+    def to_jsonl(self):
+        return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in self.snapshot())
+
+    def to_prometheus(self):
+        calls = self.snapshot("call")
+        reruns = self.snapshot("rerun")
+        lines = []
+
+        def summary(name, help_text, groups):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} summary")
+            for labels, values in sorted(groups.items()):
+                label_dict = dict(labels)
+                for quantile in (0.5, 0.95):
+                    lines.append(f"{name}{_labels(**label_dict, quantile=quantile)} {percentile(values, quantile)}")
+                lines.append(f"{name}_sum{_labels(**label_dict)} {sum(values)}")
+                lines.append(f"{name}_count{_labels(**label_dict)} {len(values)}")
+
+        def counter(name, help_text, groups):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(groups.items()):
+                lines.append(f"{name}{_labels(**dict(labels))} {value}")
+
+        latency, ttft, totals = {}, {}, {}
+        for r in calls:
+            by_stage = (("stage", r['stage']), ("model", r['model']))
+            latency.setdefault(by_stage, []).append(r['latency'])
+            if r['ttft'] is not None:
+                ttft.setdefault(by_stage, []).append(r['ttft'])
+            by_owner = by_stage + (("profile_id", r['profile_id'] or ""), ("topic_id", r['topic_id'] or ""))
+            entry = totals.setdefault(by_owner, {"calls": 0, "prompt": 0, "cached": 0, "completion": 0, "cost": 0.0})
+            entry["calls"] += 1
+            entry["prompt"] += r['prompt_tokens']
+            entry["cached"] += r['cached_tokens']
+            entry["completion"] += r['completion_tokens']
+            entry["cost"] += r['cost'] or 0.0
+        summary("influencer_factory_call_latency_seconds", "Latencia de las llamadas al LLM.", latency)
+        summary("influencer_factory_call_ttft_seconds", "Tiempo al primer token de las llamadas en streaming.", ttft)
+        counter("influencer_factory_calls_total", "Llamadas al LLM (incluye aciertos de caché).", {k: v["calls"] for k, v in totals.items()})
+        counter("influencer_factory_tokens_total", "Tokens consumidos.", {
+            **{k + (("type", "prompt"),): v["prompt"] for k, v in totals.items()},
+            **{k + (("type", "cached"),): v["cached"] for k, v in totals.items()},
+            **{k + (("type", "completion"),): v["completion"] for k, v in totals.items()}
+        })
+        counter("influencer_factory_cost_usd_total", "Costo estimado en USD.", {k: v["cost"] for k, v in totals.items()})
+        rerun_groups = {}
+        for r in reruns:
+            rerun_groups.setdefault((("scope", r['scope']), ("stage", r['stage'] or "")), []).append(r['latency'])
+        summary("influencer_factory_rerun_seconds", "Duración de los reruns de Streamlit.", rerun_groups)
+        route_groups = {}
+        for r in self.snapshot("route"):
+            key = (("stage", r['stage']), ("decision", r['decision']), ("model", r['model']))
+            route_groups[key] = route_groups.get(key, 0) + 1
+        counter("influencer_factory_route_decisions_total", "Decisiones del enrutado de modelos por etapa.", route_groups)
+        return "\n".join(lines) + "\n"
+
+
+# Registro compartido por todas las sesiones y hilos del proceso
+recorder = MetricsRecorder()
@@ -0,0 +1,79 @@
+# Pre-generación especulativa de guiones (opcional): en cuanto llegan ideas nuevas se escriben
+# en segundo plano los guiones de las primeras K (si se quiere, solo de ciertos pilares) y se
+# guardan como borrador en la idea, para que abrirla en El Guionista sea inmediato. El gasto de
+# estos borradores tiene un tope por perfil y cada borrador solo vale para la plantilla del
+# Guionista con la que se escribió.
+import hashlib
+
+from context import context_tokens
+from gateway import DEFAULT_COMPLETION_ESTIMATE
+from metrics import STAGE_SCRIPT_PREFETCH, estimate_cost, recorder
+
+# top_k: ideas nuevas a guionizar; pillars: vacío = todos; cap_usd: tope de gasto por perfil
+DEFAULT_PREFETCH = {"enabled": False, "top_k": 3, "pillars": [], "cap_usd": 0.10}
+# Guiones en paralelo de la pre-generación (deja hueco en el gateway a lo que pide el usuario)
+PREFETCH_WORKERS = 2
+# Ajuste con el gasto acumulado por perfil ({profile_id: USD})
+SPENT_SETTING = "prefetch_spent"
+
+
+def load_prefetch(saved=None):
+    return dict(DEFAULT_PREFETCH, **(saved or {}))
+
+
+def template_fingerprint(template):
+    return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+
+def make_draft(script, template):
+    return {"script": script, "template": template_fingerprint(template)}
+
+
+def valid_draft(idea, template):
+    # Texto del borrador si se escribió con esta plantilla (y la idea aún no tiene guión)
+    draft = idea.get('draft')
+    if idea.get('script') or not draft or draft.get('template') != template_fingerprint(template):
+        return None
+    return draft['script']
+
+
+def pick_ideas(ideas, top_k, pillars=()):
+    # Las primeras K ideas (en el orden en que llegaron) sin guión ni borrador, del pilar pedido
+    return [
+        idea for idea in ideas
+        if not idea.get('script') and not idea.get('draft') and (not pillars or idea.get('pilar') in pillars)
+    ][:top_k]
+
+
+def estimate_script_cost(model, messages):
+    # Estimación previa (sin caché de prompts) para no pasarse del tope antes de llamar
+    return estimate_cost(model, context_tokens(messages), DEFAULT_COMPLETION_ESTIMATE) or 0.0
+
+
+def prefetch_spent(store, profile_id):
+    return (store.get_setting(SPENT_SETTING) or {}).get(profile_id, 0.0)
+
+
+def add_prefetch_spent(store, profile_id, cost):
+    # Atómico: dos pre-generaciones que terminan a la vez suman las dos
+    def add(spent):
+        spent = spent or {}
+        spent[profile_id] = spent.get(profile_id, 0.0) + cost
+        return spent
+    store.update_setting(SPENT_SETTING, add)
+
+
+def reset_prefetch_spent(store, profile_id):
+    def reset(spent):
+        spent = spent or {}
+        spent.pop(profile_id, None)
+        return spent
+    store.update_setting(SPENT_SETTING, reset)
+
+
+def recorded_cost(profile_id, job_id):
+    # Gasto real de las llamadas de la pre-generación job_id (las respuestas de caché cuestan 0)
+    return sum(
+        r['cost'] or 0.0 for r in recorder.snapshot("call", profile_id)
+        if r['stage'] == STAGE_SCRIPT_PREFETCH and r.get('job_id') == job_id
+    )
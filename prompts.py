@@ -0,0 +1,55 @@
+# Armado de prompts con prefijo estable: el proveedor cachea el inicio idéntico de la petición
+# (instrucciones + ADN), así que lo que cambia en cada llamada (tema, idea) debe ir al final.
+# Las plantillas editables se compilan y validan una sola vez por texto.
+import functools
+import json
+import re
+
+# Placeholders de cada plantilla editable; los volátiles cambian en cada llamada del mismo perfil
+TEMPLATE_FIELDS = {
+    "strategist": ("profile_str", "topic_name"),
+    "scriptwriter": ("profile_str", "idea_str")
+}
+VOLATILE_FIELDS = {"topic_name", "idea_str"}
+
+# Solo los placeholders de cada plantilla: en el Guionista "{topic_name}" es texto literal
+_PLACEHOLDERS = {name: re.compile(r"\{(" + "|".join(fields) + r")\}") for name, fields in TEMPLATE_FIELDS.items()}
+
+
+class TemplateError(ValueError):
+    pass
+
+
+def canonical_json(value):
+    # Misma serialización para el mismo ADN: claves ordenadas y sin espacios variables
+    return json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+
+
+class CompiledTemplate:
+    def __init__(self, name, text):
+        self.name = name
+        self.text = text
+        # Trozos de texto y nombres de placeholder alternados: [texto, campo, texto, campo, ..., texto]
+        self.parts = _PLACEHOLDERS[name].split(text)
+        fields = self.parts[1::2]
+        missing = [f for f in TEMPLATE_FIELDS[name] if f not in fields]
+        if missing:
+            raise TemplateError("Falta " + ", ".join("{" + f + "}" for f in missing) + " en la plantilla.")
+        # Texto fijo hasta el primer placeholder volátil: es lo que se comparte entre llamadas
+        first_volatile = next(k for k, f in enumerate(fields) if f in VOLATILE_FIELDS)
+        self.stable_chars = sum(len(p) for p in self.parts[:2 * first_volatile + 1])
+        self.warnings = []
+        if "profile_str" in fields[first_volatile:]:
+            self.warnings.append("{profile_str} aparece después del dato que cambia en cada llamada: el perfil no entra en el prefijo cacheable.")
+        if len(text) - self.stable_chars > len(text) // 4:
+            self.warnings.append("Buena parte de las instrucciones va después del dato variable; muévelo al final para aprovechar la caché de prompts.")
+
+    def render(self, dna, **values):
+        values['profile_str'] = canonical_json(dna)
+        return "".join(part if k % 2 == 0 else values[part] for k, part in enumerate(self.parts))
+
+
+@functools.lru_cache(maxsize=64)
+def compile_template(name, text):
+    # Lanza TemplateError si la plantilla no sirve; el resultado se reutiliza mientras el texto no cambie
+    return CompiledTemplate(name, text)
@@ -0,0 +1,140 @@
+# Enrutado de modelos por etapa: modelo principal, modelo alternativo y presupuesto de latencia.
+# Si el principal no responde dentro del presupuesto (en streaming: no llega el primer token) se
+# sirve la respuesta anterior guardada o se pasa al alternativo, más rápido; si el principal
+# falla, también se pasa al alternativo. Cada decisión queda registrada en las métricas.
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import openai
+
+from metrics import recorder
+
+ROUTE_STAGES = ("interview", "summary", "dna", "dna_delta", "strategist", "scriptwriter")
+ROUTE_LABELS = {
+    "interview": "Entrevista",
+    "summary": "Resumen de la entrevista",
+    "dna": "Extracción de ADN",
+    "dna_delta": "ADN incremental (tras cada turno)",
+    "strategist": "Estratega",
+    "scriptwriter": "Guionista"
+}
+ROUTE_MODELS = ("gpt-4o", "gpt-4o-mini")
+# budget: segundos (None = sin límite)
+DEFAULT_ROUTES = {stage: {"model": "gpt-4o", "fallback": "gpt-4o-mini", "budget": None} for stage in ROUTE_STAGES}
+# Resumen y deltas del ADN corren en cada turno: por defecto el modelo barato, y el grande de plan B
+DEFAULT_ROUTES.update({stage: {"model": "gpt-4o-mini", "fallback": "gpt-4o", "budget": None} for stage in ("summary", "dna_delta")})
+# Reintentos del gateway antes de pasar al alternativo (sin alternativo se usan los de siempre)
+FAILOVER_RETRIES = 1
+# Hilos que esperan el primer trozo de los streams con presupuesto (de sobra para que las
+# peticiones no hagan cola: un stream abandonado ocupa su hilo hasta que llega su primer trozo)
+FIRST_CHUNK_WORKERS = 32
+_first_chunk_pool = ThreadPoolExecutor(max_workers=FIRST_CHUNK_WORKERS, thread_name_prefix="first-chunk")
+
+DECISION_PRIMARY = "principal"
+DECISION_PREVIOUS = "anterior_por_tiempo"
+DECISION_FALLBACK_TIMEOUT = "alternativo_por_tiempo"
+DECISION_FALLBACK_ERROR = "alternativo_por_error"
+DECISION_FAILED = "error"
+
+
+class BudgetExceeded(TimeoutError):
+    # El stream no entregó su primer trozo dentro del presupuesto
+    pass
+
+
+class Route:
+    def __init__(self, stage, model, fallback=None, budget=None):
+        self.stage = stage
+        self.model = model
+        self.fallback = fallback if fallback != model else None
+        self.budget = budget or None
+
+    def options(self, stream=False):
+        # Opciones de la llamada principal para el gateway. En streaming el presupuesto no va como
+        # timeout de httpx (valdría para cada lectura del stream entero): lo vigila first_chunk
+        options = {}
+        if self.budget and not stream:
+            # Un timeout dentro del presupuesto no se reintenta: se resuelve con el plan B
+            options.update(timeout=self.budget, retry_timeouts=False)
+        if self.fallback:
+            options['max_retries'] = FAILOVER_RETRIES
+        return options
+
+
+def load_routes(saved=None):
+    # Tabla completa (una entrada por etapa) a partir de lo guardado en los ajustes
+    return {stage: dict(DEFAULT_ROUTES[stage], **((saved or {}).get(stage) or {})) for stage in ROUTE_STAGES}
+
+
+def route_for(routes, stage):
+    entry = load_routes(routes)[stage]
+    return Route(stage, entry['model'], entry.get('fallback'), entry.get('budget'))
+
+
+def is_timeout(error):
+    return isinstance(error, (openai.APITimeoutError, BudgetExceeded))
+
+
+def first_chunk(chunks, budget):
+    # Iterador equivalente a chunks que lanza BudgetExceeded si el primer trozo no llega en
+    # `budget` segundos desde que empieza la petición; el resto del stream se lee con el timeout
+    # normal. Si la petición sigue en la cola del pool pasado el presupuesto se cancela sin
+    # llegar a hacerse; una ya empezada y abandonada se cierra (y suelta su conexión) en cuanto
+    # su primer trozo termina de llegar
+    started = []
+
+    def first():
+        started.append(time.perf_counter())
+        return next(chunks, "")
+
+    future = _first_chunk_pool.submit(first)
+    wait = budget
+    while True:
+        try:
+            return itertools.chain([future.result(timeout=wait)], chunks)
+        except FutureTimeout:
+            pass
+        if not started:
+            if future.cancel():
+                chunks.close()
+                raise BudgetExceeded(f"Sin hilo libre para la petición en {budget} s") from None
+            # Acaba de empezar: el presupuesto cuenta desde ahora
+            wait = budget
+            continue
+        wait = budget - (time.perf_counter() - started[0])
+        if wait <= 0:
+            break
+    if not future.cancel():
+        future.add_done_callback(lambda _: chunks.close())
+    raise BudgetExceeded(f"Sin respuesta en {budget} s")
+
+
+def routed_call(route, call, previous=None, tags=None, stream=False):
+    # call(model, **options) hace la llamada; previous() devuelve la respuesta guardada del
+    # modelo principal (o None). Devuelve lo que devuelva call (o previous)
+    start = time.perf_counter()
+    try:
+        result = call(route.model, **route.options(stream))
+        recorder.record_route(route.stage, route.model, DECISION_PRIMARY, time.perf_counter() - start, tags=tags)
+        return result
+    except Exception as e:
+        primary_error = e
+        timed_out = bool(route.budget) and is_timeout(e)
+        if timed_out and previous is not None:
+            cached = previous()
+            if cached is not None:
+                recorder.record_route(route.stage, route.model, DECISION_PREVIOUS, time.perf_counter() - start, error=e, tags=tags)
+                return cached
+        if not route.fallback:
+            recorder.record_route(route.stage, route.model, DECISION_FAILED, time.perf_counter() - start, error=e, tags=tags)
+            raise
+        decision = DECISION_FALLBACK_TIMEOUT if timed_out else DECISION_FALLBACK_ERROR
+    try:
+        result = call(route.fallback)
+    except Exception as e:
+        recorder.record_route(route.stage, route.fallback, DECISION_FAILED, time.perf_counter() - start, error=e, tags=tags)
+        raise
+    recorder.record_route(route.stage, route.fallback, decision, time.perf_counter() - start, error=primary_error, tags=tags)
+    return result
@@ -0,0 +1,542 @@
+# Almacén persistente (SQLite en modo WAL) para perfiles, temas, ideas y mensajes.
+# La app mantiene en st.session_state['data'] solo el perfil activo y escribe
+# aquí cada mutación de forma incremental.
+import json
+import sqlite3
+import threading
+import time
+
+from dump import DumpError
+
+# Columnas añadidas después de la primera versión del esquema
+PROFILE_MIGRATIONS = {
+    "summary": "ALTER TABLE profiles ADD COLUMN summary TEXT",
+    "dna_upto": "ALTER TABLE profiles ADD COLUMN dna_upto INTEGER NOT NULL DEFAULT 0"
+}
+# Columnas derivadas de la idea para filtrar y ordenar sin leer el JSON
+IDEA_MIGRATIONS = {
+    "pilar": "ALTER TABLE ideas ADD COLUMN pilar TEXT",
+    "scripted": "ALTER TABLE ideas ADD COLUMN scripted INTEGER NOT NULL DEFAULT 0",
+    "created_at": "ALTER TABLE ideas ADD COLUMN created_at REAL"
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    dna TEXT,
+    summary TEXT,
+    dna_upto INTEGER NOT NULL DEFAULT 0,
+    position INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    profile_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    PRIMARY KEY (profile_id, seq)
+);
+CREATE TABLE IF NOT EXISTS topics (
+    id TEXT PRIMARY KEY,
+    profile_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS topics_by_profile ON topics (profile_id, position);
+CREATE TABLE IF NOT EXISTS ideas (
+    id TEXT PRIMARY KEY,
+    topic_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    pilar TEXT,
+    scripted INTEGER NOT NULL DEFAULT 0,
+    created_at REAL
+);
+CREATE INDEX IF NOT EXISTS ideas_by_topic ON ideas (topic_id, position);
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS batches (
+    id TEXT PRIMARY KEY,
+    profile_id TEXT NOT NULL,
+    topic_id TEXT NOT NULL,
+    key_id TEXT NOT NULL,
+    status TEXT NOT NULL,
+    idea_ids TEXT NOT NULL,
+    model TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    applied INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS batches_by_topic ON batches (topic_id, created_at);
+CREATE INDEX IF NOT EXISTS batches_by_status ON batches (status);
+"""
+
+# Índices secundarios de ideas (después de migrar: usan columnas nuevas)
+IDEA_INDEXES = """
+CREATE INDEX IF NOT EXISTS ideas_by_pilar ON ideas (topic_id, pilar, position);
+CREATE INDEX IF NOT EXISTS ideas_by_scripted ON ideas (topic_id, scripted, position);
+CREATE INDEX IF NOT EXISTS ideas_by_created ON ideas (topic_id, created_at);
+"""
+# Filas que se leen / escriben por tanda al exportar e importar por registros
+RECORD_PAGE_SIZE = 500
+
+# Búsqueda de texto completo sobre título y gancho (sin distinguir acentos); rowid = rowid de ideas
+IDEA_FTS = "CREATE VIRTUAL TABLE IF NOT EXISTS ideas_fts USING fts5(titulo, gancho_visual, tokenize='unicode61 remove_diacritics 2')"
+
+
+def idea_columns(idea):
+    return idea.get('pilar'), 1 if idea.get('script') else 0
+
+
+def fts_query(text):
+    # Cada palabra como prefijo: "neum karting" encuentra "neumáticos de karting"
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in text.split())
+
+
+class FactoryStore:
+    def __init__(self, path):
+        self.path = path
+        # Una conexión compartida por todas las sesiones del proceso, serializada con un lock
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._migrate()
+            self._conn.executescript(IDEA_INDEXES)
+            try:
+                self._conn.execute(IDEA_FTS)
+                self.fts = True
+            except sqlite3.OperationalError:
+                # SQLite sin FTS5: la búsqueda cae a LIKE
+                self.fts = False
+            self._backfill_ideas()
+
+    def _migrate(self):
+        for table, migrations in (("profiles", PROFILE_MIGRATIONS), ("ideas", IDEA_MIGRATIONS)):
+            columns = {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}
+            for column, statement in migrations.items():
+                if column not in columns:
+                    self._conn.execute(statement)
+        self._conn.commit()
+
+    def _backfill_ideas(self):
+        # Ideas guardadas antes de las columnas derivadas / del índice de texto
+        stale = self._conn.execute("SELECT id, data, position FROM ideas WHERE created_at IS NULL").fetchall()
+        for idea_id, data, position in stale:
+            # Sin fecha real: la posición conserva el orden relativo (quedan como las más antiguas)
+            self._conn.execute(
+                "UPDATE ideas SET pilar = ?, scripted = ?, created_at = ? WHERE id = ?",
+                (*idea_columns(json.loads(data)), position, idea_id)
+            )
+        if self.fts and self._conn.execute("SELECT COUNT(*) FROM ideas_fts").fetchone()[0] == 0:
+            self._conn.execute(
+                "INSERT INTO ideas_fts (rowid, titulo, gancho_visual) "
+                "SELECT rowid, json_extract(data, '$.titulo'), json_extract(data, '$.gancho_visual') FROM ideas"
+            )
+        self._conn.commit()
+
+    # --- Ajustes (perfil activo, prompts) ---
+    def get_setting(self, key, default=None):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_setting(self, key, value):
+        with self._lock, self._conn:
+            self._put_setting(key, value)
+
+    def update_setting(self, key, update, default=None):
+        # Lee, modifica y guarda un ajuste en una sola transacción (p. ej. sumar a un acumulado
+        # desde varios hilos sin perder incrementos). update(valor) devuelve el valor nuevo
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+            value = update(json.loads(row[0]) if row else default)
+            self._put_setting(key, value)
+        return value
+
+    def _put_setting(self, key, value):
+        self._conn.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value))
+        )
+
+    # --- Perfiles ---
+    def list_profiles(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT id, name FROM profiles ORDER BY position").fetchall()
+        return {pid: name for pid, name in rows}
+
+    def load_profile(self, profile_id, include_ideas=False):
+        # Las ideas se consultan por página (query_ideas); include_ideas las trae todas (exportación)
+        with self._lock:
+            row = self._conn.execute("SELECT name, dna, summary, dna_upto FROM profiles WHERE id = ?", (profile_id,)).fetchone()
+            if row is None:
+                return None
+            messages = self._conn.execute(
+                "SELECT role, content FROM messages WHERE profile_id = ? ORDER BY seq", (profile_id,)
+            ).fetchall()
+            topic_rows = self._conn.execute(
+                "SELECT id, name FROM topics WHERE profile_id = ? ORDER BY position", (profile_id,)
+            ).fetchall()
+            topics = {}
+            for topic_id, topic_name in topic_rows:
+                topics[topic_id] = {"name": topic_name}
+                if include_ideas:
+                    topics[topic_id]['ideas'] = self.query_ideas(topic_id)
+        return {
+            "name": row[0],
+            "dna": json.loads(row[1]) if row[1] else None,
+            "chat_history": [{"role": role, "content": content} for role, content in messages],
+            "summary": json.loads(row[2]) if row[2] else None,
+            "dna_upto": row[3],
+            "topics": topics
+        }
+
+    def save_profile(self, profile_id, profile):
+        # Escribe (o reemplaza) un perfil completo con sus mensajes, temas e ideas
+        with self._lock, self._conn:
+            self._delete_profile(profile_id)
+            position = self._conn.execute("SELECT COALESCE(MAX(position), -1) + 1 FROM profiles").fetchone()[0]
+            self._conn.execute(
+                "INSERT INTO profiles (id, name, dna, summary, dna_upto, position) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    profile_id,
+                    profile['name'],
+                    json.dumps(profile['dna']) if profile.get('dna') else None,
+                    json.dumps(profile['summary']) if profile.get('summary') else None,
+                    profile.get('dna_upto', 0),
+                    position
+                )
+            )
+            self._conn.executemany(
+                "INSERT INTO messages (profile_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                [(profile_id, seq, m['role'], m['content']) for seq, m in enumerate(profile.get('chat_history', []))]
+            )
+            for topic_position, (topic_id, topic) in enumerate(profile.get('topics', {}).items()):
+                self._conn.execute(
+                    "INSERT INTO topics (id, profile_id, name, position) VALUES (?, ?, ?, ?)",
+                    (topic_id, profile_id, topic['name'], topic_position)
+                )
+                self._insert_ideas(topic_id, topic.get('ideas', []), 0)
+
+    def set_dna(self, profile_id, dna, dna_upto=None):
+        # dna_upto: cantidad de mensajes del chat ya incorporados al ADN
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE profiles SET dna = ? WHERE id = ?", (json.dumps(dna) if dna else None, profile_id))
+            if dna_upto is not None:
+                self._conn.execute("UPDATE profiles SET dna_upto = ? WHERE id = ?", (dna_upto, profile_id))
+
+    def set_summary(self, profile_id, summary):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE profiles SET summary = ? WHERE id = ?", (json.dumps(summary), profile_id))
+
+    def _delete_profile(self, profile_id):
+        topic_ids = [tid for (tid,) in self._conn.execute("SELECT id FROM topics WHERE profile_id = ?", (profile_id,))]
+        if self.fts:
+            self._conn.executemany(
+                "DELETE FROM ideas_fts WHERE rowid IN (SELECT rowid FROM ideas WHERE topic_id = ?)", [(tid,) for tid in topic_ids]
+            )
+        self._conn.executemany("DELETE FROM ideas WHERE topic_id = ?", [(tid,) for tid in topic_ids])
+        self._conn.execute("DELETE FROM topics WHERE profile_id = ?", (profile_id,))
+        self._conn.execute("DELETE FROM messages WHERE profile_id = ?", (profile_id,))
+        self._conn.execute("DELETE FROM profiles WHERE id = ?", (profile_id,))
+
+    # --- Mensajes ---
+    def append_message(self, profile_id, message):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO messages (profile_id, seq, role, content) "
+                "SELECT ?, COALESCE(MAX(seq), -1) + 1, ?, ? FROM messages WHERE profile_id = ?",
+                (profile_id, message['role'], message['content'], profile_id)
+            )
+
+    # --- Temas e ideas ---
+    def create_topic(self, profile_id, topic_id, name):
+        with self._lock, self._conn:
+            position = self._conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM topics WHERE profile_id = ?", (profile_id,)
+            ).fetchone()[0]
+            self._conn.execute(
+                "INSERT INTO topics (id, profile_id, name, position) VALUES (?, ?, ?, ?)",
+                (topic_id, profile_id, name, position)
+            )
+
+    def add_ideas(self, topic_id, ideas):
+        with self._lock, self._conn:
+            position = self._conn.execute(
+                "SELECT COALESCE(MAX(position), -1) + 1 FROM ideas WHERE topic_id = ?", (topic_id,)
+            ).fetchone()[0]
+            self._insert_ideas(topic_id, ideas, position)
+
+    def _insert_ideas(self, topic_id, ideas, start, replace=True):
+        # replace=False (importación): un id ya existente es un error, no se pisa la fila
+        now = time.time()
+        if self.fts and replace:
+            # INSERT OR REPLACE cambia el rowid: quitar antes la entrada vieja del índice de texto
+            self._conn.executemany(
+                "DELETE FROM ideas_fts WHERE rowid IN (SELECT rowid FROM ideas WHERE id = ?)", [(idea['id'],) for idea in ideas]
+            )
+        self._conn.executemany(
+            f"INSERT {'OR REPLACE ' if replace else ''}INTO ideas (id, topic_id, position, data, pilar, scripted, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [
+                (idea['id'], topic_id, start + offset, json.dumps(idea), *idea_columns(idea), now + offset * 1e-6)
+                for offset, idea in enumerate(ideas)
+            ]
+        )
+        if self.fts:
+            self._conn.executemany(
+                "INSERT INTO ideas_fts (rowid, titulo, gancho_visual) SELECT rowid, ?, ? FROM ideas WHERE id = ?",
+                [(idea.get('titulo', ''), idea.get('gancho_visual', ''), idea['id']) for idea in ideas]
+            )
+
+    def update_idea(self, idea):
+        # Reescribe solo la fila de la idea (p. ej. al guardar su guión) y su entrada del índice
+        # de texto, para que la búsqueda encuentre el título y el gancho editados
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE ideas SET data = ?, pilar = ?, scripted = ? WHERE id = ?",
+                (json.dumps(idea), *idea_columns(idea), idea['id'])
+            )
+            if self.fts:
+                self._conn.execute("DELETE FROM ideas_fts WHERE rowid IN (SELECT rowid FROM ideas WHERE id = ?)", (idea['id'],))
+                self._conn.execute(
+                    "INSERT INTO ideas_fts (rowid, titulo, gancho_visual) SELECT rowid, ?, ? FROM ideas WHERE id = ?",
+                    (idea.get('titulo', ''), idea.get('gancho_visual', ''), idea['id'])
+                )
+
+    def get_idea(self, idea_id):
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM ideas WHERE id = ?", (idea_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _idea_filters(self, topic_id, pilar=None, scripted=None, search=None):
+        clauses, params = ["topic_id = ?"], [topic_id]
+        if pilar is not None:
+            clauses.append("pilar = ?")
+            params.append(pilar)
+        if scripted is not None:
+            clauses.append("scripted = ?")
+            params.append(1 if scripted else 0)
+        if search and search.strip():
+            if self.fts:
+                clauses.append("rowid IN (SELECT rowid FROM ideas_fts WHERE ideas_fts MATCH ?)")
+                params.append(fts_query(search))
+            else:
+                clauses.append("(json_extract(data, '$.titulo') LIKE ? OR json_extract(data, '$.gancho_visual') LIKE ?)")
+                params.extend([f"%{search.strip()}%"] * 2)
+        return " AND ".join(clauses), params
+
+    def query_ideas(self, topic_id, pilar=None, scripted=None, search=None, newest_first=False, limit=None, offset=0):
+        # Ideas del tema filtradas por pilar / guión / texto; limit + offset para paginar
+        where, params = self._idea_filters(topic_id, pilar, scripted, search)
+        order = "created_at DESC" if newest_first else "position"
+        sql = f"SELECT data FROM ideas WHERE {where} ORDER BY {order}"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self._lock:
+            return [json.loads(d) for (d,) in self._conn.execute(sql, params)]
+
+    def count_ideas(self, topic_id, pilar=None, scripted=None, search=None):
+        where, params = self._idea_filters(topic_id, pilar, scripted, search)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM ideas WHERE {where}", params).fetchone()[0]
+
+    def idea_pillars(self, topic_id):
+        # {pilar: cantidad} para los filtros
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT pilar, COUNT(*) FROM ideas WHERE topic_id = ? GROUP BY pilar ORDER BY pilar", (topic_id,)
+            ).fetchall()
+        return {pilar: count for pilar, count in rows if pilar}
+
+    # --- Lotes de la Batch API (guiones en diferido) ---
+    def add_batch(self, batch_id, profile_id, topic_id, key_id, idea_ids, model, status):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO batches (id, profile_id, topic_id, key_id, status, idea_ids, model, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (batch_id, profile_id, topic_id, key_id, status, json.dumps(idea_ids), model, now, now)
+            )
+
+    def update_batch(self, batch_id, status, applied=None, failed=None, error=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE batches SET status = ?, applied = COALESCE(?, applied), failed = COALESCE(?, failed), "
+                "error = COALESCE(?, error), updated_at = ? WHERE id = ?",
+                (status, applied, failed, error, time.time(), batch_id)
+            )
+
+    def get_batch(self, batch_id):
+        batches = self.list_batches(batch_id=batch_id)
+        return batches[0] if batches else None
+
+    def list_batches(self, topic_id=None, statuses=None, key_id=None, batch_id=None):
+        clauses, params = [], []
+        if batch_id is not None:
+            clauses.append("id = ?")
+            params.append(batch_id)
+        if topic_id is not None:
+            clauses.append("topic_id = ?")
+            params.append(topic_id)
+        if statuses is not None:
+            clauses.append(f"status IN ({', '.join('?' * len(statuses))})")
+            params.extend(statuses)
+        if key_id is not None:
+            clauses.append("key_id = ?")
+            params.append(key_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        columns = ("id", "profile_id", "topic_id", "key_id", "status", "idea_ids", "model", "created_at", "updated_at", "applied", "failed", "error")
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(columns)} FROM batches {where} ORDER BY created_at DESC", params).fetchall()
+        batches = [dict(zip(columns, row)) for row in rows]
+        for batch in batches:
+            batch['idea_ids'] = json.loads(batch['idea_ids'])
+        return batches
+
+    # --- Volcado por registros (exportación / importación en streaming, ver dump.py) ---
+    def iter_records(self, page_size=RECORD_PAGE_SIZE):
+        # Un registro por perfil, mensaje, tema e idea; mensajes e ideas se leen por páginas
+        for pid in self.list_profiles():
+            with self._lock:
+                row = self._conn.execute("SELECT name, dna, summary, dna_upto FROM profiles WHERE id = ?", (pid,)).fetchone()
+            if row is None:
+                continue
+            yield {
+                "type": "profile",
+                "id": pid,
+                "name": row[0],
+                "dna": json.loads(row[1]) if row[1] else None,
+                "summary": json.loads(row[2]) if row[2] else None,
+                "dna_upto": row[3]
+            }
+            last_seq = -1
+            while True:
+                with self._lock:
+                    rows = self._conn.execute(
+                        "SELECT seq, role, content FROM messages WHERE profile_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                        (pid, last_seq, page_size)
+                    ).fetchall()
+                for last_seq, role, content in rows:
+                    yield {"type": "message", "profile_id": pid, "role": role, "content": content}
+                if len(rows) < page_size:
+                    break
+            with self._lock:
+                topic_rows = self._conn.execute(
+                    "SELECT id, name FROM topics WHERE profile_id = ? ORDER BY position", (pid,)
+                ).fetchall()
+            for topic_id, topic_name in topic_rows:
+                yield {"type": "topic", "id": topic_id, "profile_id": pid, "name": topic_name}
+                last = (-1, "")
+                while True:
+                    with self._lock:
+                        rows = self._conn.execute(
+                            "SELECT position, id, data FROM ideas WHERE topic_id = ? AND (position, id) > (?, ?) ORDER BY position, id LIMIT ?",
+                            (topic_id, *last, page_size)
+                        ).fetchall()
+                    for position, idea_id, data in rows:
+                        last = (position, idea_id)
+                        yield {"type": "idea", "topic_id": topic_id, "idea": json.loads(data)}
+                    if len(rows) < page_size:
+                        break
+
+    def import_records(self, records, profile_ids=None, replace=False):
+        # Consume registros ya validados (dump.read_records) en una sola transacción: si alguno
+        # falla no queda nada a medias. replace borra todo antes; si no, se combinan: cada perfil
+        # del archivo (solo los de profile_ids, si se indica) reemplaza al del mismo id y el resto
+        # de la base de datos se conserva. Un tema o idea cuyo id ya es de otro perfil corta la
+        # importación con DumpError. Devuelve cuántos registros de cada tipo se importaron.
+        counts = {"profile": 0, "message": 0, "topic": 0, "idea": 0}
+        # Siguiente seq / posición por perfil y tema importados (los omitidos no están aquí)
+        next_seq, next_topic, next_idea = {}, {}, {}
+        pending = {}
+
+        def flush_ideas():
+            # Los perfiles importados ya se borraron: un id de idea que siga en la base es de otro
+            # perfil, y pisarlo le quitaría la idea. Se rechaza todo (la transacción se deshace)
+            ids = [idea['id'] for ideas in pending.values() for idea in ideas]
+            taken = self._conn.execute(
+                f"SELECT ideas.id, profiles.name FROM ideas JOIN topics ON topics.id = ideas.topic_id "
+                f"JOIN profiles ON profiles.id = topics.profile_id WHERE ideas.id IN ({','.join('?' * len(ids))}) LIMIT 1",
+                ids
+            ).fetchone() if ids else None
+            if taken:
+                raise DumpError(f"La idea {taken[0]} del archivo ya existe en el perfil «{taken[1]}»; no se importó nada.")
+            for topic_id, ideas in pending.items():
+                self._insert_ideas(topic_id, ideas, next_idea[topic_id], replace=False)
+                next_idea[topic_id] += len(ideas)
+            pending.clear()
+
+        with self._lock, self._conn:
+            if replace:
+                for pid in self.list_profiles():
+                    self._delete_profile(pid)
+            for record in records:
+                kind = record['type']
+                if kind == "factory":
+                    if replace:
+                        self._put_setting("current_profile_id", record.get('current_profile_id'))
+                        for key in ("prompts", "routes"):
+                            if record.get(key):
+                                self._put_setting(key, record[key])
+                    continue
+                if kind == "profile":
+                    pid = record['id']
+                    if profile_ids is not None and pid not in profile_ids:
+                        continue
+                    self._delete_profile(pid)
+                    self._conn.execute(
+                        "INSERT INTO profiles (id, name, dna, summary, dna_upto, position) "
+                        "SELECT ?, ?, ?, ?, ?, COALESCE(MAX(position), -1) + 1 FROM profiles",
+                        (
+                            pid,
+                            record['name'],
+                            json.dumps(record['dna']) if record.get('dna') else None,
+                            json.dumps(record['summary']) if record.get('summary') else None,
+                            record.get('dna_upto') or 0
+                        )
+                    )
+                    next_seq[pid] = next_topic[pid] = 0
+                elif kind == "message":
+                    pid = record['profile_id']
+                    if pid not in next_seq:
+                        continue
+                    self._conn.execute(
+                        "INSERT INTO messages (profile_id, seq, role, content) VALUES (?, ?, ?, ?)",
+                        (pid, next_seq[pid], record['role'], record['content'])
+                    )
+                    next_seq[pid] += 1
+                elif kind == "topic":
+                    pid = record['profile_id']
+                    if pid not in next_topic:
+                        continue
+                    owner = self._conn.execute(
+                        "SELECT profiles.name FROM topics JOIN profiles ON profiles.id = topics.profile_id WHERE topics.id = ?",
+                        (record['id'],)
+                    ).fetchone()
+                    if owner:
+                        raise DumpError(f"El tema «{record['name']}» ({record['id']}) ya existe en el perfil «{owner[0]}»; no se importó nada.")
+                    self._conn.execute(
+                        "INSERT INTO topics (id, profile_id, name, position) VALUES (?, ?, ?, ?)",
+                        (record['id'], pid, record['name'], next_topic[pid])
+                    )
+                    next_topic[pid] += 1
+                    next_idea[record['id']] = 0
+                elif kind == "idea":
+                    if record['topic_id'] not in next_idea:
+                        continue
+                    pending.setdefault(record['topic_id'], []).append(record['idea'])
+                    if sum(len(ideas) for ideas in pending.values()) >= RECORD_PAGE_SIZE:
+                        flush_ideas()
+                else:
+                    continue
+                counts[kind] += 1
+            flush_ideas()
+        return counts
@@ -0,0 +1,220 @@
+# Transcripción de audios largos: el archivo se decodifica localmente, se corta en silencios en
+# trozos que se solapan unos segundos, los trozos se transcriben en paralelo con Whisper y el
+# texto se cose en orden quitando las palabras repetidas en el solape. Cada trozo transcrito se
+# guarda en la caché en disco, así que reintentar solo reenvía los que fallaron.
+import hashlib
+import io
+import shutil
+import subprocess
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+
+from dedupe import normalize
+from gateway import default_gateway
+from llm_cache import request_key
+from metrics import STAGE_WHISPER, recorder
+
+WHISPER_MODEL = "whisper-1"
+# Límite de subida de la API de audio
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+# Duración objetivo de cada trozo y ventana (hacia atrás) donde se busca el silencio para cortar
+CHUNK_SECONDS = 120.0
+SILENCE_SEARCH_SECONDS = 20.0
+# Audio compartido entre trozos consecutivos (el texto repetido se elimina al coser)
+OVERLAP_SECONDS = 1.5
+# Ventana de energía para detectar silencios
+FRAME_SECONDS = 0.03
+# Frames que se pasan a float a la vez al medir la energía (~1 minuto de audio a 16 kHz)
+ENERGY_BLOCK_FRAMES = 2000
+# Trozos transcritos a la vez (el gateway sigue aplicando los límites de RPM)
+TRANSCRIBE_WORKERS = 4
+# Frecuencia a la que se remuestrea con ffmpeg (suficiente para voz; 32 KB por segundo)
+DECODE_SAMPLE_RATE = 16000
+# Palabras que se comparan al coser dos trozos
+MAX_OVERLAP_WORDS = 40
+
+
+class TranscriptionError(Exception):
+    # Fallaron algunos trozos; los demás quedaron en caché para el reintento
+    def __init__(self, failed, total, errors):
+        self.failed = failed
+        self.total = total
+        self.errors = errors
+        super().__init__(f"Fallaron {len(failed)} de {total} fragmentos: {errors[0]}")
+
+
+def _pcm_to_mono(frames, sample_width, channels):
+    if sample_width == 1:
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype="<i2")
+    elif sample_width == 3:
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        samples = ((raw[:, 2].astype(np.int8).astype(np.int32) << 8) | raw[:, 1]).astype(np.int16)
+    elif sample_width == 4:
+        samples = (np.frombuffer(frames, dtype="<i4") >> 16).astype(np.int16)
+    else:
+        raise ValueError(f"WAV de {sample_width * 8} bits no soportado")
+    if channels > 1:
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels).mean(axis=1).astype(np.int16)
+    return samples
+
+
+def decode_audio(data, filename):
+    # (muestras int16 mono, frecuencia) o None si no se puede decodificar localmente
+    if filename.lower().endswith(".wav"):
+        try:
+            with wave.open(io.BytesIO(data)) as wav:
+                frames = wav.readframes(wav.getnframes())
+                return _pcm_to_mono(frames, wav.getsampwidth(), wav.getnchannels()), wav.getframerate()
+        except (wave.Error, EOFError, ValueError):
+            pass
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        return None
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-loglevel", "error", "-i", "pipe:0",
+         "-f", "s16le", "-ac", "1", "-ar", str(DECODE_SAMPLE_RATE), "pipe:1"],
+        input=data, capture_output=True
+    )
+    if result.returncode != 0:
+        return None
+    return np.frombuffer(result.stdout, dtype="<i2"), DECODE_SAMPLE_RATE
+
+
+def encode_wav(samples, rate):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def frame_energy(samples, frame):
+    # RMS de cada frame completo, por bloques en float32: nunca se copia la grabación entera a float
+    frames = samples[:len(samples) - len(samples) % frame].reshape(-1, frame)
+    energy = np.empty(len(frames), dtype=np.float32)
+    for begin in range(0, len(frames), ENERGY_BLOCK_FRAMES):
+        block = frames[begin:begin + ENERGY_BLOCK_FRAMES].astype(np.float32)
+        energy[begin:begin + len(block)] = np.sqrt(np.einsum("ij,ij->i", block, block) / frame)
+    return energy
+
+
+def split_points(samples, rate, chunk_seconds=CHUNK_SECONDS, search_seconds=SILENCE_SEARCH_SECONDS):
+    # Muestras donde cortar: el frame más silencioso de la ventana previa a cada objetivo
+    frame = max(1, int(rate * FRAME_SECONDS))
+    energy = frame_energy(samples, frame)
+    chunk_frames = int(chunk_seconds / FRAME_SECONDS)
+    search_frames = min(int(search_seconds / FRAME_SECONDS), chunk_frames // 2)
+    points, start = [], 0
+    while len(energy) - start > chunk_frames:
+        window = energy[start + chunk_frames - search_frames:start + chunk_frames]
+        cut = start + chunk_frames - search_frames + int(window.argmin())
+        points.append(cut * frame)
+        start = cut
+    return points
+
+
+def make_chunks(samples, rate, chunk_seconds=CHUNK_SECONDS, overlap_seconds=OVERLAP_SECONDS):
+    # Lista de (bytes WAV, segundos) en orden; cada trozo empieza overlap_seconds antes del corte
+    overlap = int(overlap_seconds * rate)
+    bounds = [0] + split_points(samples, rate, chunk_seconds) + [len(samples)]
+    chunks = []
+    for begin, end in zip(bounds, bounds[1:]):
+        piece = samples[max(0, begin - overlap):end]
+        chunks.append((encode_wav(piece, rate), len(piece) / rate))
+    return chunks
+
+
+def _words(text):
+    # Palabras comparables: sin mayúsculas, acentos ni signos ("Estás hoy?" == "estas hoy")
+    return [normalize(w) for w in text.split()]
+
+
+def stitch(texts):
+    # Une los textos en orden quitando del inicio de cada uno lo que repite el final del anterior
+    result = []
+    for text in texts:
+        words = text.split()
+        if result and words:
+            tail, head = _words(" ".join(result[-MAX_OVERLAP_WORDS:])), _words(" ".join(words[:MAX_OVERLAP_WORDS]))
+            for size in range(min(len(tail), len(head)), 0, -1):
+                if tail[-size:] == head[:size]:
+                    words = words[size:]
+                    break
+        result.extend(words)
+    return " ".join(result)
+
+
+def chunk_key(audio, model=WHISPER_MODEL):
+    return request_key({"endpoint": "audio.transcriptions", "model": model, "audio": hashlib.sha256(audio).hexdigest()})
+
+
+def transcribe_chunk(client, audio, filename, seconds=None, cache=None, tags=None, model=WHISPER_MODEL):
+    key = chunk_key(audio, model)
+    start = time.perf_counter()
+    if cache is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            recorder.record_call(STAGE_WHISPER, model, time.perf_counter() - start, cached=True, tags=tags)
+            return cached
+    try:
+        # verbose_json trae la duración del audio (para estimar el costo)
+        transcription = default_gateway.transcription(
+            client,
+            model=model,
+            file=(filename, audio),
+            response_format="verbose_json"
+        )
+    except Exception as e:
+        recorder.record_call(STAGE_WHISPER, model, time.perf_counter() - start, error=e, tags=tags)
+        raise
+    recorder.record_call(
+        STAGE_WHISPER, model, time.perf_counter() - start,
+        audio_seconds=getattr(transcription, "duration", None) or seconds or 0.0, tags=tags
+    )
+    text = transcription.text.strip()
+    if cache is not None:
+        cache.put(key, text)
+    return text
+
+
+def transcribe_audio(client, data, filename, cache=None, tags=None, on_progress=None, workers=TRANSCRIBE_WORKERS):
+    # Texto completo del audio. on_progress(hechos, total) se llama desde el hilo que invoca,
+    # así que puede actualizar la interfaz. Si falla algún trozo se lanza TranscriptionError
+    # después de terminar (y cachear) los demás.
+    decoded = decode_audio(data, filename)
+    if decoded is None:
+        # Sin decodificador local (mp3/m4a sin ffmpeg): un solo envío con el nombre original
+        # para que la API reconozca el formato, si cabe en el límite
+        if len(data) > MAX_UPLOAD_BYTES:
+            raise ValueError("El archivo supera 25 MB y no se puede dividir sin ffmpeg; conviértelo a WAV o instala ffmpeg.")
+        chunks = [(filename, data, None)]
+    else:
+        chunks = [(f"fragmento_{k:03d}.wav", audio, seconds) for k, (audio, seconds) in enumerate(make_chunks(*decoded))]
+    texts = [None] * len(chunks)
+    errors = {}
+    if on_progress:
+        on_progress(0, len(chunks))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(transcribe_chunk, client, audio, name, seconds, cache, tags): k
+            for k, (name, audio, seconds) in enumerate(chunks)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            k = futures[future]
+            try:
+                texts[k] = future.result()
+            except Exception as e:
+                errors[k] = e
+            if on_progress:
+                on_progress(done, len(chunks))
+    if errors:
+        failed = sorted(errors)
+        raise TranscriptionError(failed, len(chunks), [errors[k] for k in failed])
+    return stitch(texts)